@@ -0,0 +1,297 @@
+# Python imports
+from typing import Dict, Iterable, Iterator, Set, Union
+
+# Third-party imports
+from bitarray import bitarray
+from bitarray.util import zeros
+
+"""Containers hold the lower 16 bits of the integers that share their upper bits. Sparse containers are sets, dense
+containers are bitarrays with one bit per possible value."""
+Container = Union[Set[int], bitarray]
+
+CONTAINER_SIZE = 1 << 16
+# Containers with more values than this are stored as bitarrays, which then take less memory than sets. Bitarrays are
+# only converted back once they are half as full, so repeatedly adding and removing a value does not convert every time.
+DENSE_THRESHOLD = 4096
+SPARSE_THRESHOLD = DENSE_THRESHOLD // 2
+
+_ONE = bitarray('1')
+
+
+class Bitmap(object):
+    """A compressed set of integers, such as document identifiers, in the style of Roaring bitmaps.
+
+    Integers are partitioned by their upper bits into chunks of 2^16 values. Every chunk is stored in a container that
+    is either a set of values, if the chunk is sparse, or a bitarray, if the chunk is dense. Unions, differences and
+    intersections of dense chunks are bitwise operations on bitarrays, so they take time linear in the number of
+    chunks rather than in the number of values. Iteration yields the integers in ascending order.
+    """
+
+    def __init__(
+            self,
+            values: Iterable[int] = (),
+    ) -> None:
+        """Initializes a bitmap.
+
+        :param values: The initial integers in the bitmap
+        :type values: Iterable[int]
+        :returns: None
+        :rtype: None
+        """
+        self.containers: Dict[int, Container] = {}
+        self.update(values)
+
+    def add(
+            self,
+            value: int,
+    ) -> None:
+        """Adds an integer to the bitmap.
+
+        :param value: The integer to add
+        :type value: int
+        :returns: None
+        :rtype: None
+        """
+        (high, low) = (value >> 16, value & 0xFFFF)
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = {low}
+        elif isinstance(container, bitarray):
+            container[low] = 1
+        else:
+            container.add(low)
+            if len(container) > DENSE_THRESHOLD:
+                self.containers[high] = _to_dense(container)
+
+    def update(
+            self,
+            values: Iterable[int],
+    ) -> None:
+        """Adds several integers to the bitmap.
+
+        :param values: The integers to add
+        :type values: Iterable[int]
+        :returns: None
+        :rtype: None
+        """
+        for value in values:
+            self.add(value)
+
+    def discard(
+            self,
+            value: int,
+    ) -> None:
+        """Removes an integer from the bitmap, if it is present.
+
+        :param value: The integer to remove
+        :type value: int
+        :returns: None
+        :rtype: None
+        """
+        (high, low) = (value >> 16, value & 0xFFFF)
+        container = self.containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, bitarray):
+            container[low] = 0
+        else:
+            container.discard(low)
+        self._normalize(high)
+
+    def union(
+            self,
+            *others: 'Bitmap',
+    ) -> 'Bitmap':
+        """Computes the union of this bitmap and other bitmaps.
+
+        :param others: The other bitmaps
+        :type others: Bitmap
+        :returns: A new bitmap containing the integers that are in any of the bitmaps
+        :rtype: Bitmap
+        """
+        result = self.copy()
+        for other in others:
+            for high, container in other.containers.items():
+                own = result.containers.get(high)
+                if own is None:
+                    result.containers[high] = container.copy()
+                elif isinstance(own, bitarray):
+                    result.containers[high] = own | _to_dense(container)
+                elif isinstance(container, bitarray):
+                    result.containers[high] = container | _to_dense(own)
+                else:
+                    result.containers[high] = own | container
+                result._normalize(high)
+        return result
+
+    def difference(
+            self,
+            *others: 'Bitmap',
+    ) -> 'Bitmap':
+        """Computes the difference of this bitmap and other bitmaps.
+
+        :param others: The other bitmaps
+        :type others: Bitmap
+        :returns: A new bitmap containing the integers that are in this bitmap, but in none of the other bitmaps
+        :rtype: Bitmap
+        """
+        result = self.copy()
+        for other in others:
+            for high, container in other.containers.items():
+                own = result.containers.get(high)
+                if own is None:
+                    continue
+                if isinstance(own, bitarray):
+                    result.containers[high] = own & ~_to_dense(container)
+                elif isinstance(container, bitarray):
+                    result.containers[high] = {low for low in own if not container[low]}
+                else:
+                    result.containers[high] = own - container
+                result._normalize(high)
+        return result
+
+    def intersection(
+            self,
+            *others: 'Bitmap',
+    ) -> 'Bitmap':
+        """Computes the intersection of this bitmap and other bitmaps.
+
+        :param others: The other bitmaps
+        :type others: Bitmap
+        :returns: A new bitmap containing the integers that are in all of the bitmaps
+        :rtype: Bitmap
+        """
+        result = self.copy()
+        for other in others:
+            for high in list(result.containers):
+                own = result.containers[high]
+                container = other.containers.get(high)
+                if container is None:
+                    del result.containers[high]
+                    continue
+                if isinstance(own, bitarray) and isinstance(container, bitarray):
+                    result.containers[high] = own & container
+                elif isinstance(own, bitarray):
+                    result.containers[high] = {low for low in container if own[low]}
+                elif isinstance(container, bitarray):
+                    result.containers[high] = {low for low in own if container[low]}
+                else:
+                    result.containers[high] = own & container
+                result._normalize(high)
+        return result
+
+    def copy(
+            self,
+    ) -> 'Bitmap':
+        """Copies the bitmap.
+
+        :returns: A new bitmap containing the same integers
+        :rtype: Bitmap
+        """
+        result = Bitmap()
+        result.containers = {high: container.copy() for high, container in self.containers.items()}
+        return result
+
+    def __contains__(
+            self,
+            value: int,
+    ) -> bool:
+        """Checks whether an integer is in the bitmap.
+
+        :param value: The integer
+        :type value: int
+        :returns: Whether the integer is in the bitmap
+        :rtype: bool
+        """
+        container = self.containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        return bool(container[low]) if isinstance(container, bitarray) else low in container
+
+    def __len__(
+            self,
+    ) -> int:
+        """Counts the integers in the bitmap.
+
+        :returns: The number of integers in the bitmap
+        :rtype: int
+        """
+        return sum(container.count() if isinstance(container, bitarray) else len(container)
+                   for container in self.containers.values())
+
+    def __iter__(
+            self,
+    ) -> Iterator[int]:
+        """Iterates over the integers in the bitmap in ascending order.
+
+        :returns: An iterator over the integers
+        :rtype: Iterator[int]
+        """
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            base = high << 16
+            lows = container.search(_ONE) if isinstance(container, bitarray) else sorted(container)
+            for low in lows:
+                yield base | low
+
+    def __eq__(
+            self,
+            other: object,
+    ) -> bool:
+        """Comparison method.
+
+        :param other: The bitmap to compare this bitmap to
+        :type other: object
+        :returns: Whether both bitmaps contain the same integers
+        :rtype: bool
+        """
+        return isinstance(other, Bitmap) and len(self) == len(other) and all(value in other for value in self)
+
+    def __repr__(
+            self,
+    ) -> str:
+        """Represents the bitmap as a string.
+
+        :returns: A string listing the integers in the bitmap
+        :rtype: str
+        """
+        return 'Bitmap({0})'.format(list(self))
+
+    def _normalize(
+            self,
+            high: int,
+    ) -> None:
+        """Stores a container in its most compact form, removing it if it is empty.
+
+        :param high: The upper bits of the integers in the container
+        :type high: int
+        :returns: None
+        :rtype: None
+        """
+        container = self.containers[high]
+        size = container.count() if isinstance(container, bitarray) else len(container)
+        if size == 0:
+            del self.containers[high]
+        elif isinstance(container, bitarray) and size <= SPARSE_THRESHOLD:
+            self.containers[high] = set(container.search(_ONE))
+        elif not isinstance(container, bitarray) and size > DENSE_THRESHOLD:
+            self.containers[high] = _to_dense(container)
+
+
+def _to_dense(
+        container: Container,
+) -> bitarray:
+    """Converts a container to a bitarray.
+
+    :param container: The container
+    :type container: Container
+    :returns: A bitarray with a bit set for every value in the container. A bitarray container is returned as is.
+    :rtype: bitarray
+    """
+    if isinstance(container, bitarray):
+        return container
+    dense = zeros(CONTAINER_SIZE)
+    for low in container:
+        dense[low] = 1
+    return dense
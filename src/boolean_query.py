@@ -0,0 +1,97 @@
+# Python imports
+from typing import Any, List, NamedTuple, Tuple
+
+# Project imports
+from src.bitmap import Bitmap
+
+"""Boolean queries combine patterns with the AND, OR and NOT operators, for example 'foo* AND NOT *bar OR baz'.
+They are interpreted in disjunctive normal form: AND binds stronger than OR, NOT negates a single pattern and
+parentheses are not supported. Every clause of ANDed patterns must contain at least one pattern that is not negated,
+as negations are evaluated against the documents matching the other patterns of the clause.
+The patterns are matched through Bloom filters, so a negated pattern can also match documents that do not contain it.
+These documents are then dropped, and a query with NOT may miss true matches. The Libertas client removes the false
+positives when it is given the query (see LibertasClient.dec_search).
+"""
+
+"""Type declaration for the clauses of a boolean query. Every clause is a list of (negated, pattern index) pairs."""
+Clauses = List[List[Tuple[bool, int]]]
+
+AND = ' AND '
+OR = ' OR '
+NOT = 'NOT '
+
+
+class BooleanSrchToken(NamedTuple):
+    """A search token for a boolean query, consisting of its clauses and one search token per distinct pattern."""
+    clauses: Clauses
+    tokens: List[Any]
+
+
+class BooleanSearchResult(NamedTuple):
+    """The encrypted results of a boolean query, consisting of its clauses and the results of every distinct
+    pattern."""
+    clauses: Clauses
+    results: List[List[int]]
+
+
+def is_boolean_query(
+        q: str,
+) -> bool:
+    """Checks whether a query uses boolean operators.
+
+    :param q: The query
+    :type q: str
+    :returns: Whether the query contains an AND, OR or NOT operator
+    :rtype: bool
+    """
+    return AND in q or OR in q or q.startswith(NOT)
+
+
+def parse_boolean_query(
+        q: str,
+) -> Tuple[Clauses, List[str]]:
+    """Parses a boolean query into clauses of ANDed, possibly negated, patterns.
+
+    :param q: The query, for example 'foo* AND NOT *bar OR baz'
+    :type q: str
+    :returns: The clauses, which refer to patterns by their index, and the distinct patterns
+    :rtype: Tuple[Clauses, List[str]]
+    """
+    patterns: List[str] = []
+    clauses: Clauses = []
+    for clause_string in q.split(OR):
+        clause = []
+        for term in clause_string.split(AND):
+            negated = term.startswith(NOT)
+            pattern = term[len(NOT):] if negated else term
+            if pattern == '' or pattern.startswith(NOT):
+                raise ValueError('Invalid boolean query \'{0}\''.format(q))
+            if pattern not in patterns:
+                patterns.append(pattern)
+            clause.append((negated, patterns.index(pattern)))
+        if all(negated for (negated, _) in clause):
+            raise ValueError('Every clause of boolean query \'{0}\' must contain a pattern without NOT'.format(q))
+        clauses.append(clause)
+    return clauses, patterns
+
+
+def evaluate_clauses(
+        clauses: Clauses,
+        documents: List[List[int]],
+) -> List[int]:
+    """Determines the documents that satisfy a boolean query, given the documents matching each pattern.
+
+    :param clauses: The clauses of the boolean query
+    :type clauses: Clauses
+    :param documents: The document identifiers matching each pattern
+    :type documents: List[List[int]]
+    :returns: The identifiers of the documents satisfying at least one clause, in ascending order
+    :rtype: List[int]
+    """
+    bitmaps = [Bitmap(pattern_documents) for pattern_documents in documents]
+    results = Bitmap()
+    for clause in clauses:
+        positive = [bitmaps[i] for (negated, i) in clause if not negated]
+        negative = [bitmaps[i] for (negated, i) in clause if negated]
+        results = results.union(positive[0].intersection(*positive[1:]).difference(*negative))
+    return list(results)
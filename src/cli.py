@@ -120,7 +120,8 @@ class CLI(object):
         print('    {0} {{document id}} {{keyword}}    Delete a document-keyword pair from the database'
               .format(self.delete))
         print('    {0} {{query}}                    Search the database. Use \'_\' to indicate any single character \
-and \'*\' to indicate 0 or more characters'.format(self.search))
+and \'*\' to indicate 0 or more characters. Combine patterns with AND, OR and NOT, e.g. \'foo* AND NOT *bar\''
+              .format(self.search))
         print('    {0}                          Reselect SSE scheme'.format(self.reselect))
         print('    {0}                              Reprint this information'.format(self.help))
         print('    {0}                              Quit the CLI'.format(self.quit))
@@ -217,7 +218,9 @@ and \'*\' to indicate 0 or more characters'.format(self.search))
                 ind = int(input_parts[1])
                 w = input_parts[2]
                 add_token = self.client.add_token(ind, w)
-                self.server.add(add_token)
+                # The client returns no token for an update that its pair tracker knows is redundant
+                if add_token is not None:
+                    self.server.add(add_token)
             except ValueError:
                 print('Invalid document id. Expected an integer, received \'' + input_parts[1] + '\'.')
 
@@ -241,7 +244,8 @@ and \'*\' to indicate 0 or more characters'.format(self.search))
                 ind = int(input_parts[1])
                 w = input_parts[2]
                 del_token = self.client.del_token(ind, w)
-                self.server.delete(del_token)
+                if del_token is not None:
+                    self.server.delete(del_token)
             except ValueError:
                 print('Invalid document id. Expected an integer, received \'' + input_parts[1] + '\'.')
 
@@ -257,22 +261,27 @@ and \'*\' to indicate 0 or more characters'.format(self.search))
         :returns: None
         :rtype: None
         """
-        if len(input_parts) != 2:
-            print('Invalid number of parameters. Expected 1, but received ' + str(len(input_parts) - 1) + '.')
+        if len(input_parts) < 2:
+            print('Invalid number of parameters. Expected at least 1, but received 0.')
             print('Format: \'{0} {{query}}'.format(self.search) + '\'.')
-        else:
-            q = input_parts[1]
-            srch_token = self.client.srch_token(q)
+            return
 
-            if self.scheme == CliSchemeOption.ZHAO_AND_NISHIDE:
-                results = self.server.search(srch_token)
-            elif self.scheme == CliSchemeOption.LIBERTAS:
-                encrypted_results = self.server.search(srch_token)
-                results = self.client.dec_search(encrypted_results)
-            else:
-                results = []
+        q = ' '.join(input_parts[1:])
+        try:
+            srch_token = self.client.srch_token(q)
+        except ValueError as e:
+            print(str(e) + '.')
+            return
+
+        if self.scheme == CliSchemeOption.ZHAO_AND_NISHIDE:
+            results = self.server.search(srch_token)
+        elif self.scheme == CliSchemeOption.LIBERTAS:
+            encrypted_results = self.server.search(srch_token)
+            results = self.client.dec_search(encrypted_results, q)
+        else:
+            results = []
 
-            if len(results) == 0:
-                print('There are no matching documents.')
-            else:
-                print('Matching document ids: ' + ''.join(list(map(lambda i: str(i) + ', ', results)))[:-2] + '.')
+        if len(results) == 0:
+            print('There are no matching documents.')
+        else:
+            print('Matching document ids: ' + ''.join(list(map(lambda i: str(i) + ', ', results)))[:-2] + '.')
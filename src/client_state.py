@@ -0,0 +1,76 @@
+# Python imports
+import json
+import os
+import struct
+from typing import Dict
+
+# Project imports
+from src.crypto import decrypt_bytes, derive_key, encrypt_bytes
+
+"""A state file starts with a header holding a magic number, the format version and the salt of the key derived from
+the passphrase. The header is followed by the encrypted JSON encoding of the state, which is authenticated together
+with the header."""
+HEADER = struct.Struct('>4sH16s')
+MAGIC = b'CLST'
+VERSION = 1
+
+
+def save_state(
+        path: str,
+        state: Dict,
+        passphrase: str,
+) -> None:
+    """Encrypts the state of a client under a key derived from a passphrase and writes it to a file. The state is
+    written to a temporary file first, which then replaces the file at the path.
+
+    :param path: The path of the state file
+    :type path: str
+    :param state: The state, a dictionary that can be encoded as JSON
+    :type state: Dict
+    :param passphrase: The passphrase to derive the encryption key from
+    :type passphrase: str
+    :returns: None
+    :rtype: None
+    """
+    header = HEADER.pack(MAGIC, VERSION, os.urandom(16))
+    key = derive_key(passphrase, header[-16:])
+    cipher_text = encrypt_bytes(key, json.dumps(state, separators=(',', ':')).encode('utf-8'), header)
+
+    temporary_path = path + '.tmp'
+    # The state holds the keys of the client, so only the owner may read it
+    fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(header + cipher_text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_state(
+        path: str,
+        passphrase: str,
+) -> Dict:
+    """Reads and decrypts the state of a client written by save_state().
+
+    :param path: The path of the state file
+    :type path: str
+    :param passphrase: The passphrase the state was encrypted with
+    :type passphrase: str
+    :returns: The state
+    :rtype: Dict
+    :raises ValueError: If the file is not a state file, the passphrase is wrong or the file has been modified
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError('{0} is not a client state file'.format(path))
+    (magic, version, salt) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('{0} is not a client state file'.format(path))
+    if version != VERSION:
+        raise ValueError('Unsupported client state version {0}'.format(version))
+    try:
+        plain_text = decrypt_bytes(derive_key(passphrase, salt), data[HEADER.size:], data[:HEADER.size])
+    except ValueError:
+        raise ValueError('Wrong passphrase, or the client state has been modified') from None
+    return json.loads(plain_text.decode('utf-8'))
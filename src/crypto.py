@@ -112,6 +112,67 @@ def decrypt(
     return _unpad(plain_text)
 
 
+def derive_key(
+        passphrase: str,
+        salt: bytes,
+) -> bytes:
+    """Derives a 256-bit key from a passphrase using scrypt.
+
+    :param passphrase: The passphrase
+    :type passphrase: str
+    :param salt: A random salt, stored along with the data encrypted under the key
+    :type salt: bytes
+    :returns: The derived key
+    :rtype: bytes
+    """
+    return hashlib.scrypt(passphrase.encode('utf-8'), salt=salt, n=2 ** 14, r=8, p=1, dklen=32)
+
+
+def encrypt_bytes(
+        key: bytes,
+        plain_text: bytes,
+        associated_data: bytes = b'',
+) -> bytes:
+    """Encrypts and authenticates data using AES in GCM mode.
+
+    :param key: The encryption key
+    :type key: bytes
+    :param plain_text: The data to encrypt
+    :type plain_text: bytes
+    :param associated_data: Data that is authenticated, but not encrypted
+    :type associated_data: bytes
+    :returns: The nonce, the encryption of the data and the authentication tag
+    :rtype: bytes
+    """
+    nonce = os.urandom(12)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(associated_data)
+    (cipher_text, tag) = cipher.encrypt_and_digest(plain_text)
+    return nonce + cipher_text + tag
+
+
+def decrypt_bytes(
+        key: bytes,
+        cipher_text: bytes,
+        associated_data: bytes = b'',
+) -> bytes:
+    """Decrypts and verifies data encrypted by encrypt_bytes().
+
+    :param key: The decryption key
+    :type key: bytes
+    :param cipher_text: The nonce, the encrypted data and the authentication tag
+    :type cipher_text: bytes
+    :param associated_data: The data that was authenticated along with the encrypted data
+    :type associated_data: bytes
+    :returns: The decrypted data
+    :rtype: bytes
+    :raises ValueError: If the key is wrong or the data has been modified
+    """
+    cipher = AES.new(key, AES.MODE_GCM, nonce=cipher_text[:12])
+    cipher.update(associated_data)
+    return cipher.decrypt_and_verify(cipher_text[12:-16], cipher_text[-16:])
+
+
 def _pad(
         s: str,
         bs: int,
@@ -42,7 +42,8 @@ class DeletionExperiment:
                     del_token = client_zn.del_token(ind, w)
                     server_zn.delete(del_token)
                     del_token = client_lib.del_token(ind, w)
-                    server_lib.delete(del_token)
+                    if del_token is not None:
+                        server_lib.delete(del_token)
 
                 for query in queries:
                     search_times_zn_queries.append(measure_zn(client_zn, server_zn, query))
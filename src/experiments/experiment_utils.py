@@ -63,7 +63,9 @@ def prepare_schemes(
         server_zn.add(add_token)
 
         add_token = client_lib.add_token(ind, w)
-        server_lib.add(add_token)
+        # The client returns no token for an update that its pair tracker knows is redundant
+        if add_token is not None:
+            server_lib.add(add_token)
 
     return client_zn, server_zn, client_lib, server_lib
 
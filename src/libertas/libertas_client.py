@@ -1,36 +1,128 @@
 # Python imports
-import math
+import hashlib
 import os
-from typing import Dict, List
+import re
+import struct
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 # Project imports
-from src.crypto import decrypt, encrypt
+from src.bitmap import Bitmap
+from src.boolean_query import BooleanSearchResult, evaluate_clauses, is_boolean_query, parse_boolean_query
+from src.client_state import load_state, save_state
+from src.crypto import decrypt_bytes, encrypt_bytes
+from src.libertas.pair_tracker import PairTracker
 from src.sigma_interface.sigma_client import SigmaClient
-from src.utils import Update, Op, AddToken, SrchToken
+from src.utils import Update, Op, AddToken, ConsolidationToken, SrchToken
 from src.zhao_nishide.zn_client import ZNClient
 
+"""An encoded update starts with a header holding the timestamp, the operation, the document identifier and the length
+of the UTF-8 encoded keyword, which follows the header. The update may be padded with zero bytes."""
+UPDATE_HEADER = struct.Struct('>QBqH')
+
+"""The approximate number of bytes an entry of the decrypted update cache takes besides its key and update, for the
+node of the ordered dictionary that holds it."""
+CACHE_ENTRY_OVERHEAD = 100
+
 
 class LibertasClient(object):
     """Libertas client implementation.
 
     Libertas uses a wildcard supporting SSE scheme internally. In addition to the security guarantees and functionality
     provided by the underlying scheme, Libertas provides Update Pattern Revealing Backward Privacy.
+
+    The key and timestamp counter of the client, together with the state of the underlying client, can be saved to a
+    file encrypted under a passphrase (see save and load). The state must be saved after the last update, as reusing
+    timestamps would make dec_search order updates of the same pair incorrectly.
+
+    Updates are encoded as fixed-width binary records, which are encrypted with AES-GCM. The length of an encrypted
+    update reveals the length of its keyword, unless size classes are configured: updates are then padded to the
+    smallest size class they fit in, or to a multiple of the largest size class.
+
+    Large search results can be decrypted by a pool of worker processes, which receive the key once when they start.
+    Every worker reduces a chunk of the results to the last operation per document-keyword pair, and these partial
+    results are merged by timestamp. The pool is kept between searches until close() is called.
+
+    Decrypted updates can be cached, keyed by a digest of their encryption, so repeated and overlapping queries only
+    decrypt updates that have not been seen before. The cache is bounded by an estimate of the memory its entries take,
+    and evicts the least recently used updates first.
+
+    As deletes are added to the index as updates, the index grows with every update. After a search, the client can
+    consolidate the results (see consolidate): the updates of pairs matching the query are replaced by a freshly
+    encrypted add update for every pair that is still present, so the index size follows the live pairs.
+
+    Updates can also be buffered on the client (see buffer_add and buffer_delete), and are then only turned into tokens
+    when the buffer is flushed. Only the last buffered operation on a pair is flushed, so repeated operations and an add
+    followed by a delete of the same pair cost a single index entry. Buffered updates are not visible to searches until
+    the tokens of the flush have been sent to the server. An update created directly by add_token or del_token
+    supersedes the buffered update of its pair, which is then dropped. The buffer has no timer: the caller must flush
+    it when it stops buffering updates, as buffer_max_age is only checked when an update is buffered.
+
+    A pair tracker (see pair_tracker) lets the client skip adds of pairs that are certainly present and deletes of pairs
+    that are certainly absent: add_token and del_token then return None, and flushes leave these updates out. The
+    tracker assumes that every token it lets through reaches the server.
     """
 
     def __init__(
             self,
             sigma: SigmaClient[AddToken, SrchToken],
+            size_classes: Optional[Sequence[int]] = None,
+            decryption_workers: Optional[int] = None,
+            parallel_threshold: int = 10000,
+            cache_size: Optional[int] = None,
+            buffer_size: Optional[int] = None,
+            buffer_max_age: Optional[float] = None,
+            pair_tracker: Optional[PairTracker] = None,
     ) -> None:
         """Initializes a Libertas client, setting the underlying client scheme that is used.
 
         :param sigma: The underlying SSE scheme used by this Libertas instance
         :type sigma: ZNClient
+        :param size_classes: The sizes to pad encoded updates to (bytes), or None to not pad updates
+        :type size_classes: Optional[Sequence[int]]
+        :param decryption_workers: The number of processes that decrypt large search results, or None to decrypt all
+        results in the calling thread
+        :type decryption_workers: Optional[int]
+        :param parallel_threshold: The minimum number of encrypted updates for which results are decrypted in parallel
+        :type parallel_threshold: int
+        :param cache_size: The maximum memory used to cache decrypted updates (bytes), or None to not cache updates
+        :type cache_size: Optional[int]
+        :param buffer_size: The number of buffered pairs after which the buffer is flushed, or None to not buffer
+        updates
+        :type buffer_size: Optional[int]
+        :param buffer_max_age: The age of the oldest buffered update after which the buffer is flushed on the next
+        buffered update (seconds), or None to only flush full buffers. The age is not checked in between, so the
+        caller must call flush() once no more updates are buffered.
+        :type buffer_max_age: Optional[float]
+        :param pair_tracker: The tracker of present pairs used to skip redundant updates, or None to send every update
+        :type pair_tracker: Optional[PairTracker]
         :returns: None
         :rtype: None
         """
+        if size_classes is not None and (len(size_classes) == 0 or min(size_classes) < 1):
+            raise ValueError('Size classes must be positive')
+        if buffer_size is not None and buffer_size < 1:
+            raise ValueError('The buffer size must be at least 1')
+        if decryption_workers is not None and decryption_workers < 1:
+            raise ValueError('The number of decryption workers must be at least 1')
         self.sigma: SigmaClient = sigma
+        self.size_classes = None if size_classes is None else sorted(size_classes)
+        self.decryption_workers = decryption_workers
+        self.parallel_threshold = parallel_threshold
+        self.cache_size = cache_size
+        self.buffer_size = buffer_size
+        self.buffer_max_age = buffer_max_age
+        self.pair_tracker = pair_tracker
         self.k = None
         self.t = None
+        self._decryption_pool: Optional[ProcessPoolExecutor] = None
+        self._update_cache: Dict[bytes, Tuple[Update, int]] = OrderedDict()
+        self.cache_usage = 0
+        self._buffer: Dict[Tuple[str, int], Op] = {}
+        self._buffered_since = 0.
 
     def setup(
             self,
@@ -45,10 +137,111 @@ class LibertasClient(object):
         :returns: None
         :rtype: None
         """
+        self.close()
+        self.clear_cache()
+        self._buffer = {}
+        if self.pair_tracker is not None:
+            self.pair_tracker.clear()
         self.sigma.setup(security_parameter[1])
         self.k = os.urandom(security_parameter[0] // 8)
         self.t = 0
 
+    def close(
+            self,
+    ) -> None:
+        """Stops the worker processes that decrypt search results, if they have been started.
+
+        :returns: None
+        :rtype: None
+        """
+        if self._decryption_pool is not None:
+            self._decryption_pool.shutdown()
+            self._decryption_pool = None
+
+    def clear_cache(
+            self,
+    ) -> None:
+        """Removes all decrypted updates from the cache.
+
+        :returns: None
+        :rtype: None
+        """
+        self._update_cache.clear()
+        self.cache_usage = 0
+
+    def export_state(
+            self,
+    ) -> Dict:
+        """Exports the key, timestamp counter and size classes of the client, the state of its pair tracker and the
+        state of the underlying client.
+
+        :returns: The state of the client, a dictionary that can be encoded as JSON
+        :rtype: Dict
+        :raises ValueError: If updates are buffered, as these are not part of the state
+        """
+        if len(self._buffer) > 0:
+            raise ValueError('The buffer must be flushed before the state is exported')
+        state = {'k': self.k.hex(), 't': self.t, 'size_classes': self.size_classes, 'sigma': self.sigma.export_state()}
+        if self.pair_tracker is not None:
+            state['pair_tracker'] = self.pair_tracker.export_state()
+        return state
+
+    def import_state(
+            self,
+            state: Dict,
+    ) -> None:
+        """Restores the state of a client exported by export_state().
+
+        :param state: The state of a client
+        :type state: Dict
+        :returns: None
+        :rtype: None
+        """
+        self.close()
+        self.clear_cache()
+        self._buffer = {}
+        self.sigma.import_state(state['sigma'])
+        self.k = bytes.fromhex(state['k'])
+        self.t = state['t']
+        self.size_classes = state['size_classes']
+        if self.pair_tracker is not None:
+            if 'pair_tracker' in state:
+                self.pair_tracker.import_state(state['pair_tracker'])
+            else:
+                raise ValueError('The state does not contain the pairs of a pair tracker')
+
+    def save(
+            self,
+            path: str,
+            passphrase: str,
+    ) -> None:
+        """Writes the state of the client to a file, encrypted under a key derived from a passphrase.
+
+        :param path: The path of the state file
+        :type path: str
+        :param passphrase: The passphrase to encrypt the state with
+        :type passphrase: str
+        :returns: None
+        :rtype: None
+        """
+        save_state(path, self.export_state(), passphrase)
+
+    def load(
+            self,
+            path: str,
+            passphrase: str,
+    ) -> None:
+        """Restores the state of the client from a file written by save(), instead of calling setup().
+
+        :param path: The path of the state file
+        :type path: str
+        :param passphrase: The passphrase the state was encrypted with
+        :type passphrase: str
+        :returns: None
+        :rtype: None
+        """
+        self.import_state(load_state(path, passphrase))
+
     def srch_token(
             self,
             q: str,
@@ -66,76 +259,337 @@ class LibertasClient(object):
             self,
             ind: int,
             w: str,
-    ) -> AddToken:
+    ) -> Optional[AddToken]:
         """Creates an add token for a document-keyword pair, to be send to the server.
 
         :param ind: The document identifier of the document in the document-keyword pair that is to be added
         :type ind: int
         :param w: The keyword in the document-keyword pair that is to be added
         :type w: str
-        :returns: the add token
-        :rtype: AddToken
+        :returns: the add token, or None if the pair tracker knows the pair is present
+        :rtype: Optional[AddToken]
         """
-        self.t = self.t + 1
-        content = self._encrypt_update(self.t, Op.ADD, ind, w)
-        return self.sigma.add_token(content, w)
+        # A buffered update of the pair would be flushed with a later timestamp, overriding this update
+        self._buffer.pop((w, ind), None)
+        return self._update_token(Op.ADD, ind, w)
 
     def del_token(
             self,
             ind: int,
             w: str,
-    ) -> AddToken:
+    ) -> Optional[AddToken]:
         """Creates a delete token for a document-keyword pair, to be send to the server.
 
         :param ind: The document identifier of the document in the document-keyword pair that is to be deleted
         :type ind: int
         :param w: The keyword in the document-keyword pair that is to be deleted
         :type w: str
-        :returns: the delete token
-        :rtype: AddToken
+        :returns: the delete token, or None if the pair tracker knows the pair is absent
+        :rtype: Optional[AddToken]
+        """
+        # A buffered update of the pair would be flushed with a later timestamp, overriding this update
+        self._buffer.pop((w, ind), None)
+        return self._update_token(Op.DEL, ind, w)
+
+    def _update_token(
+            self,
+            op: Op,
+            ind: int,
+            w: str,
+    ) -> Optional[AddToken]:
+        """Creates the token of an update with the next timestamp, unless the pair tracker knows the update is
+        redundant.
+
+        :param op: The operation
+        :type op: Op
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: The token, or None if the update is redundant
+        :rtype: Optional[AddToken]
         """
+        if self.pair_tracker is not None:
+            if op == Op.ADD:
+                if self.pair_tracker.is_live(ind, w):
+                    return None
+                self.pair_tracker.add(ind, w)
+            else:
+                if not self.pair_tracker.may_be_live(ind, w):
+                    return None
+                self.pair_tracker.discard(ind, w)
         self.t = self.t + 1
-        content = self._encrypt_update(self.t, Op.DEL, ind, w)
+        content = self._encrypt_update(self.t, op, ind, w)
         return self.sigma.add_token(content, w)
 
+    def buffer_add(
+            self,
+            ind: int,
+            w: str,
+    ) -> List[AddToken]:
+        """Buffers the addition of a document-keyword pair, flushing the buffer if it is full or too old.
+
+        :param ind: The document identifier of the document in the document-keyword pair that is to be added
+        :type ind: int
+        :param w: The keyword in the document-keyword pair that is to be added
+        :type w: str
+        :returns: The tokens of the flushed updates, to be send to the server in order, or an empty list if the buffer
+        was not flushed
+        :rtype: List[AddToken]
+        """
+        return self._buffer_update(Op.ADD, ind, w)
+
+    def buffer_delete(
+            self,
+            ind: int,
+            w: str,
+    ) -> List[AddToken]:
+        """Buffers the deletion of a document-keyword pair, flushing the buffer if it is full or too old.
+
+        :param ind: The document identifier of the document in the document-keyword pair that is to be deleted
+        :type ind: int
+        :param w: The keyword in the document-keyword pair that is to be deleted
+        :type w: str
+        :returns: The tokens of the flushed updates, to be send to the server in order, or an empty list if the buffer
+        was not flushed
+        :rtype: List[AddToken]
+        """
+        return self._buffer_update(Op.DEL, ind, w)
+
+    def flush(
+            self,
+    ) -> List[AddToken]:
+        """Creates the add and delete tokens of all buffered updates and empties the buffer.
+
+        :returns: The tokens of the buffered updates, to be send to the server in order
+        :rtype: List[AddToken]
+        """
+        (buffer, self._buffer) = (self._buffer, {})
+        tokens = [self._update_token(op, ind, w) for (w, ind), op in buffer.items()]
+        return [token for token in tokens if token is not None]
+
+    def _buffer_update(
+            self,
+            op: Op,
+            ind: int,
+            w: str,
+    ) -> List[AddToken]:
+        """Buffers an update, replacing the buffered update of the same pair, and flushes the buffer if it holds
+        buffer_size pairs or its oldest update is buffer_max_age seconds old.
+
+        :param op: The operation
+        :type op: Op
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: The tokens of the flushed updates, or an empty list if the buffer was not flushed
+        :rtype: List[AddToken]
+        """
+        if self.buffer_size is None:
+            raise ValueError('Updates can only be buffered if a buffer size is set')
+        now = time.monotonic()
+        if len(self._buffer) == 0:
+            self._buffered_since = now
+        # Only the last operation determines whether the pair is present after the flush
+        self._buffer.pop((w, ind), None)
+        self._buffer[(w, ind)] = op
+        if len(self._buffer) >= self.buffer_size or (self.buffer_max_age is not None
+                                                     and now - self._buffered_since >= self.buffer_max_age):
+            return self.flush()
+        return []
+
     def dec_search(
             self,
-            r_star: List[int],
+            r_star: Union[List[bytes], BooleanSearchResult],
+            q: Optional[str] = None,
     ) -> List[int]:
         """Decrypts encrypted updates received from the server and determines which document identifiers are still
         relevant for the query. Document identifiers are relevant when there is a keyword-document pair that is
-        added, but not deleted afterwards.
+        added, but not deleted afterwards. For a boolean query, the relevant documents are determined per pattern and
+        then combined according to the clauses of the query.
+        If the query is given, updates of keywords that do not match it are false positives of the Bloom filters and
+        are dropped, as in consolidate(), so the result is exact. Without the query, the result of a boolean query with
+        NOT may miss matching documents, as a false positive of a negated pattern removes the document.
 
-        :param r_star: A list of encrypted updates
-        :type r_star: List[int]
+        :param r_star: A list of encrypted updates, or the clauses and encrypted updates per pattern of a boolean query.
+        Encrypted updates may be any read-only bytes-like objects, such as slices of a buffer received from the server.
+        :type r_star: Union[List[bytes], BooleanSearchResult]
+        :param q: The query the encrypted updates were returned for, or None to keep the false positives
+        :type q: Optional[str]
         :returns: A list of document identifiers matching with the initial query
         :rtype: List[int]
         """
-        # Decrypt r_star and sort it according to timestamp t
-        decrypted_updates: List[Update] = list(map(lambda e: self._decrypt_update(e), r_star))
-        decrypted_updates.sort(key=lambda x: x[0])
+        if q is not None and is_boolean_query(q) != isinstance(r_star, BooleanSearchResult):
+            raise ValueError('The encrypted updates were not returned for query \'{0}\''.format(q))
+        if isinstance(r_star, BooleanSearchResult):
+            patterns = [None] * len(r_star.results)
+            if q is not None:
+                patterns = [_query_pattern(pattern) for pattern in parse_boolean_query(q)[1]]
+            # Patterns often share updates, so decrypt every update only once
+            decrypted: Dict[bytes, Update] = {}
+            documents = []
+            for pattern, pattern_r_star in zip(patterns, r_star.results):
+                for e in pattern_r_star:
+                    if e not in decrypted:
+                        decrypted[e] = self._decrypt_update(e)
+                updates = [decrypted[e] for e in pattern_r_star]
+                if pattern is not None:
+                    updates = [update for update in updates if pattern.fullmatch(update[3]) is not None]
+                documents.append(self._relevant_documents(updates))
+            return evaluate_clauses(r_star.clauses, documents)
 
-        keyword_documents_dict: Dict[str, List[int]] = {}
-        for update in decrypted_updates:
-            # Unpack entry (see utils.Update)
-            (t, op, ind, w) = update
+        pattern = None if q is None else _query_pattern(q)
+        if self.decryption_workers is not None and len(r_star) >= self.parallel_threshold:
+            latest_operations = self._parallel_latest_operations(r_star)
+            if pattern is not None:
+                latest_operations = {(w, ind): latest for (w, ind), latest in latest_operations.items()
+                                     if pattern.fullmatch(w) is not None}
+            return self._added_documents(latest_operations)
+        updates = (self._decrypt_update(e) for e in r_star)
+        if pattern is not None:
+            updates = (update for update in updates if pattern.fullmatch(update[3]) is not None)
+        return self._relevant_documents(updates)
 
-            if w not in keyword_documents_dict:
-                keyword_documents_dict[w] = []
+    def consolidate(
+            self,
+            q: str,
+            r_star: List[bytes],
+    ) -> ConsolidationToken:
+        """Creates a consolidation token from the encrypted updates returned by a search, to be send to the server.
+        The token removes all returned updates of every document-keyword pair with more than one update or whose last
+        update is a delete, and adds a freshly encrypted add update for each of these pairs that is still present.
+        Updates of keywords that do not match the query are false positives of the Bloom filters, whose other updates
+        may not have been returned, so they are left alone.
 
-            documents_list: List[int] = keyword_documents_dict[w]
-            if op == Op.ADD and ind not in documents_list:
-                # Add ind to the results for this keyword
-                documents_list.append(ind)
-                keyword_documents_dict[w] = documents_list
-            elif op == Op.DEL and ind in documents_list:
-                # Remove ind from the results for this keyword
-                documents_list.remove(ind)
-                keyword_documents_dict[w] = documents_list
+        :param q: The query the encrypted updates were returned for, which must not be a boolean query
+        :type q: str
+        :param r_star: All encrypted updates returned by the search, not an interrupted partial search
+        :type r_star: List[bytes]
+        :returns: The consolidation token
+        :rtype: ConsolidationToken
+        """
+        if is_boolean_query(q):
+            raise ValueError('Only the results of a single pattern can be consolidated')
+        pattern = _query_pattern(q)
+        updates = []
+        cipher_texts: Dict[Tuple[str, int], List[bytes]] = {}
+        for e in r_star:
+            update = self._decrypt_update(e)
+            (_, _, ind, w) = update
+            if pattern.fullmatch(w) is not None:
+                updates.append(update)
+                cipher_texts.setdefault((w, ind), []).append(bytes(e))
+
+        del_tokens = []
+        add_tokens = []
+        for (w, ind), (t, op) in self._latest_operations(updates).items():
+            pair_cipher_texts = cipher_texts[(w, ind)]
+            if len(pair_cipher_texts) == 1 and op == Op.ADD:
+                continue
+            del_tokens.extend(self.sigma.del_token(e, w) for e in pair_cipher_texts)
+            if op == Op.ADD:
+                # The timestamp of the last add is kept, so updates of the pair made after the search still override it
+                add_tokens.append(self.sigma.add_token(self._encrypt_update(t, Op.ADD, ind, w), w))
+        return ConsolidationToken(del_tokens, add_tokens)
+
+    def _parallel_latest_operations(
+            self,
+            r_star: List[bytes],
+    ) -> Dict[Tuple[str, int], Tuple[int, Op]]:
+        """Decrypts encrypted updates in chunks on the worker processes, and merges the last operations per
+        document-keyword pair found by the workers. If updates are cached, only the updates that are not cached are
+        sent to the workers, which then return the decrypted updates so they can be added to the cache.
+
+        :param r_star: The encrypted updates
+        :type r_star: List[bytes]
+        :returns: For every (w, ind) pair, the timestamp and operation of its last update
+        :rtype: Dict[Tuple[str, int], Tuple[int, Op]]
+        """
+        if self._decryption_pool is None:
+            self._decryption_pool = ProcessPoolExecutor(self.decryption_workers, initializer=_init_decryption_worker,
+                                                        initargs=(self.k,))
+        latest_operations = {}
+        if self.cache_size is not None:
+            cached_updates = []
+            missing = []
+            for e in r_star:
+                update = self._cached_update(e)
+                if update is None:
+                    missing.append(e)
+                else:
+                    cached_updates.append(update)
+            self._latest_operations(cached_updates, latest_operations)
+            r_star = missing
+
+        # Several chunks per worker even out differences in the time workers take per chunk
+        chunk_size = max(1, -(-len(r_star) // (4 * self.decryption_workers)))
+        # Slices of a buffer cannot be sent to other processes, so they are copied
+        chunks = [[bytes(e) for e in r_star[i:i + chunk_size]] for i in range(0, len(r_star), chunk_size)]
 
-        # Combine the ind values for all keywords and remove duplicates
-        results = [ind for sub_results in keyword_documents_dict.values() for ind in sub_results]
-        return list(set(results))
+        if self.cache_size is not None:
+            for chunk, updates in zip(chunks, self._decryption_pool.map(_decrypt_chunk, chunks)):
+                for cipher_text, update in zip(chunk, updates):
+                    self._cache_update(cipher_text, update)
+                self._latest_operations(updates, latest_operations)
+        else:
+            for partial_operations in self._decryption_pool.map(_chunk_latest_operations, chunks):
+                self._latest_operations(((t, op, ind, w) for (w, ind), (t, op) in partial_operations.items()),
+                                        latest_operations)
+        return latest_operations
+
+    @classmethod
+    def _relevant_documents(
+            cls,
+            decrypted_updates: Iterable[Update],
+    ) -> List[int]:
+        """Determines which document identifiers are relevant given all decrypted updates for a query.
+
+        :param decrypted_updates: The decrypted updates, in any order
+        :type decrypted_updates: Iterable[Update]
+        :returns: A list of document identifiers that are added, but not deleted afterwards, for some keyword, in
+        ascending order
+        :rtype: List[int]
+        """
+        return cls._added_documents(cls._latest_operations(decrypted_updates))
+
+    @staticmethod
+    def _added_documents(
+            latest_operations: Dict[Tuple[str, int], Tuple[int, Op]],
+    ) -> List[int]:
+        """Determines which document identifiers are relevant given the last operation on every document-keyword
+        pair.
+
+        :param latest_operations: For every (w, ind) pair, the timestamp and operation of its last update
+        :type latest_operations: Dict[Tuple[str, int], Tuple[int, Op]]
+        :returns: A list of document identifiers whose last operation is an add for some keyword, in ascending order
+        :rtype: List[int]
+        """
+        # Combine the ind values for all keywords, which removes duplicates
+        return list(Bitmap(ind for (_, ind), (_, op) in latest_operations.items() if op == Op.ADD))
+
+    @staticmethod
+    def _latest_operations(
+            decrypted_updates: Iterable[Update],
+            latest_operations: Optional[Dict[Tuple[str, int], Tuple[int, Op]]] = None,
+    ) -> Dict[Tuple[str, int], Tuple[int, Op]]:
+        """Finds the last operation on every document-keyword pair. Only the update with the highest timestamp of a
+        pair determines whether the pair is present, so the updates need not be sorted.
+
+        :param decrypted_updates: The decrypted updates, in any order
+        :type decrypted_updates: Iterable[Update]
+        :param latest_operations: The last operations found so far, which are updated in place, or None to start anew
+        :type latest_operations: Optional[Dict[Tuple[str, int], Tuple[int, Op]]]
+        :returns: For every (w, ind) pair, the timestamp and operation of its last update
+        :rtype: Dict[Tuple[str, int], Tuple[int, Op]]
+        """
+        if latest_operations is None:
+            latest_operations = {}
+        for (t, op, ind, w) in decrypted_updates:
+            latest = latest_operations.get((w, ind))
+            if latest is None or latest[0] < t:
+                latest_operations[(w, ind)] = (t, op)
+        return latest_operations
 
     def _encrypt_update(
             self,
@@ -143,8 +597,9 @@ class LibertasClient(object):
             op: Op,
             ind: int,
             w: str,
-    ) -> int:
-        """Encrypts a (t, op, ind, w) tuple.
+    ) -> bytes:
+        """Encrypts a (t, op, ind, w) tuple. The cipher text is kept as bytes, so the server can store it as is and
+        return it without conversion.
 
         :param t: The timestamp in the tuple
         :type t: int
@@ -155,26 +610,170 @@ class LibertasClient(object):
         :param w: The keyword in the tuple
         :type w: str
         :returns: The tuple in encrypted form
-        :rtype: int
+        :rtype: bytes
         """
-        update_str: str = '{0},{1},{2},{3}'.format(t, op.value, ind, w)
-        encrypted_update_str: bytes = encrypt(self.k, update_str)
-        return int.from_bytes(encrypted_update_str, byteorder='big')
+        w_bytes = w.encode('utf-8')
+        try:
+            update = UPDATE_HEADER.pack(t, op.value, ind, len(w_bytes)) + w_bytes
+        except struct.error:
+            raise ValueError('The timestamp, document identifier or keyword is too large to encode') from None
+        if self.size_classes is not None:
+            size = next((size for size in self.size_classes if size >= len(update)), None)
+            if size is None:
+                largest = self.size_classes[-1]
+                size = -(-len(update) // largest) * largest
+            update += bytes(size - len(update))
+        return encrypt_bytes(self.k, update)
 
     def _decrypt_update(
             self,
-            cipher_text: int,
+            cipher_text: bytes,
     ) -> Update:
         """Decrypts the encryption of a (t, op, ind, w) tuple.
 
-        :param cipher_text: The encrypted tuple
-        :type cipher_text: int
+        :param cipher_text: The encrypted tuple, as bytes or another bytes-like object
+        :type cipher_text: bytes
         :returns: The (t, op, ind, w) tuple
         :rtype: Update
         """
-        # Ensure byte alignment of 16 because of CBC mode
-        byte_length = math.ceil(math.log(cipher_text, 2) / 8 / 16) * 16
-        cipher_text_bytes: bytes = int.to_bytes(cipher_text, byteorder='big', length=byte_length)
-        update_str: str = decrypt(self.k, cipher_text_bytes)
-        (t, op, ind, w) = update_str.split(',')
-        return int(t), Op(int(op)), int(ind), w
+        if self.cache_size is None:
+            return _decrypt_update(self.k, cipher_text)
+        update = self._cached_update(cipher_text)
+        if update is None:
+            update = _decrypt_update(self.k, cipher_text)
+            self._cache_update(cipher_text, update)
+        return update
+
+    def _cached_update(
+            self,
+            cipher_text: bytes,
+    ) -> Optional[Update]:
+        """Looks up the decryption of an encrypted update in the cache, marking it as most recently used.
+
+        :param cipher_text: The encrypted update
+        :type cipher_text: bytes
+        :returns: The (t, op, ind, w) tuple, or None if it is not cached
+        :rtype: Optional[Update]
+        """
+        key = _cache_key(cipher_text)
+        entry = self._update_cache.get(key)
+        if entry is None:
+            return None
+        self._update_cache.move_to_end(key)
+        return entry[0]
+
+    def _cache_update(
+            self,
+            cipher_text: bytes,
+            update: Update,
+    ) -> None:
+        """Adds a decrypted update to the cache, evicting the least recently used updates while the cache is full.
+
+        :param cipher_text: The encrypted update
+        :type cipher_text: bytes
+        :param update: The (t, op, ind, w) tuple
+        :type update: Update
+        :returns: None
+        :rtype: None
+        """
+        key = _cache_key(cipher_text)
+        (t, op, ind, w) = update
+        size = (CACHE_ENTRY_OVERHEAD + sys.getsizeof(key) + sys.getsizeof(update) + sys.getsizeof(t)
+                + sys.getsizeof(ind) + sys.getsizeof(w))
+        if size > self.cache_size:
+            return
+        self.cache_usage += size
+        self._update_cache[key] = (update, size)
+        while self.cache_usage > self.cache_size:
+            (_, (_, evicted_size)) = self._update_cache.popitem(last=False)
+            self.cache_usage -= evicted_size
+
+
+def _query_pattern(
+        q: str,
+) -> re.Pattern:
+    """Compiles a query into a regular expression matching the keywords the query matches.
+
+    :param q: The query, a string of characters, possibly containing singular _ and * wildcards
+    :type q: str
+    :returns: The regular expression
+    :rtype: re.Pattern
+    """
+    return re.compile(''.join('.' if c == '_' else '.*' if c == '*' else re.escape(c) for c in q), re.DOTALL)
+
+
+def _cache_key(
+        cipher_text: bytes,
+) -> bytes:
+    """Computes the key of an encrypted update in the decrypted update cache.
+
+    :param cipher_text: The encrypted update, as bytes or another bytes-like object
+    :type cipher_text: bytes
+    :returns: A digest of the encrypted update
+    :rtype: bytes
+    """
+    return hashlib.blake2b(cipher_text, digest_size=16).digest()
+
+
+def _decrypt_update(
+        k: bytes,
+        cipher_text: bytes,
+) -> Update:
+    """Decrypts the encryption of a (t, op, ind, w) tuple under a key.
+
+    :param k: The key of the client
+    :type k: bytes
+    :param cipher_text: The encrypted tuple, as bytes or another bytes-like object
+    :type cipher_text: bytes
+    :returns: The (t, op, ind, w) tuple
+    :rtype: Update
+    """
+    update = decrypt_bytes(k, cipher_text)
+    (t, op, ind, length) = UPDATE_HEADER.unpack_from(update)
+    w = update[UPDATE_HEADER.size:UPDATE_HEADER.size + length].decode('utf-8')
+    return t, Op(op), ind, w
+
+
+# The key of the client whose search results a worker process decrypts
+_worker_key: Optional[bytes] = None
+
+
+def _init_decryption_worker(
+        k: bytes,
+) -> None:
+    """Stores the key of the client in a worker process that decrypts search results.
+
+    :param k: The key of the client
+    :type k: bytes
+    :returns: None
+    :rtype: None
+    """
+    global _worker_key
+    _worker_key = k
+
+
+def _decrypt_chunk(
+        cipher_texts: List[bytes],
+) -> List[Update]:
+    """Decrypts a chunk of encrypted updates in a worker process.
+
+    :param cipher_texts: The encrypted updates
+    :type cipher_texts: List[bytes]
+    :returns: The (t, op, ind, w) tuples, in the order of the encrypted updates
+    :rtype: List[Update]
+    """
+    return [_decrypt_update(_worker_key, e) for e in cipher_texts]
+
+
+def _chunk_latest_operations(
+        cipher_texts: List[bytes],
+) -> Dict[Tuple[str, int], Tuple[int, Op]]:
+    """Decrypts a chunk of encrypted updates in a worker process and finds the last operation per document-keyword
+    pair among them.
+
+    :param cipher_texts: The encrypted updates
+    :type cipher_texts: List[bytes]
+    :returns: For every (w, ind) pair in the chunk, the timestamp and operation of its last update
+    :rtype: Dict[Tuple[str, int], Tuple[int, Op]]
+    """
+    return LibertasClient._latest_operations(_decrypt_update(_worker_key, e) for e in cipher_texts)
@@ -1,9 +1,10 @@
 # Python imports
-from typing import List
+from typing import List, Optional, Union
 
 # Project imports
+from src.boolean_query import BooleanSearchResult, BooleanSrchToken
 from src.sigma_interface.sigma_server import SigmaServer
-from src.utils import AddToken, SrchToken
+from src.utils import AddToken, ConsolidationToken, PartialSearchResult, SearchEstimate, SearchPlan, SrchToken
 
 
 class LibertasServer(object):
@@ -39,16 +40,104 @@ class LibertasServer(object):
     def search(
             self,
             srch_token: SrchToken,
-    ) -> List[int]:
+    ) -> Union[List[bytes], BooleanSearchResult]:
         """Searches the index using a search token, resulting in encrypted results.
+        For a boolean search token, the encrypted results of all its patterns are found in a single scan of the index.
+        As the server cannot tell which updates are still valid, it leaves combining them to the client.
 
         :param srch_token: The search token generated by the client
         :type srch_token: SrchToken
-        :returns: A list of encrypted updates
-        :rtype: List[int]
+        :returns: A list of encrypted updates, or the clauses and encrypted updates per pattern for a boolean query. The
+        encrypted updates are bytes, or read-only slices of the buffer holding them if the index stores them packed.
+        :rtype: Union[List[bytes], BooleanSearchResult]
         """
+        if isinstance(srch_token, BooleanSrchToken):
+            return BooleanSearchResult(srch_token.clauses, self.sigma.multi_search(srch_token.tokens))
         return self.sigma.search(srch_token)
 
+    def partial_search(
+            self,
+            srch_token: SrchToken,
+            time_budget: Optional[float] = None,
+            filter_budget: Optional[int] = None,
+            cursor: int = 0,
+    ) -> PartialSearchResult:
+        """Searches the index using a search token like search(), but stops once a time or filter budget is exhausted.
+        The encrypted results of all resumed calls must be combined before they are passed to dec_search, as an add
+        and a later delete of the same pair may be returned by different calls.
+
+        :param srch_token: The search token generated by the client
+        :type srch_token: SrchToken
+        :param time_budget: The maximum wall time to spend on this call (seconds), or None for no time limit
+        :type time_budget: Optional[float]
+        :param filter_budget: The maximum number of index entries to scan in this call, or None for no limit
+        :type filter_budget: Optional[int]
+        :param cursor: The position to resume scanning from, as returned by an earlier call
+        :type cursor: int
+        :returns: The encrypted updates found so far, the scanned fraction of the index and a resumable cursor
+        :rtype: PartialSearchResult
+        """
+        return self.sigma.partial_search(srch_token, time_budget, filter_budget, cursor)
+
+    def estimate(
+            self,
+            srch_token: SrchToken,
+            sample_rate: float,
+            confidence: float = .95,
+    ) -> SearchEstimate:
+        """Estimates the number of encrypted updates a search would return, and therefore the number of decryptions
+        dec_search would perform, by evaluating the search token on a random sample of the index.
+
+        :param srch_token: The search token generated by the client
+        :type srch_token: SrchToken
+        :param sample_rate: The fraction of the index to sample, in (0, 1]
+        :type sample_rate: float
+        :param confidence: The confidence level of the returned interval
+        :type confidence: float
+        :returns: The estimated number of matching encrypted updates and its confidence interval
+        :rtype: SearchEstimate
+        """
+        return self.sigma.estimate(srch_token, sample_rate, confidence)
+
+    def explain(
+            self,
+            srch_token: SrchToken,
+    ) -> SearchPlan:
+        """Describes the work a search with a search token would cause on the server, without performing the search.
+
+        :param srch_token: The search token generated by the client
+        :type srch_token: SrchToken
+        :returns: The expected cost of the search
+        :rtype: SearchPlan
+        """
+        return self.sigma.explain(srch_token)
+
+    def save(
+            self,
+            path: str,
+    ) -> None:
+        """Writes a snapshot of the index to a file, so the server can be restarted without replaying every update.
+
+        :param path: The path of the snapshot file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+        self.sigma.save(path)
+
+    def load(
+            self,
+            path: str,
+    ) -> None:
+        """Replaces the index by a snapshot written by save().
+
+        :param path: The path of the snapshot file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+        self.sigma.load(path)
+
     def add(
             self,
             add_token: AddToken,
@@ -74,3 +163,17 @@ class LibertasServer(object):
         :rtype: None
         """
         self.sigma.add(del_token)
+
+    def consolidate(
+            self,
+            consolidation_token: ConsolidationToken,
+    ) -> None:
+        """Atomically removes the encrypted updates that a consolidation token replaces and adds the consolidated add
+        updates of the token, so searches see either all updates or their consolidation.
+
+        :param consolidation_token: The consolidation token generated by the client after a search
+        :type consolidation_token: ConsolidationToken
+        :returns: None
+        :rtype: None
+        """
+        self.sigma.replace(consolidation_token.del_tokens, consolidation_token.add_tokens)
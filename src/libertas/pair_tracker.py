@@ -0,0 +1,429 @@
+# Python imports
+import hashlib
+import math
+import struct
+from typing import Dict, Iterator, Set, Tuple
+
+# Third-party imports
+from bitarray import bitarray
+from bitarray.util import zeros
+
+"""A pair is encoded for hashing as its document identifier followed by its UTF-8 encoded keyword."""
+PAIR_HEADER = struct.Struct('>q')
+
+
+class PairTracker(object):
+    """Interface of the trackers of the document-keyword pairs that are present in the index, kept by a Libertas
+    client.
+
+    The client skips an add of a pair that is certainly present and a delete of a pair that is certainly absent. A
+    tracker only describes the index if every update since the setup of the client has passed through it.
+    """
+
+    # The type of tracker, stored in its exported state so the state is only imported by the same type of tracker
+    state_type = None
+
+    def is_live(
+            self,
+            ind: int,
+            w: str,
+    ) -> bool:
+        """Checks whether a pair is certainly present, so an add of the pair can be skipped.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: Whether the pair is certainly present
+        :rtype: bool
+        """
+        pass
+
+    def may_be_live(
+            self,
+            ind: int,
+            w: str,
+    ) -> bool:
+        """Checks whether a pair may be present, so a delete of the pair cannot be skipped.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: Whether the pair may be present
+        :rtype: bool
+        """
+        pass
+
+    def add(
+            self,
+            ind: int,
+            w: str,
+    ) -> None:
+        """Records that a pair has been added.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: None
+        :rtype: None
+        """
+        pass
+
+    def discard(
+            self,
+            ind: int,
+            w: str,
+    ) -> None:
+        """Records that a pair has been deleted.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: None
+        :rtype: None
+        """
+        pass
+
+    def clear(
+            self,
+    ) -> None:
+        """Forgets all pairs, for a new index.
+
+        :returns: None
+        :rtype: None
+        """
+        pass
+
+    def export_state(
+            self,
+    ) -> Dict:
+        """Exports the state of the tracker.
+
+        :returns: The state of the tracker, a dictionary that can be encoded as JSON
+        :rtype: Dict
+        """
+        pass
+
+    def import_state(
+            self,
+            state: Dict,
+    ) -> None:
+        """Restores the state of the tracker exported by export_state().
+
+        :param state: The state of the tracker
+        :type state: Dict
+        :returns: None
+        :rtype: None
+        :raises ValueError: If the state has been exported by another type of tracker
+        """
+        pass
+
+    def _check_state(
+            self,
+            state: Dict,
+    ) -> None:
+        """Checks that a state has been exported by the same type of tracker.
+
+        :param state: The state of a tracker
+        :type state: Dict
+        :returns: None
+        :rtype: None
+        :raises ValueError: If the state has been exported by another type of tracker
+        """
+        if not isinstance(state, dict) or state.get('type') != self.state_type:
+            raise ValueError('Expected the state of a tracker of type {0}'.format(self.state_type))
+
+
+class ExactPairTracker(PairTracker):
+    """A tracker holding the exact set of the pairs that are present in the index."""
+
+    state_type = 'exact'
+
+    def __init__(
+            self,
+    ) -> None:
+        """Initializes an empty tracker.
+
+        :returns: None
+        :rtype: None
+        """
+        self._pairs: Set[Tuple[str, int]] = set()
+
+    def is_live(
+            self,
+            ind: int,
+            w: str,
+    ) -> bool:
+        """Checks whether a pair is present, so an add of the pair can be skipped.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: Whether the pair is present
+        :rtype: bool
+        """
+        return (w, ind) in self._pairs
+
+    def may_be_live(
+            self,
+            ind: int,
+            w: str,
+    ) -> bool:
+        """Checks whether a pair is present, so a delete of the pair cannot be skipped.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: Whether the pair is present
+        :rtype: bool
+        """
+        return (w, ind) in self._pairs
+
+    def add(
+            self,
+            ind: int,
+            w: str,
+    ) -> None:
+        """Records that a pair has been added.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: None
+        :rtype: None
+        """
+        self._pairs.add((w, ind))
+
+    def discard(
+            self,
+            ind: int,
+            w: str,
+    ) -> None:
+        """Records that a pair has been deleted.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: None
+        :rtype: None
+        """
+        self._pairs.discard((w, ind))
+
+    def clear(
+            self,
+    ) -> None:
+        """Forgets all pairs, for a new index.
+
+        :returns: None
+        :rtype: None
+        """
+        self._pairs = set()
+
+    def export_state(
+            self,
+    ) -> Dict:
+        """Exports the tracked pairs.
+
+        :returns: The state of the tracker, a dictionary that can be encoded as JSON
+        :rtype: Dict
+        """
+        return {'type': self.state_type, 'pairs': sorted([w, ind] for (w, ind) in self._pairs)}
+
+    def import_state(
+            self,
+            state: Dict,
+    ) -> None:
+        """Restores the tracked pairs exported by export_state().
+
+        :param state: The state of the tracker
+        :type state: Dict
+        :returns: None
+        :rtype: None
+        :raises ValueError: If the state has not been exported by an exact tracker
+        """
+        self._check_state(state)
+        self._pairs = {(w, ind) for (w, ind) in state['pairs']}
+
+
+class ApproximatePairTracker(PairTracker):
+    """A tracker holding a Bloom filter of the pairs that have been added to the index.
+
+    The filter takes a fixed amount of memory, but cannot remove pairs and may report pairs that have never been added.
+    It therefore never proves that a pair is present, so adds are always sent to the server, and it only skips deletes
+    of pairs that have certainly never been added. A delete of any other pair is sent as well.
+    """
+
+    state_type = 'approximate'
+
+    def __init__(
+            self,
+            capacity: int,
+            error_rate: float,
+    ) -> None:
+        """Initializes an empty tracker.
+
+        :param capacity: The number of pairs the tracker is sized for
+        :type capacity: int
+        :param error_rate: The probability that a pair that has never been added is reported as possibly present, once
+        the tracker holds capacity pairs
+        :type error_rate: float
+        :returns: None
+        :rtype: None
+        """
+        self._set_parameters(capacity, error_rate)
+        self._bits = zeros(self.size)
+
+    def is_live(
+            self,
+            ind: int,
+            w: str,
+    ) -> bool:
+        """Checks whether a pair is certainly present, which the Bloom filter can never tell.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: False
+        :rtype: bool
+        """
+        return False
+
+    def may_be_live(
+            self,
+            ind: int,
+            w: str,
+    ) -> bool:
+        """Checks whether a pair may have been added, so a delete of the pair cannot be skipped.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: Whether all positions of the pair are set in the Bloom filter
+        :rtype: bool
+        """
+        return all(self._bits[position] for position in self._positions(ind, w))
+
+    def add(
+            self,
+            ind: int,
+            w: str,
+    ) -> None:
+        """Records that a pair has been added, setting its positions in the Bloom filter.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: None
+        :rtype: None
+        """
+        for position in self._positions(ind, w):
+            self._bits[position] = 1
+
+    def discard(
+            self,
+            ind: int,
+            w: str,
+    ) -> None:
+        """Records that a pair has been deleted, which leaves the Bloom filter unchanged, as its positions may be shared
+        with other pairs.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: None
+        :rtype: None
+        """
+        pass
+
+    def clear(
+            self,
+    ) -> None:
+        """Forgets all pairs, for a new index.
+
+        :returns: None
+        :rtype: None
+        """
+        self._bits = zeros(self.size)
+
+    def export_state(
+            self,
+    ) -> Dict:
+        """Exports the parameters and the bits of the Bloom filter.
+
+        :returns: The state of the tracker, a dictionary that can be encoded as JSON
+        :rtype: Dict
+        """
+        return {'type': self.state_type, 'capacity': self.capacity, 'error_rate': self.error_rate,
+                'bits': self._bits.tobytes().hex()}
+
+    def import_state(
+            self,
+            state: Dict,
+    ) -> None:
+        """Restores the Bloom filter exported by export_state(), including its parameters.
+
+        :param state: The state of the tracker
+        :type state: Dict
+        :returns: None
+        :rtype: None
+        :raises ValueError: If the state has not been exported by an approximate tracker
+        """
+        self._check_state(state)
+        self._set_parameters(state['capacity'], state['error_rate'])
+        bits = bitarray()
+        bits.frombytes(bytes.fromhex(state['bits']))
+        if len(bits) != (self.size + 7) // 8 * 8:
+            raise ValueError('Expected a Bloom filter of {0} bits'.format(self.size))
+        del bits[self.size:]
+        self._bits = bits
+
+    def _set_parameters(
+            self,
+            capacity: int,
+            error_rate: float,
+    ) -> None:
+        """Sets the capacity and error rate of the tracker, and derives the size and number of hash functions of the
+        Bloom filter from them.
+
+        :param capacity: The number of pairs the tracker is sized for
+        :type capacity: int
+        :param error_rate: The probability that a pair that has never been added is reported as possibly present
+        :type error_rate: float
+        :returns: None
+        :rtype: None
+        """
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError('The capacity must be positive and the error rate must be between 0 and 1')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-(capacity * math.log(error_rate)) / (math.log(2) ** 2))
+        self.hash_functions = max(1, round((self.size / capacity) * math.log(2)))
+
+    def _positions(
+            self,
+            ind: int,
+            w: str,
+    ) -> Iterator[int]:
+        """Derives the positions of a pair in the Bloom filter by double hashing.
+
+        :param ind: The document identifier
+        :type ind: int
+        :param w: The keyword
+        :type w: str
+        :returns: The positions
+        :rtype: Iterator[int]
+        """
+        digest = hashlib.blake2b(PAIR_HEADER.pack(ind) + w.encode('utf-8'), digest_size=16).digest()
+        (h1, h2) = (int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1)
+        return (((h1 + i * h2) % self.size) for i in range(self.hash_functions))
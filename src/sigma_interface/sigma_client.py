@@ -1,5 +1,5 @@
 # Python imports
-from typing import Generic
+from typing import Dict, Generic
 
 # Project imports
 from src.utils import AddToken, SrchToken
@@ -31,6 +31,29 @@ class SigmaClient(Generic[AddToken, SrchToken]):
         """
         pass
 
+    def export_state(
+            self,
+    ) -> Dict:
+        """Exports the keys and parameters of the client.
+
+        :returns: The state of the client, a dictionary that can be encoded as JSON
+        :rtype: Dict
+        """
+        pass
+
+    def import_state(
+            self,
+            state: Dict,
+    ) -> None:
+        """Restores the state of a client exported by export_state().
+
+        :param state: The state of a client
+        :type state: Dict
+        :returns: None
+        :rtype: None
+        """
+        pass
+
     def srch_token(
             self,
             q: str,
@@ -59,3 +82,19 @@ class SigmaClient(Generic[AddToken, SrchToken]):
         :rtype: AddToken
         """
         pass
+
+    def del_token(
+            self,
+            ind: int,
+            w: str,
+    ) -> bytes:
+        """Creates a delete token for a document-keyword pair, to be send to the server.
+
+        :param ind: The document identifier of the document in the document-keyword pair that is to be deleted
+        :type ind: int
+        :param w: The keyword in the document-keyword pair that is to be deleted
+        :type w: str
+        :returns: the delete token
+        :rtype: bytes
+        """
+        pass
@@ -1,8 +1,8 @@
 # Python imports
-from typing import List, Generic
+from typing import List, Generic, Optional
 
 # Project imports
-from src.utils import AddToken, SrchToken
+from src.utils import AddToken, PartialSearchResult, SearchEstimate, SearchPlan, SrchToken
 
 
 class SigmaServer(Generic[AddToken, SrchToken]):
@@ -40,6 +40,97 @@ class SigmaServer(Generic[AddToken, SrchToken]):
         :rtype: List[int]
         """
 
+    def multi_search(
+            self,
+            srch_tokens: List[SrchToken],
+    ) -> List[List[int]]:
+        """Searches the index for several queries at once and returns the results of every query.
+
+        :param srch_tokens: The search tokens, one per query
+        :type srch_tokens: List[SrchToken]
+        :returns: A list of results per search token
+        :rtype: List[List[int]]
+        """
+
+    def partial_search(
+            self,
+            srch_token: SrchToken,
+            time_budget: Optional[float] = None,
+            filter_budget: Optional[int] = None,
+            cursor: int = 0,
+    ) -> PartialSearchResult:
+        """Searches the index for a query represented by a search token, stopping once a time or filter budget is
+        exhausted. Returns the results found so far, the scanned fraction of the index and a cursor to resume from.
+
+        :param srch_token: The search token
+        :type srch_token: SrchToken
+        :param time_budget: The maximum wall time to spend on this call (seconds), or None for no time limit
+        :type time_budget: Optional[float]
+        :param filter_budget: The maximum number of index entries to scan in this call, or None for no limit
+        :type filter_budget: Optional[int]
+        :param cursor: The position to resume scanning from, as returned by an earlier call
+        :type cursor: int
+        :returns: The partial results
+        :rtype: PartialSearchResult
+        """
+
+    def estimate(
+            self,
+            srch_token: SrchToken,
+            sample_rate: float,
+            confidence: float = .95,
+    ) -> SearchEstimate:
+        """Estimates the number of index entries matching a search token by evaluating it on a random sample of the
+        index.
+
+        :param srch_token: The search token
+        :type srch_token: SrchToken
+        :param sample_rate: The fraction of the index to sample, in (0, 1]
+        :type sample_rate: float
+        :param confidence: The confidence level of the returned interval
+        :type confidence: float
+        :returns: The estimated number of matching entries and its confidence interval
+        :rtype: SearchEstimate
+        """
+
+    def explain(
+            self,
+            srch_token: SrchToken,
+    ) -> SearchPlan:
+        """Describes the work a search with a search token would cause, without performing the search.
+
+        :param srch_token: The search token
+        :type srch_token: SrchToken
+        :returns: The expected cost of the search
+        :rtype: SearchPlan
+        """
+
+    def save(
+            self,
+            path: str,
+    ) -> None:
+        """Writes a snapshot of the index to a file.
+
+        :param path: The path of the snapshot file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+        pass
+
+    def load(
+            self,
+            path: str,
+    ) -> None:
+        """Replaces the index by a snapshot written by save().
+
+        :param path: The path of the snapshot file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+        pass
+
     def add(
             self,
             add_token: AddToken,
@@ -52,3 +143,20 @@ class SigmaServer(Generic[AddToken, SrchToken]):
         :rtype: None
         """
         pass
+
+    def replace(
+            self,
+            del_tokens: List[bytes],
+            add_tokens: List[AddToken],
+    ) -> None:
+        """Atomically deletes document-keyword pairs, represented by delete tokens, and adds others, represented by add
+        tokens, to the index.
+
+        :param del_tokens: Delete tokens representing the document-keyword pairs to delete
+        :type del_tokens: List[bytes]
+        :param add_tokens: Add tokens representing the document-keyword pairs to add
+        :type add_tokens: List[AddToken]
+        :returns: None
+        :rtype: None
+        """
+        pass
@@ -0,0 +1,103 @@
+# Python imports
+import threading
+from collections import Counter
+from typing import Dict
+
+
+class Stats(object):
+    """A set of named counters and histograms, used to instrument clients and servers.
+
+    Counting is not synchronized, so a Stats object should only be updated by one thread at a time. Concurrent
+    operations count into a Stats object of their own and merge it into a shared Stats object once they are done.
+    """
+
+    def __init__(
+            self,
+    ) -> None:
+        """Initializes an empty set of counters and histograms.
+
+        :returns: None
+        :rtype: None
+        """
+        self.counters: Counter = Counter()
+        self.histograms: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def count(
+            self,
+            name: str,
+            n: int = 1,
+    ) -> None:
+        """Increases a counter.
+
+        :param name: The name of the counter
+        :type name: str
+        :param n: The amount to increase the counter by
+        :type n: int
+        :returns: None
+        :rtype: None
+        """
+        self.counters[name] += n
+
+    def observe(
+            self,
+            name: str,
+            value: int,
+    ) -> None:
+        """Records a value in a histogram.
+
+        :param name: The name of the histogram
+        :type name: str
+        :param value: The observed value
+        :type value: int
+        :returns: None
+        :rtype: None
+        """
+        if name not in self.histograms:
+            self.histograms[name] = Counter()
+        self.histograms[name][value] += 1
+
+    def merge(
+            self,
+            other: 'Stats',
+    ) -> None:
+        """Adds the counters and histograms of another Stats object to this one.
+
+        :param other: The Stats object to merge, which must no longer be updated
+        :type other: Stats
+        :returns: None
+        :rtype: None
+        """
+        with self._lock:
+            self.counters.update(other.counters)
+            for name, histogram in other.histograms.items():
+                if name not in self.histograms:
+                    self.histograms[name] = Counter()
+                self.histograms[name].update(histogram)
+
+    def snapshot(
+            self,
+    ) -> Dict[str, Dict]:
+        """Copies the current counters and histograms.
+
+        :returns: A dictionary with a 'counters' dictionary from counter names to values, and a 'histograms' dictionary
+        from histogram names to dictionaries from observed values to their number of observations
+        :rtype: Dict[str, Dict]
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: dict(histogram) for name, histogram in self.histograms.items()},
+            }
+
+    def reset(
+            self,
+    ) -> None:
+        """Sets all counters and histograms back to zero.
+
+        :returns: None
+        :rtype: None
+        """
+        with self._lock:
+            self.counters = Counter()
+            self.histograms = {}
@@ -1,6 +1,6 @@
 # Python imports
 from enum import Enum
-from typing import Tuple, TypeVar
+from typing import List, NamedTuple, Optional, Tuple, TypeVar
 
 
 class Op(Enum):
@@ -29,3 +29,59 @@ SrchToken = TypeVar('SrchToken')
 
 """Type declaration for Libertas updates, (t, op, ind, w) tuples."""
 Update = Tuple[int, Op, int, str]
+
+
+class PartialSearchResult(NamedTuple):
+    """The outcome of a search that may have been interrupted by a time or filter budget.
+
+    results: The results found in the scanned part of the index
+    scanned_fraction: The fraction of the index that has been scanned, including earlier resumed calls
+    cursor: The index position to resume the search from, or None if the entire index has been scanned
+    """
+    results: List[int]
+    scanned_fraction: float
+    cursor: Optional[int]
+
+
+class SearchEstimate(NamedTuple):
+    """An estimate of the number of index entries matching a search token, based on a random sample of the index.
+
+    matches: The estimated number of matching entries
+    lower: The lower bound of the confidence interval of the number of matching entries
+    upper: The upper bound of the confidence interval of the number of matching entries
+    sample_size: The number of entries that have been evaluated
+    """
+    matches: float
+    lower: float
+    upper: float
+    sample_size: int
+
+
+class SearchPlan(NamedTuple):
+    """A description of the work a search token causes on the server.
+
+    dictionary_lookup: Whether the token is answered from the exact match dictionary instead of the Bloom filters
+    filters: The number of Bloom filters that will be scanned
+    positions: The number of Bloom filter positions in the token
+    distinct_positions: The number of distinct positions, as repeated positions are only probed once per filter
+    expected_hmacs_per_filter: The expected number of HMACs per non-matching filter, given that a scan of a filter stops
+    at the first position that is not set
+    estimated_seconds: The expected duration of the search, calibrated from recent searches, or None without history
+    """
+    dictionary_lookup: bool
+    filters: int
+    positions: int
+    distinct_positions: int
+    expected_hmacs_per_filter: float
+    estimated_seconds: Optional[float]
+
+
+class ConsolidationToken(NamedTuple):
+    """The changes that replace the encrypted updates of document-keyword pairs by a single add update per pair that
+    is still present.
+
+    del_tokens: The delete tokens of the encrypted updates to remove from the index
+    add_tokens: The add tokens of the consolidated add updates
+    """
+    del_tokens: List[bytes]
+    add_tokens: List[AddToken]
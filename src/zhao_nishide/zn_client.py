@@ -1,14 +1,17 @@
 # Python imports
 import math
 import os
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 # Third-party imports
 from bitarray import bitarray
 
 # Project imports
+from src.boolean_query import BooleanSrchToken, is_boolean_query, parse_boolean_query
+from src.client_state import load_state, save_state
 from src.crypto import hash_string_to_int, hash_int, hash_string, hash_bytes
 from src.sigma_interface.sigma_client import SigmaClient
+from src.stats import Stats
 
 
 class ZNClient(SigmaClient[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[bytes]]]):
@@ -21,18 +24,41 @@ class ZNClient(SigmaClient[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
     This implementation uses Bloom filters for the index. Search queries are allowed to contain both _ and * wildcard
     characters. A _ character is used to indicate the presence of any single character, while the * character marks the
     presence of 0 or more characters.
+
+    Optionally, entries can be tagged with a length bucket, the keyword length divided by a bucket width. Queries
+    without * wildcards can only match keywords of their own length, so their search tokens restrict the server to a
+    single bucket. This reveals the bucket of every entry and query to the server. Wider buckets leak less about
+    keyword lengths, but let the server skip fewer entries.
+
+    Optionally, entries can also be labeled with a pseudorandom function of their keyword, allowing the server to keep
+    a dictionary from labels to entries. Queries without wildcards are then answered by a dictionary lookup instead of a
+    scan of all Bloom filters. This reveals to the server which entries share a keyword, and which entries match a
+    query without wildcards even before it is searched for again.
+
+    The keys and Bloom filter parameters of the client can be saved to a file encrypted under a passphrase, so a
+    restarted client can keep using its index (see save and load). The hashes of the Bloom filter positions, which
+    every add token needs to mask its Bloom filter, can be precomputed once and are saved along with the keys.
     """
 
     def __init__(
             self,
             fp_rate: float,
             average_keyword_length: int,
+            length_bucket_width: Optional[int] = None,
+            exact_match_dictionary: bool = False,
+            collect_stats: bool = False,
     ) -> None:
         """Initializes a Zhao and Nishide client.
 
         :param fp_rate: The false-positive rate of individual search results
         :type fp_rate: float
         :param average_keyword_length: The average length of keywords, used to determine optimal Bloom filter parameters
+        :param length_bucket_width: The number of keyword lengths per length bucket, or None to not tag entries
+        :type length_bucket_width: Optional[int]
+        :param exact_match_dictionary: Whether to label entries, so queries without wildcards can use a dictionary
+        :type exact_match_dictionary: bool
+        :param collect_stats: Whether to count the pseudorandom function evaluations of the client, see stats()
+        :type collect_stats: bool
         :returns: None
         :rtype: None
         """
@@ -43,7 +69,13 @@ class ZNClient(SigmaClient[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
         self.bf_size = math.ceil(-(set_size * math.log(fp_rate)) / (math.log(2) ** 2))
         self.bf_hash_functions = math.ceil((self.bf_size / set_size) * math.log(2))
 
+        if length_bucket_width is not None and length_bucket_width < 1:
+            raise ValueError('The length bucket width must be at least 1')
+        self.length_bucket_width = length_bucket_width
+        self.exact_match_dictionary = exact_match_dictionary
         self.k = None
+        self._position_hashes: Optional[List[bytes]] = None
+        self._stats: Optional[Stats] = Stats() if collect_stats else None
 
     def setup(
             self,
@@ -59,6 +91,90 @@ class ZNClient(SigmaClient[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
         k_h: List[bytes] = [os.urandom(security_parameter // 8) for _ in range(self.bf_hash_functions)]
         k_g: bytes = os.urandom(security_parameter // 8)
         self.k: (bytes, bytes) = (k_h, k_g)
+        self._position_hashes = None
+
+    def precompute_tables(
+            self,
+    ) -> None:
+        """Precomputes the hashes of all Bloom filter positions under k_g. Add tokens then need half as many
+        pseudorandom function evaluations, and search tokens need none for their second part.
+
+        :returns: None
+        :rtype: None
+        """
+        (_, k_g) = self.k
+        self._position_hashes = [hash_int(k_g, pos) for pos in range(self.bf_size)]
+
+    def export_state(
+            self,
+    ) -> Dict:
+        """Exports the keys and Bloom filter parameters of the client, and its precomputed tables, if any.
+
+        :returns: The state of the client, a dictionary that can be encoded as JSON
+        :rtype: Dict
+        """
+        (k_h, k_g) = self.k
+        return {
+            'bf_size': self.bf_size,
+            'bf_hash_functions': self.bf_hash_functions,
+            'length_bucket_width': self.length_bucket_width,
+            'exact_match_dictionary': self.exact_match_dictionary,
+            'k_h': [k.hex() for k in k_h],
+            'k_g': k_g.hex(),
+            'position_hashes': None if self._position_hashes is None else [h.hex() for h in self._position_hashes],
+        }
+
+    def import_state(
+            self,
+            state: Dict,
+    ) -> None:
+        """Restores the state of a client exported by export_state(), replacing the parameters the client was
+        initialized with.
+
+        :param state: The state of a client
+        :type state: Dict
+        :returns: None
+        :rtype: None
+        """
+        self.bf_size = state['bf_size']
+        self.bf_hash_functions = state['bf_hash_functions']
+        self.length_bucket_width = state['length_bucket_width']
+        self.exact_match_dictionary = state['exact_match_dictionary']
+        self.k = ([bytes.fromhex(k) for k in state['k_h']], bytes.fromhex(state['k_g']))
+        position_hashes = state['position_hashes']
+        self._position_hashes = None if position_hashes is None else [bytes.fromhex(h) for h in position_hashes]
+
+    def save(
+            self,
+            path: str,
+            passphrase: str,
+    ) -> None:
+        """Writes the state of the client to a file, encrypted under a key derived from a passphrase.
+
+        :param path: The path of the state file
+        :type path: str
+        :param passphrase: The passphrase to encrypt the state with
+        :type passphrase: str
+        :returns: None
+        :rtype: None
+        """
+        save_state(path, self.export_state(), passphrase)
+
+    def load(
+            self,
+            path: str,
+            passphrase: str,
+    ) -> None:
+        """Restores the state of the client from a file written by save(), instead of calling setup().
+
+        :param path: The path of the state file
+        :type path: str
+        :param passphrase: The passphrase the state was encrypted with
+        :type passphrase: str
+        :returns: None
+        :rtype: None
+        """
+        self.import_state(load_state(path, passphrase))
 
     def srch_token(
             self,
@@ -67,30 +183,56 @@ class ZNClient(SigmaClient[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
         """Creates a search token for a query, to be send to a Z&N server.
         The first part of the search token consists of Bloom filter positions, one per element in s_t(q).
         The second part of the search token consists of hashes of these positions.
+        If length buckets or the exact match dictionary are used, the third part lists the buckets to scan, or is None
+        if all buckets are to be scanned, and the fourth part is the dictionary label of the query, or None if the
+        query contains wildcards. Tokens that carry a label have no Bloom filter positions.
+        Queries combining patterns with AND, OR and NOT operators (see boolean_query) result in a BooleanSrchToken
+        holding the clauses of the query and a search token for every distinct pattern.
 
         :param q: The query, a string of characters, possibly containing singular _ and * wildcards
         :type q: str
         :returns: The search token
         :rtype: (List[int], List[bytes])
         """
+        if is_boolean_query(q):
+            (clauses, patterns) = parse_boolean_query(q)
+            return BooleanSrchToken(clauses, [self.srch_token(pattern) for pattern in patterns])
+
         (k_h, k_g) = self.k
+        extended = self.length_bucket_width is not None or self.exact_match_dictionary
+        if self.exact_match_dictionary and '_' not in q and '*' not in q:
+            self._count('srch_tokens')
+            return [], [], None, self._label(q)
+
         # Append the query with '\0' to indicate the end of the query. This way 'test' is interpreted differently from
         # 'test*'.
         s_t = self._s_t(q + '\0')
         td1s: List[int] = [hash_string_to_int(k, e) % self.bf_size for e in s_t for k in k_h]
-        td2s: List[bytes] = [hash_int(k_g, pos) for pos in td1s]
+        position_hashes = self._position_hashes
+        if position_hashes is None:
+            td2s: List[bytes] = [hash_int(k_g, pos) for pos in td1s]
+        else:
+            td2s: List[bytes] = [position_hashes[pos] for pos in td1s]
+        self._count('srch_tokens')
+        self._count('srch_token_prf_calls', len(td1s) + (len(td2s) if position_hashes is None else 0))
+        if extended:
+            buckets = None if '*' in q or self.length_bucket_width is None else [self._length_bucket(q)]
+            return td1s, td2s, buckets, None
         return td1s, td2s
 
     def add_token(
             self,
-            ind: int,
+            ind: Union[int, bytes],
             w: str,
     ) -> Tuple[int, bitarray, bytes]:
         """Creates an add token for a document-keyword pair, to be send to a Z&N server.
-        Add tokens consist of the document identifier, Bloom filter and its ID.
+        Add tokens consist of the document identifier, Bloom filter and its ID. If length buckets or the exact match
+        dictionary are used, the length bucket and the dictionary label of the keyword are appended, either of which is
+        None if unused.
 
-        :param ind: The document identifier of the document-keyword pair to add
-        :type ind: int
+        :param ind: The document identifier of the document-keyword pair to add, an integer or, for Libertas, an
+        encrypted update
+        :type ind: Union[int, bytes]
         :param w: The keyword of the document-keyword pair to add
         :type w: str
         :returns: An add token, a tuple consisting of a document identifier, Bloom filter and its ID
@@ -99,7 +241,7 @@ class ZNClient(SigmaClient[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
         # Append the keyword with '\0' to indicate the end of the keyword
         s_k = self._s_k(w + '\0')
         (k_h, k_g) = self.k
-        b_id = hash_string(k_g, str(ind) + w)
+        b_id = self._b_id(ind, w)
         bloom_filter = bitarray(self.bf_size)
 
         # Fill Bloom filter
@@ -109,30 +251,115 @@ class ZNClient(SigmaClient[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
                 bloom_filter[pos] = True
 
         # Mask Bloom filter
+        position_hashes = self._position_hashes
         for pos in range(self.bf_size):
-            h = hash_bytes(b_id, hash_int(k_g, pos))
+            h_pos = hash_int(k_g, pos) if position_hashes is None else position_hashes[pos]
+            h = hash_bytes(b_id, h_pos)
             first_hash_bit = h[0] & 1
             bloom_filter[pos] ^= first_hash_bit
+        self._count('add_tokens')
+        self._count('add_token_prf_calls',
+                    1 + len(s_k) * len(k_h) + (2 if position_hashes is None else 1) * self.bf_size)
+        if self.length_bucket_width is not None or self.exact_match_dictionary:
+            bucket = None if self.length_bucket_width is None else self._length_bucket(w)
+            label = self._label(w) if self.exact_match_dictionary else None
+            return ind, bloom_filter, b_id, bucket, label
         return ind, bloom_filter, b_id
 
     def del_token(
             self,
-            ind: int,
+            ind: Union[int, bytes],
             w: str,
     ) -> bytes:
         """Creates a delete token for a document-keyword pair, to be send to a Z&N server.
         A delete token is a Bloom filter ID.
 
-        :param ind: The document identifier of the document-keyword pair to delete
-        :type ind: int
+        :param ind: The document identifier of the document-keyword pair to delete, an integer or, for Libertas, an
+        encrypted update
+        :type ind: Union[int, bytes]
         :param w: The keyword of the document-keyword pair to delete
         :type w: str
         :returns: A delete token, which is a Bloom filter ID
         :rtype: bytes
         """
+        return self._b_id(ind, w)
+
+    def _b_id(
+            self,
+            ind: Union[int, bytes],
+            w: str,
+    ) -> bytes:
+        """Derives the Bloom filter ID of a document-keyword pair.
+
+        :param ind: The document identifier, an integer or a bytes-like object
+        :type ind: Union[int, bytes]
+        :param w: The keyword
+        :type w: str
+        :returns: The Bloom filter ID
+        :rtype: bytes
+        """
         (_, k_g) = self.k
-        b_id = hash_string(k_g, str(ind) + w)
-        return b_id
+        if isinstance(ind, int):
+            return hash_string(k_g, str(ind) + w)
+        return hash_bytes(k_g, bytes(ind) + w.encode('utf-8'))
+
+    def _length_bucket(
+            self,
+            w: str,
+    ) -> int:
+        """Determines the length bucket of a keyword or of a query without * wildcards.
+
+        :param w: The keyword or query
+        :type w: str
+        :returns: The length bucket
+        :rtype: int
+        """
+        return len(w) // self.length_bucket_width
+
+    def _label(
+            self,
+            w: str,
+    ) -> bytes:
+        """Determines the exact match dictionary label of a keyword, using a key derived from k_g.
+
+        :param w: The keyword
+        :type w: str
+        :returns: The dictionary label
+        :rtype: bytes
+        """
+        (_, k_g) = self.k
+        k_l = hash_string(k_g, 'dictionary')
+        self._count('label_prf_calls', 2)
+        return hash_string(k_l, w)
+
+    def stats(
+            self,
+    ) -> Optional[Dict[str, Dict]]:
+        """Returns the work done by the client since it was initialized. The counters are 'add_tokens', 'srch_tokens',
+        and the number of pseudorandom function evaluations for Bloom filters and their masks in 'add_token_prf_calls'
+        and 'srch_token_prf_calls', and for exact match dictionary labels in 'label_prf_calls'.
+
+        :returns: A snapshot of the counters (see Stats.snapshot), or None if stats are not collected
+        :rtype: Optional[Dict[str, Dict]]
+        """
+        return None if self._stats is None else self._stats.snapshot()
+
+    def _count(
+            self,
+            name: str,
+            n: int = 1,
+    ) -> None:
+        """Increases a counter, if stats are collected.
+
+        :param name: The name of the counter
+        :type name: str
+        :param n: The amount to increase the counter by
+        :type n: int
+        :returns: None
+        :rtype: None
+        """
+        if self._stats is not None:
+            self._stats.count(name, n)
 
     @classmethod
     def _s_k(
@@ -1,12 +1,26 @@
 # Python imports
-from typing import List, Tuple
+import itertools
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from itertools import islice
+from statistics import NormalDist
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
 
 # Third-party imports
 from bitarray import bitarray
 
 # Project imports
+from src.boolean_query import BooleanSrchToken, evaluate_clauses
 from src.crypto import hash_bytes
 from src.sigma_interface.sigma_server import SigmaServer
+from src.stats import Stats
+from src.utils import PartialSearchResult, SearchEstimate, SearchPlan
+from src.zhao_nishide.zn_storage import (DEFAULT_IND_SIZE, LOG_ADD, MappedIndex, Segment, WriteAheadLog, load_snapshot,
+                                         pack_segment, save_snapshot)
 
 
 class ZNServer(SigmaServer[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[bytes]]]):
@@ -19,28 +33,108 @@ class ZNServer(SigmaServer[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
     This implementation uses Bloom filters for the index. Search queries are allowed to contain both _ and * wildcard
     characters. A _ character is used to indicate the presence of any single character, while the * character marks the
     presence of 0 or more characters.
+
+    The server can be shared between threads. Updates are serialized by a write lock, while searches run without
+    locking against a snapshot of the index: additions only append to the index list and deletions replace the list by
+    a filtered copy, so the first n entries of a list never change once a search has observed them.
+
+    Add tokens may carry two more elements, the length bucket and the dictionary label of their keyword (see ZNClient).
+    Entries with a bucket are kept in a separate list per bucket, and search tokens that carry a list of buckets as
+    third element only scan the untagged entries and the entries in those buckets. Entries with a label are also stored
+    in a dictionary from labels to entries, and search tokens that carry a label as fourth element are answered from
+    this dictionary without scanning any Bloom filter.
+
+    The index can also be stored in a file that is searched in place through a memory map, or streamed from disk in
+    chunks of a fixed size if the index is larger than the memory (see build_index and MappedIndex). All entries are
+    then appended to the file, including the entries with a length bucket, and the dictionary is rebuilt from the file
+    when it is opened.
+
+    An in-memory index can be made durable with a snapshot (see save) and a write-ahead log of the updates made since
+    (see open_log). Saving a snapshot, loading one or building a new index empties the log.
+
+    The untagged entries of an in-memory index are split into segments. New entries are appended to a mutable list,
+    which is sealed into an immutable segment of packed records once it holds segment_size entries (see seal). Deleting
+    an entry from a sealed segment only hides it. Once there are more than max_segments sealed segments, a background
+    thread merges them into a single segment without the deleted entries (see merge), so the cost of a search remains
+    proportional to the number of live entries. Searches scan the sealed segments, oldest first, before the list.
     """
 
+    # The number of recent searches used to calibrate the latency estimates of explain()
+    recent_searches = 64
+
     def __init__(
             self,
+            collect_stats: bool = False,
+            segment_size: Optional[int] = None,
+            max_segments: int = 4,
+            segment_directory: Optional[str] = None,
     ) -> None:
         """Initializes a Zhao and Nishide server.
 
+        :param collect_stats: Whether to count the work done by searches, see stats()
+        :type collect_stats: bool
+        :param segment_size: The number of untagged entries after which they are sealed into a segment, or None to
+        only seal segments when seal() is called
+        :type segment_size: Optional[int]
+        :param max_segments: The number of sealed segments above which they are merged in the background
+        :type max_segments: int
+        :param segment_directory: A directory of this server to store sealed segments in as memory-mapped files, or None
+        to keep them in memory
+        :type segment_directory: Optional[str]
         :returns: None
         :rtype: None
         """
         super().__init__()
-        self.index = None
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.segment_directory = segment_directory
+        self._publish([], None, None)
+        self.dictionary = None
+        self.dictionary_labels = None
+        self._write_lock = threading.Lock()
+        self._log: Optional[WriteAheadLog] = None
+        self._merge_lock = threading.Lock()
+        self._merger: Optional[threading.Thread] = None
+        self._merge_error: Optional[Exception] = None
+        self._segment_numbers = itertools.count()
+        self._search_timings: Deque[Tuple[int, float]] = deque(maxlen=self.recent_searches)
+        self._stats: Optional[Stats] = Stats() if collect_stats else None
 
     def build_index(
             self,
+            path: Optional[str] = None,
+            ind_size: int = DEFAULT_IND_SIZE,
+            chunk_size: Optional[int] = None,
     ) -> None:
-        """Sets up the Z&N server, creating an empty index.
+        """Sets up the Z&N server, creating an empty index. If a path is given, the index is stored in that file
+        instead of in memory, and the entries already in the file are kept. An index file that was open before is
+        closed, and the files of the sealed segments of the previous index are removed.
 
+        :param path: The path of the index file, or None to keep the index in memory
+        :type path: Optional[str]
+        :param ind_size: The size of the document identifier slot of a new index file (bytes). The default only holds
+        integers; for Libertas, the slot must hold 2 bytes more than the longest encrypted update.
+        :type ind_size: int
+        :param chunk_size: The number of bytes a search reads from the index file at once, or None to search the file
+        through a memory map (see MappedIndex)
+        :type chunk_size: Optional[int]
         :returns: None
         :rtype: None
         """
-        self.index: List[(bytes, bitarray)] = []
+        with self._write_lock:
+            if self._log is not None and path is not None:
+                raise ValueError('An index file cannot be combined with a write-ahead log')
+            self._close_index()
+            self._remove_segment_files(self.segments)
+            self._publish([], [] if path is None else MappedIndex(path, ind_size, chunk_size), {})
+            self.dictionary: Dict[bytes, Dict[bytes, int]] = {}
+            self.dictionary_labels: Dict[bytes, bytes] = {}
+            if self._log is not None:
+                self._log.truncate()
+            if path is not None:
+                for ind, b_id, label in self.index.labelled_entries():
+                    self.dictionary.setdefault(label, {})[b_id] = ind
+                    self.dictionary_labels[b_id] = label
 
     def search(
             self,
@@ -53,34 +147,477 @@ class ZNServer(SigmaServer[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
         :param srch_token: The search token
         :type srch_token: Tuple[List[int], List[bytes]]
         :returns: A list containing the identifiers of matching documents and possibly some other documents, as the
-        use of Bloom filters introduce false positives.
+        use of Bloom filters introduce false positives. For a boolean query with NOT, a false positive of a negated
+        pattern drops a matching document, so the list may then also miss matching documents.
         :rtype: List[int]
         """
-        (td1s, td2s) = srch_token
-        results = []
-        for ind, bit_array, b_id in self.index:
-            for pos, h_pos in zip(td1s, td2s):
-                mask_bit = hash_bytes(b_id, h_pos)[0] & 1
-                if bit_array[pos] ^ mask_bit == 0:
-                    break
+        if isinstance(srch_token, BooleanSrchToken):
+            return evaluate_clauses(srch_token.clauses, self.multi_search(srch_token.tokens))
+
+        (td1s, td2s, buckets, label) = self._unpack_srch_token(srch_token)
+        if label is not None:
+            return list(self.iter_search(srch_token))
+        snapshot = self._snapshot(buckets)
+        filters = self._scan_size(snapshot)
+        start = time.perf_counter()
+        results = list(self._iter_snapshot(td1s, td2s, snapshot))
+        if filters > 0:
+            self._search_timings.append((filters, time.perf_counter() - start))
+        return results
+
+    def iter_search(
+            self,
+            srch_token: Tuple[List[int], List[bytes]],
+            limit: Optional[int] = None,
+    ) -> Iterator[int]:
+        """Searches the index for a query represented by a search token and yields matching document IDs as soon as
+        they are found. Every document ID is yielded at most once. The scan stops as soon as `limit` distinct document
+        IDs have been yielded, so the remainder of the index is never inspected. Filters of documents that have already
+        been found are skipped without probing them, so a matching document with many keywords costs little more than
+        a matching document with one keyword.
+
+        :param srch_token: The search token
+        :type srch_token: Tuple[List[int], List[bytes]]
+        :param limit: The maximum number of document IDs to yield, or None to scan the entire index
+        :type limit: Optional[int]
+        :returns: An iterator over the identifiers of matching documents, in index order
+        :rtype: Iterator[int]
+        """
+        if limit is not None and limit <= 0:
+            return
+        if isinstance(srch_token, BooleanSrchToken):
+            # Boolean queries can only be evaluated once the entire index has been scanned
+            yield from islice(self.search(srch_token), limit)
+            return
+        (td1s, td2s, buckets, label) = self._unpack_srch_token(srch_token)
+        if label is not None:
+            self._count_lookup()
+            yield from islice(self._lookup(label), limit)
+            return
+        yield from self._iter_snapshot(td1s, td2s, self._snapshot(buckets), limit)
+
+    def _iter_snapshot(
+            self,
+            td1s: List[int],
+            td2s: List[bytes],
+            snapshot: List[Tuple[List[Tuple[int, bitarray, bytes]], int]],
+            limit: Optional[int] = None,
+    ) -> Iterator[int]:
+        """Scans a snapshot of the index for the trapdoors of a search token and yields every matching document ID once.
+
+        :param td1s: The Bloom filter positions of the search token
+        :type td1s: List[int]
+        :param td2s: The hashes of the Bloom filter positions of the search token
+        :type td2s: List[bytes]
+        :param snapshot: The snapshot, as returned by _snapshot()
+        :type snapshot: List[Tuple[List[Tuple[int, bitarray, bytes]], int]]
+        :param limit: The maximum number of document IDs to yield, or None to scan the entire snapshot
+        :type limit: Optional[int]
+        :returns: An iterator over the identifiers of matching documents, in index order
+        :rtype: Iterator[int]
+        """
+        search_stats = None if self._stats is None else Stats()
+        found: Set[int] = set()
+        try:
+            for ind, bit_array, b_id in self._scan(snapshot):
+                if ind in found:
+                    # The document already matched, so its remaining filters need not be probed
+                    if search_stats is not None:
+                        search_stats.count('duplicate_suppressions')
+                elif self._probe(td1s, td2s, bit_array, b_id, search_stats):
+                    found.add(ind)
+                    yield ind
+                    if len(found) == limit:
+                        return
+        finally:
+            self._record(search_stats)
+
+    def multi_search(
+            self,
+            srch_tokens: List[Tuple[List[int], List[bytes]]],
+    ) -> List[List[int]]:
+        """Searches the index for several queries at once, scanning every Bloom filter only once. This is used to
+        evaluate boolean queries, whose patterns are combined per document afterwards.
+
+        :param srch_tokens: The search tokens, one per query
+        :type srch_tokens: List[Tuple[List[int], List[bytes]]]
+        :returns: For every search token, the identifiers of the matching documents, as returned by search()
+        :rtype: List[List[int]]
+        """
+        unpacked_tokens = [self._unpack_srch_token(srch_token) for srch_token in srch_tokens]
+        results: List[List[int]] = [[] for _ in srch_tokens]
+        scanned = []
+        for i, (_, _, _, label) in enumerate(unpacked_tokens):
+            if label is not None:
+                self._count_lookup()
+                results[i] = self._lookup(label)
             else:
-                if ind not in results:
-                    results.append(ind)
+                scanned.append(i)
+        if len(scanned) == 0:
+            return results
+
+        bucket_lists = [unpacked_tokens[i][2] for i in scanned]
+        buckets = None if None in bucket_lists else [bucket for bucket_list in bucket_lists for bucket in bucket_list]
+        search_stats = None if self._stats is None else Stats()
+        found: List[Set[int]] = [set() for _ in srch_tokens]
+        for ind, bit_array, b_id in self._scan(self._snapshot(buckets)):
+            for i in scanned:
+                (td1s, td2s, _, _) = unpacked_tokens[i]
+                if ind in found[i]:
+                    if search_stats is not None:
+                        search_stats.count('duplicate_suppressions')
+                elif self._probe(td1s, td2s, bit_array, b_id, search_stats):
+                    found[i].add(ind)
+                    results[i].append(ind)
+        self._record(search_stats)
         return results
 
+    def partial_search(
+            self,
+            srch_token: Tuple[List[int], List[bytes]],
+            time_budget: Optional[float] = None,
+            filter_budget: Optional[int] = None,
+            cursor: int = 0,
+    ) -> PartialSearchResult:
+        """Searches the index like search(), but stops once the time budget or the filter budget is exhausted.
+        Every call scans at least one entry, so resuming the search until the cursor is None always terminates.
+        The search can be resumed by passing the returned cursor to a subsequent call. Deleting entries in between
+        calls shifts index positions, so a resumed search may then skip or revisit some entries. A document ID that has
+        been returned by an earlier call may be returned again by a resumed call.
+
+        :param srch_token: The search token
+        :type srch_token: Tuple[List[int], List[bytes]]
+        :param time_budget: The maximum wall time to spend on this call (seconds), or None for no time limit
+        :type time_budget: Optional[float]
+        :param filter_budget: The maximum number of Bloom filters to scan in this call, or None for no limit
+        :type filter_budget: Optional[int]
+        :param cursor: The index position to start scanning from, as returned by an earlier call
+        :type cursor: int
+        :returns: The results found so far, the fraction of the index that has been scanned and a resumable cursor
+        :rtype: PartialSearchResult
+        :raises ValueError: If the filter budget is smaller than 1
+        """
+        if filter_budget is not None and filter_budget < 1:
+            raise ValueError('The filter budget must be at least 1')
+        self._require_single_pattern(srch_token)
+        (td1s, td2s, buckets, label) = self._unpack_srch_token(srch_token)
+        if label is not None:
+            self._count_lookup()
+            return PartialSearchResult(self._lookup(label), 1., None)
+        snapshot = self._snapshot(buckets)
+        length = self._scan_size(snapshot)
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        end = length if filter_budget is None else min(length, cursor + filter_budget)
+        search_stats = None if self._stats is None else Stats()
+        results = []
+        found: Set[int] = set()
+        position = cursor
+        # Deleted records yield a placeholder, so the position advances past them like the cursor and the length
+        for entry in self._scan(snapshot, cursor, True):
+            if position >= end or (position > cursor and deadline is not None and time.monotonic() >= deadline):
+                break
+            position += 1
+            if entry is None:
+                continue
+            (ind, bit_array, b_id) = entry
+            if ind in found:
+                if search_stats is not None:
+                    search_stats.count('duplicate_suppressions')
+            elif self._probe(td1s, td2s, bit_array, b_id, search_stats):
+                found.add(ind)
+                results.append(ind)
+        self._record(search_stats)
+
+        scanned_fraction = position / length if length > 0 else 1.
+        return PartialSearchResult(results, scanned_fraction, position if position < length else None)
+
+    def estimate(
+            self,
+            srch_token: Tuple[List[int], List[bytes]],
+            sample_rate: float,
+            confidence: float = .95,
+    ) -> SearchEstimate:
+        """Estimates the number of index entries matching a search token by evaluating it on a uniform random sample
+        of the entries the search would scan. Since a document may match with several keywords, the number of matching
+        documents can be lower. The confidence interval is the Wilson score interval of the sampled proportion with a
+        finite population correction, which does not collapse when the sample has no or only matching entries. Tokens
+        with a dictionary label are answered exactly from the dictionary, without evaluating any entries.
+
+        :param srch_token: The search token
+        :type srch_token: Tuple[List[int], List[bytes]]
+        :param sample_rate: The fraction of the scanned entries to sample, in (0, 1]
+        :type sample_rate: float
+        :param confidence: The confidence level of the returned interval
+        :type confidence: float
+        :returns: The estimated number of matching entries and its confidence interval
+        :rtype: SearchEstimate
+        """
+        self._require_single_pattern(srch_token)
+        if not 0 < sample_rate <= 1:
+            raise ValueError('The sample rate must be in (0, 1]')
+        (td1s, td2s, buckets, label) = self._unpack_srch_token(srch_token)
+        if label is not None:
+            matches = len(self.dictionary.get(label, {}))
+            return SearchEstimate(matches, matches, matches, 0)
+
+        snapshot = self._snapshot(buckets)
+        population = self._scan_size(snapshot)
+        sample_size = min(population, max(1, round(population * sample_rate)))
+        if sample_size == 0:
+            return SearchEstimate(0, 0, 0, 0)
+
+        positions = sorted(random.sample(range(population), sample_size))
+        hits = 0
+        sampled = 0
+        offset = 0
+        for partition, length in snapshot:
+            while sampled < sample_size and positions[sampled] < offset + length:
+                entry = partition[positions[sampled] - offset]
+                # Deleted records of an index file count as non-matching entries
+                if entry is not None:
+                    (_, bit_array, b_id) = entry
+                    hits += self._matches(td1s, td2s, bit_array, b_id)
+                sampled += 1
+            offset += length
+
+        proportion = hits / sample_size
+        correction = (population - sample_size) / (population - 1) if population > 1 else 0
+        if correction == 0:
+            # The entire population has been sampled
+            return SearchEstimate(hits, hits, hits, sample_size)
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        # The finite population correction shrinks the variance as if the sample were larger
+        n = sample_size / correction
+        denominator = 1 + z ** 2 / n
+        center = (proportion + z ** 2 / (2 * n)) / denominator
+        margin = z / denominator * math.sqrt(proportion * (1 - proportion) / n + z ** 2 / (4 * n ** 2))
+        lower = max(0., center - margin) * population
+        upper = min(1., center + margin) * population
+        return SearchEstimate(proportion * population, lower, upper, sample_size)
+
+    def explain(
+            self,
+            srch_token: Tuple[List[int], List[bytes]],
+    ) -> SearchPlan:
+        """Describes the work a search with a search token would cause, without performing the search.
+        The expected number of HMACs per filter assumes that every position of a non-matching filter is set with
+        probability 1/2, as in a Bloom filter with optimal parameters. The latency estimate scales the time per filter
+        of recent calls to search() to the number of filters that will be scanned.
+
+        :param srch_token: The search token
+        :type srch_token: Tuple[List[int], List[bytes]]
+        :returns: The expected cost of the search
+        :rtype: SearchPlan
+        """
+        self._require_single_pattern(srch_token)
+        (td1s, _, buckets, label) = self._unpack_srch_token(srch_token)
+        if label is not None:
+            return SearchPlan(True, 0, 0, 0, 0., 0.)
+
+        filters = self._scan_size(self._snapshot(buckets))
+        distinct_positions = len(td1s)
+        expected_hmacs = 2 * (1 - .5 ** distinct_positions)
+
+        timings = list(self._search_timings)
+        timed_filters = sum(timing_filters for (timing_filters, _) in timings)
+        estimated_seconds = None
+        if timed_filters > 0:
+            estimated_seconds = filters * sum(seconds for (_, seconds) in timings) / timed_filters
+        return SearchPlan(False, filters, len(srch_token[0]), distinct_positions, expected_hmacs, estimated_seconds)
+
+    def stats(
+            self,
+    ) -> Optional[Dict[str, Dict]]:
+        """Returns the work done by searches since the server was initialized. The counters are 'searches',
+        'dictionary_lookups', 'filters_scanned', 'hmacs', 'matches' and 'duplicate_suppressions', the number of
+        filters that were skipped because their document had already been found. The 'early_exit_depth' histogram
+        records the number of positions probed before each filter was rejected.
+
+        :returns: A snapshot of the counters and histograms (see Stats.snapshot), or None if stats are not collected
+        :rtype: Optional[Dict[str, Dict]]
+        """
+        return None if self._stats is None else self._stats.snapshot()
+
+    def save(
+            self,
+            path: str,
+    ) -> None:
+        """Writes a snapshot of the index to a file. The snapshot is a versioned binary image that holds the Bloom
+        filter size, every entry with its length bucket and dictionary label, and a checksum. Updates wait until the
+        snapshot has been written, while searches continue.
+
+        :param path: The path of the snapshot file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+        with self._write_lock:
+            sections = [(None, list(self._scan(self._snapshot([]))))]
+            sections += [(bucket, entries) for bucket, entries in sorted(self.buckets.items())]
+            save_snapshot(path, sections, self.dictionary_labels)
+            if self._log is not None:
+                self._log.truncate()
+
+    def load(
+            self,
+            path: str,
+    ) -> None:
+        """Replaces the index by a snapshot written by save(). The loaded index is kept in memory, also if the saved
+        index was stored in a file. The files of the sealed segments of the previous index are removed.
+
+        :param path: The path of the snapshot file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+        (sections, labelled) = load_snapshot(path)
+        with self._write_lock:
+            self._close_index()
+            index = []
+            buckets = {}
+            for bucket, entries in sections:
+                if bucket is None:
+                    index = entries
+                else:
+                    buckets[bucket] = entries
+            self._remove_segment_files(self.segments)
+            self._publish([], index, buckets)
+            self.dictionary = {}
+            self.dictionary_labels = {}
+            for ind, b_id, label in labelled:
+                self.dictionary.setdefault(label, {})[b_id] = ind
+                self.dictionary_labels[b_id] = label
+            if self._log is not None:
+                self._log.truncate()
+
+    def open_log(
+            self,
+            path: str,
+            group_size: int = 64,
+            max_delay: Optional[float] = None,
+    ) -> int:
+        """Opens a write-ahead log and applies the updates it contains to the index, after which every update is
+        appended to the log once it has been applied. On startup, the last snapshot is loaded first and the log is
+        opened next. The log is synced in groups of updates (see WriteAheadLog), so the updates of an incomplete group
+        may be lost if the machine crashes, unless sync_log() is called.
+
+        :param path: The path of the log file
+        :type path: str
+        :param group_size: The number of updates after which the log is synced
+        :type group_size: int
+        :param max_delay: The age of the oldest unsynced update after which the log is synced on the next update
+        (seconds), or None to only sync full groups
+        :type max_delay: Optional[float]
+        :returns: The number of updates applied from the log
+        :rtype: int
+        """
+        log = WriteAheadLog(path, group_size, max_delay)
+        with self._write_lock:
+            if isinstance(self.index, MappedIndex):
+                log.close()
+                raise ValueError('An index file cannot be combined with a write-ahead log')
+            if self._log is not None:
+                self._log.close()
+            replayed = 0
+            for record_type, token in log.records():
+                if record_type == LOG_ADD:
+                    self._add(token)
+                else:
+                    self._delete(token)
+                replayed += 1
+            self._log = log
+        return replayed
+
+    def sync_log(
+            self,
+    ) -> None:
+        """Forces the updates in the write-ahead log to the disk, if a log is open.
+
+        :returns: None
+        :rtype: None
+        """
+        with self._write_lock:
+            if self._log is not None:
+                self._log.sync()
+
+    def close_log(
+            self,
+    ) -> None:
+        """Syncs and closes the write-ahead log, if a log is open. Later updates are no longer logged.
+
+        :returns: None
+        :rtype: None
+        """
+        with self._write_lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def seal(
+            self,
+    ) -> None:
+        """Seals the mutable list of untagged entries into an immutable segment and starts a new list.
+
+        :returns: None
+        :rtype: None
+        """
+        with self._write_lock:
+            self._seal()
+
+    def merge(
+            self,
+    ) -> None:
+        """Merges all sealed segments into a single segment without their deleted entries. The merged segment is
+        packed without holding the write lock, so updates and searches continue meanwhile. Deletions made in the
+        meantime are applied to the merged segment before it replaces the segments it was made from.
+
+        :returns: None
+        :rtype: None
+        :raises RuntimeError: If a background merge has failed since the last call, in which case nothing is merged
+        """
+        (error, self._merge_error) = (self._merge_error, None)
+        if error is not None:
+            raise RuntimeError('A background merge failed') from error
+        with self._merge_lock:
+            segments = self.segments
+            if len(segments) < 2 and all(len(segment.deleted) == 0 for segment in segments):
+                return
+            entries = [entry for segment in segments for entry in segment.entries(0, len(segment))]
+            merged = None
+            if len(entries) > 0:
+                merged = pack_segment(entries, self._segment_path())
+
+            with self._write_lock:
+                current = self.segments[:len(segments)]
+                if len(current) < len(segments) or any(c.records is not s.records for c, s in zip(current, segments)):
+                    # The index has been replaced while merging
+                    self._remove_segment_files([merged])
+                    return
+                for old_segment, current_segment in zip(segments, current):
+                    for b_id in current_segment.deleted - old_segment.deleted:
+                        if merged is not None and b_id in merged.b_ids:
+                            merged = merged.delete(b_id)
+                self._publish(([merged] if merged is not None else []) + self.segments[len(segments):], self.index,
+                              self.buckets)
+            self._remove_segment_files(segments)
+
     def add(
             self,
             add_token: Tuple[int, bitarray, bytes],
     ) -> None:
         """Adds a document-keyword pair, represented by an add token, to the index.
-        An add token consists of a document identifier, a Bloom filter and its ID.
+        An add token consists of a document identifier, a Bloom filter and its ID, optionally followed by the length
+        bucket and the dictionary label of the keyword.
 
         :param add_token: An add token representing a document-keyword pair
         :type add_token: Tuple[int, bitarray, bytes]
         :returns: None
         :rtype: None
         """
-        self.index.append(add_token)
+        with self._write_lock:
+            self._add(add_token)
+            if self._log is not None:
+                self._log.append_add(add_token)
 
     def delete(
             self,
@@ -94,4 +631,417 @@ class ZNServer(SigmaServer[Tuple[bytes, bitarray, bytes], Tuple[List[int], List[
         :returns: None
         :rtype: None
         """
-        self.index = [(ind, bf, b_id) for (ind, bf, b_id) in self.index if b_id != del_token]
+        with self._write_lock:
+            self._delete(del_token)
+            if self._log is not None:
+                self._log.append_delete(del_token)
+
+    def replace(
+            self,
+            del_tokens: List[bytes],
+            add_tokens: List[Tuple[int, bitarray, bytes]],
+    ) -> None:
+        """Atomically deletes document-keyword pairs and adds others, so no other update is applied in between. A search
+        that runs concurrently may see the added pairs before the deleted pairs are removed. The add tokens are logged
+        before the delete tokens, so replaying a log that ends halfway through a replacement never loses the pairs that
+        were added.
+
+        :param del_tokens: Delete tokens representing the document-keyword pairs to delete
+        :type del_tokens: List[bytes]
+        :param add_tokens: Add tokens representing the document-keyword pairs to add
+        :type add_tokens: List[Tuple[int, bitarray, bytes]]
+        :returns: None
+        :rtype: None
+        """
+        with self._write_lock:
+            for add_token in add_tokens:
+                self._add(add_token)
+            self._delete_all(set(del_tokens))
+            if self._log is not None:
+                for add_token in add_tokens:
+                    self._log.append_add(add_token)
+                for del_token in del_tokens:
+                    self._log.append_delete(del_token)
+
+    def _add(
+            self,
+            add_token: Tuple[int, bitarray, bytes],
+    ) -> None:
+        """Applies an add token to the index. The caller must hold the write lock.
+
+        :param add_token: An add token representing a document-keyword pair
+        :type add_token: Tuple[int, bitarray, bytes]
+        :returns: None
+        :rtype: None
+        """
+        (ind, bit_array, b_id, bucket, label) = add_token if len(add_token) == 5 else (*add_token, None, None)
+        if isinstance(self.index, MappedIndex):
+            self.index.append(ind, bit_array, b_id, label)
+        elif bucket is None:
+            self.index.append((ind, bit_array, b_id))
+            if self.segment_size is not None and len(self.index) >= self.segment_size:
+                self._seal()
+        elif bucket in self.buckets:
+            self.buckets[bucket].append((ind, bit_array, b_id))
+        else:
+            # Replace the dictionary rather than inserting into it, as searches may be iterating over it
+            self._publish(self.segments, self.index, {**self.buckets, bucket: [(ind, bit_array, b_id)]})
+        if label is not None:
+            self.dictionary.setdefault(label, {})[b_id] = ind
+            self.dictionary_labels[b_id] = label
+
+    def _delete(
+            self,
+            del_token: bytes,
+    ) -> None:
+        """Applies a delete token to the index. The caller must hold the write lock.
+
+        :param del_token: A delete token representing a document-keyword pair
+        :type del_token: bytes
+        :returns: None
+        :rtype: None
+        """
+        self._delete_all({del_token})
+
+    def _delete_all(
+            self,
+            del_tokens: Set[bytes],
+    ) -> None:
+        """Applies several delete tokens to the index at once, rebuilding every list of entries only once. The caller
+        must hold the write lock.
+
+        :param del_tokens: Delete tokens representing document-keyword pairs
+        :type del_tokens: Set[bytes]
+        :returns: None
+        :rtype: None
+        """
+        if len(del_tokens) == 0:
+            return
+        index = self.index
+        if isinstance(index, MappedIndex):
+            for del_token in del_tokens:
+                index.delete(del_token)
+        else:
+            index = [(ind, bf, b_id) for (ind, bf, b_id) in index if b_id not in del_tokens]
+        segments = []
+        for segment in self.segments:
+            for del_token in del_tokens & segment.b_ids:
+                segment = segment.delete(del_token)
+            segments.append(segment)
+        buckets = {bucket: [(ind, bf, b_id) for (ind, bf, b_id) in entries if b_id not in del_tokens]
+                   for bucket, entries in self.buckets.items()}
+        self._publish(segments, index, buckets)
+        for del_token in del_tokens:
+            label = self.dictionary_labels.pop(del_token, None)
+            if label is not None:
+                postings = self.dictionary[label]
+                del postings[del_token]
+                if len(postings) == 0:
+                    del self.dictionary[label]
+
+    def _close_index(
+            self,
+    ) -> None:
+        """Closes the index file before the index is replaced, if the index is stored in a file. Searches that are
+        still running keep their memory map. The caller must hold the write lock.
+
+        :returns: None
+        :rtype: None
+        """
+        if isinstance(self.index, MappedIndex):
+            self.index.close()
+
+    def _seal(
+            self,
+    ) -> None:
+        """Seals the mutable list of untagged entries into an immutable segment, and starts a background merge if
+        there are too many sealed segments. The caller must hold the write lock.
+
+        :returns: None
+        :rtype: None
+        """
+        if isinstance(self.index, MappedIndex):
+            raise ValueError('An index file cannot be sealed into segments')
+        if len(self.index) == 0:
+            return
+        # Replace the segments and the list rather than modifying them, as searches may be iterating over them
+        self._publish(self.segments + [pack_segment(self.index, self._segment_path())], [], self.buckets)
+        if len(self.segments) > self.max_segments and (self._merger is None or not self._merger.is_alive()):
+            self._merger = threading.Thread(target=self._background_merge, daemon=True)
+            self._merger.start()
+
+    def _publish(
+            self,
+            segments: List[Segment],
+            index: Optional[List[Tuple[int, bitarray, bytes]]],
+            buckets: Optional[Dict[int, List[Tuple[int, bitarray, bytes]]]],
+    ) -> None:
+        """Replaces the sealed segments, the untagged entries and the length buckets of the index. Searches take the
+        three from a single tuple that is replaced in one assignment, so they never combine parts of different
+        versions. The caller must hold the write lock.
+
+        :param segments: The sealed segments
+        :type segments: List[Segment]
+        :param index: The list or the index file of the untagged entries
+        :type index: Optional[List[Tuple[int, bitarray, bytes]]]
+        :param buckets: The lists of entries per length bucket
+        :type buckets: Optional[Dict[int, List[Tuple[int, bitarray, bytes]]]]
+        :returns: None
+        :rtype: None
+        """
+        self.segments = segments
+        self.index = index
+        self.buckets = buckets
+        self._view = (segments, index, buckets)
+
+    def _background_merge(
+            self,
+    ) -> None:
+        """Merges the sealed segments on a background thread. An exception cannot propagate out of the thread, so it
+        is stored and raised by the next call to merge().
+
+        :returns: None
+        :rtype: None
+        """
+        try:
+            self.merge()
+        except Exception as e:
+            self._merge_error = e
+
+    def _segment_path(
+            self,
+    ) -> Optional[str]:
+        """Chooses the file to store a new segment in. Files that already exist in the segment directory, for example
+        those of another server that used the directory before, are never overwritten.
+
+        :returns: The path of the segment file, or None if segments are kept in memory
+        :rtype: Optional[str]
+        """
+        if self.segment_directory is None:
+            return None
+        while True:
+            path = os.path.join(self.segment_directory, 'segment-{0}.zn'.format(next(self._segment_numbers)))
+            if not os.path.exists(path):
+                return path
+
+    @staticmethod
+    def _remove_segment_files(
+            segments: List[Optional[Segment]],
+    ) -> None:
+        """Removes the files of segments that are no longer part of the index. Searches that still use a segment can
+        continue, as its memory map remains valid.
+
+        :param segments: The segments to remove
+        :type segments: List[Optional[Segment]]
+        :returns: None
+        :rtype: None
+        """
+        for segment in segments:
+            if segment is not None and segment.path is not None and os.path.exists(segment.path):
+                os.remove(segment.path)
+
+    def _snapshot(
+            self,
+            buckets: Optional[List[int]] = None,
+    ) -> List[Tuple[List[Tuple[int, bitarray, bytes]], int]]:
+        """Captures a consistent view of the index for a search, without blocking concurrent updates.
+        Entries appended after the snapshot lie beyond the captured lengths, and deletions never modify a captured list.
+        The segments, the untagged entries and the buckets are read from one tuple (see _publish).
+
+        :param buckets: The length buckets to include next to the untagged entries, or None to include all buckets
+        :type buckets: Optional[List[int]]
+        :returns: The lists of entries to scan, each paired with the number of entries it contains
+        :rtype: List[Tuple[List[Tuple[int, bitarray, bytes]], int]]
+        """
+        (segments, index, bucket_dict) = self._view
+        keys = sorted(bucket_dict) if buckets is None else sorted(set(buckets).intersection(bucket_dict))
+        partitions = segments + [index] + [bucket_dict[bucket] for bucket in keys]
+        return [(partition, len(partition)) for partition in partitions]
+
+    @staticmethod
+    def _scan_size(
+            snapshot: List[Tuple[List[Tuple[int, bitarray, bytes]], int]],
+    ) -> int:
+        """Counts the entries in a snapshot.
+
+        :param snapshot: The snapshot, as returned by _snapshot()
+        :type snapshot: List[Tuple[List[Tuple[int, bitarray, bytes]], int]]
+        :returns: The number of entries a scan of the snapshot visits
+        :rtype: int
+        """
+        return sum(length for (_, length) in snapshot)
+
+    @staticmethod
+    def _scan(
+            snapshot: List[Tuple[List[Tuple[int, bitarray, bytes]], int]],
+            start: int = 0,
+            placeholders: bool = False,
+    ) -> Iterator[Optional[Tuple[int, bitarray, bytes]]]:
+        """Iterates over the entries of a snapshot, starting at a position in the concatenation of its lists. The
+        positions count the records of segments and index files, including their deleted records.
+
+        :param snapshot: The snapshot, as returned by _snapshot()
+        :type snapshot: List[Tuple[List[Tuple[int, bitarray, bytes]], int]]
+        :param start: The number of records to skip
+        :type start: int
+        :param placeholders: Whether to yield None for every deleted record instead of skipping it, so every position
+        yields exactly one item
+        :type placeholders: bool
+        :returns: An iterator over the entries
+        :rtype: Iterator[Optional[Tuple[int, bitarray, bytes]]]
+        """
+        for partition, length in snapshot:
+            if start >= length:
+                start -= length
+                continue
+            if isinstance(partition, list):
+                yield from islice(partition, start, length)
+            else:
+                yield from partition.entries(start, length, placeholders)
+            start = 0
+
+    def _lookup(
+            self,
+            label: bytes,
+    ) -> List[int]:
+        """Looks up the document IDs of the entries with a dictionary label.
+
+        :param label: The dictionary label of a keyword
+        :type label: bytes
+        :returns: The identifiers of the documents containing the keyword, without duplicates, in insertion order
+        :rtype: List[int]
+        """
+        postings = self.dictionary.get(label, {})
+        # Copy the postings first, as they may be modified by a concurrent update
+        return list(dict.fromkeys(list(postings.values())))
+
+    @staticmethod
+    def _unpack_srch_token(
+            srch_token: Tuple[List[int], List[bytes]],
+    ) -> Tuple[List[int], List[bytes], Optional[List[int]], Optional[bytes]]:
+        """Splits a search token into its Bloom filter positions, their hashes, the length buckets to scan and its
+        dictionary label. Repeated positions are removed, as probing a position again cannot change the outcome.
+
+        :param srch_token: The search token
+        :type srch_token: Tuple[List[int], List[bytes]]
+        :returns: The positions, the hashes of the positions, the length buckets, or None to scan all buckets, and the
+        dictionary label, or None if the Bloom filters are to be scanned
+        :rtype: Tuple[List[int], List[bytes], Optional[List[int]], Optional[bytes]]
+        """
+        if len(srch_token) == 4:
+            (td1s, td2s, buckets, label) = srch_token
+        else:
+            (td1s, td2s) = srch_token
+            (buckets, label) = (None, None)
+        positions = dict(zip(td1s, td2s))
+        return list(positions.keys()), list(positions.values()), buckets, label
+
+    @staticmethod
+    def _require_single_pattern(
+            srch_token: Tuple[List[int], List[bytes]],
+    ) -> None:
+        """Rejects boolean search tokens for operations that only support a single pattern.
+
+        :param srch_token: The search token
+        :type srch_token: Tuple[List[int], List[bytes]]
+        :returns: None
+        :rtype: None
+        """
+        if isinstance(srch_token, BooleanSrchToken):
+            raise ValueError('Boolean search tokens are only supported by search(), iter_search() and multi_search()')
+
+    def _count_lookup(
+            self,
+    ) -> None:
+        """Counts a search that is answered from the exact match dictionary, if stats are collected.
+
+        :returns: None
+        :rtype: None
+        """
+        if self._stats is not None:
+            search_stats = Stats()
+            search_stats.count('searches')
+            search_stats.count('dictionary_lookups')
+            self._stats.merge(search_stats)
+
+    def _record(
+            self,
+            search_stats: Optional[Stats],
+    ) -> None:
+        """Adds the stats of a finished search to the stats of the server.
+
+        :param search_stats: The stats of the search, or None if stats are not collected
+        :type search_stats: Optional[Stats]
+        :returns: None
+        :rtype: None
+        """
+        if search_stats is not None:
+            search_stats.count('searches')
+            self._stats.merge(search_stats)
+
+    def _probe(
+            self,
+            td1s: List[int],
+            td2s: List[bytes],
+            bit_array: bitarray,
+            b_id: bytes,
+            search_stats: Optional[Stats],
+    ) -> bool:
+        """Checks whether a masked Bloom filter contains all positions of a search token, like _matches(), counting
+        the work done if stats are collected.
+
+        :param td1s: The Bloom filter positions of the search token
+        :type td1s: List[int]
+        :param td2s: The hashes of the Bloom filter positions of the search token
+        :type td2s: List[bytes]
+        :param bit_array: The masked Bloom filter
+        :type bit_array: bitarray
+        :param b_id: The ID of the Bloom filter, used to unmask it
+        :type b_id: bytes
+        :param search_stats: The stats of the current search, or None if stats are not collected
+        :type search_stats: Optional[Stats]
+        :returns: Whether all positions of the search token are set in the unmasked Bloom filter
+        :rtype: bool
+        """
+        if search_stats is None:
+            return self._matches(td1s, td2s, bit_array, b_id)
+
+        search_stats.count('filters_scanned')
+        depth = 0
+        for pos, h_pos in zip(td1s, td2s):
+            depth += 1
+            mask_bit = hash_bytes(b_id, h_pos)[0] & 1
+            if bit_array[pos] ^ mask_bit == 0:
+                search_stats.count('hmacs', depth)
+                search_stats.observe('early_exit_depth', depth)
+                return False
+        search_stats.count('hmacs', depth)
+        search_stats.count('matches')
+        return True
+
+    @staticmethod
+    def _matches(
+            td1s: List[int],
+            td2s: List[bytes],
+            bit_array: bitarray,
+            b_id: bytes,
+    ) -> bool:
+        """Checks whether a masked Bloom filter contains all positions of a search token. The check stops at the first
+        position that is not set.
+
+        :param td1s: The Bloom filter positions of the search token
+        :type td1s: List[int]
+        :param td2s: The hashes of the Bloom filter positions of the search token
+        :type td2s: List[bytes]
+        :param bit_array: The masked Bloom filter
+        :type bit_array: bitarray
+        :param b_id: The ID of the Bloom filter, used to unmask it
+        :type b_id: bytes
+        :returns: Whether all positions of the search token are set in the unmasked Bloom filter
+        :rtype: bool
+        """
+        for pos, h_pos in zip(td1s, td2s):
+            mask_bit = hash_bytes(b_id, h_pos)[0] & 1
+            if bit_array[pos] ^ mask_bit == 0:
+                return False
+        return True
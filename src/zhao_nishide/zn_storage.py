@@ -0,0 +1,922 @@
+# Python imports
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple, Union
+
+# Third-party imports
+from bitarray import bitarray
+
+"""A file starts with a header holding a magic number, the format version, the Bloom filter size in bits and the size
+of the document identifier slot in bytes. The header is followed by fixed-size records, one per index entry, holding
+a flags byte, the document identifier, the Bloom filter ID, the dictionary label and the Bloom filter bits."""
+HEADER = struct.Struct('>4sHIHxxxx')
+MAGIC = b'ZNIX'
+VERSION = 1
+
+B_ID_SIZE = 32
+LABEL_SIZE = 32
+# Document identifiers are stored as signed big-endian integers. Libertas stores encrypted updates as document
+# identifiers, which are stored as raw bytes preceded by their length and need a larger slot: the slot of an index file
+# is fixed when the file is created, and must hold 2 bytes more than the longest encrypted update. The default slot
+# only holds integers.
+DEFAULT_IND_SIZE = 8
+IND_LENGTH = struct.Struct('>H')
+# The number of chunk buffers an index keeps for reuse by later streaming scans
+MAX_CHUNK_BUFFERS = 4
+
+# Bits of the flags byte of a record
+DELETED = 1
+LABELLED = 2
+IND_BYTES = 4
+
+"""A snapshot starts with a header holding a magic number, the format version, the Bloom filter size in bits, the size
+of the document identifier slot in bytes, the number of sections and the CRC-32 checksum of the other header fields
+and the remainder of the file. Every section holds the records of the untagged entries or of the entries in one length
+bucket, in index order."""
+SNAPSHOT_HEADER = struct.Struct('>4sHIHII')
+SNAPSHOT_MAGIC = b'ZNSS'
+SNAPSHOT_VERSION = 2
+# The checksum is the last field of the snapshot header
+SNAPSHOT_CHECKSUM_OFFSET = SNAPSHOT_HEADER.size - 4
+SECTION_HEADER = struct.Struct('>?qQ')
+
+"""A log record starts with a header holding the record type, the length of the payload and the CRC-32 checksum of
+the payload. The payload of an add record starts with a header holding its flags, the length bucket, the Bloom filter
+size in bits and the length of the document identifier, which are followed by the document identifier, the Bloom
+filter ID, the dictionary label, if any, and the Bloom filter bits. The payload of a delete record is a Bloom filter
+ID."""
+LOG_RECORD_HEADER = struct.Struct('>BII')
+ADD_PAYLOAD_HEADER = struct.Struct('>BqIH')
+LOG_ADD = 1
+LOG_DELETE = 2
+# Bits of the flags of an add record
+HAS_BUCKET = 1
+HAS_LABEL = 2
+HAS_BYTES_IND = 4
+
+Ind = Union[int, bytes, memoryview]
+Entry = Tuple[Ind, bitarray, bytes]
+"""The entries of a snapshot, grouped by length bucket. The untagged entries have None as bucket."""
+Sections = List[Tuple[Optional[int], List[Entry]]]
+
+
+def _ind_size(
+        ind: Ind,
+) -> int:
+    """Computes the size of the slot needed to store a document identifier.
+
+    :param ind: The document identifier, an integer or a bytes-like object
+    :type ind: Ind
+    :returns: The size of the slot (bytes)
+    :rtype: int
+    """
+    if isinstance(ind, int):
+        # Signed integers need one bit more than their magnitude
+        return (ind.bit_length() + 8) // 8
+    return IND_LENGTH.size + len(ind)
+
+
+class RecordFormat(object):
+    """The fixed-size binary layout of the entries of a Zhao and Nishide index."""
+
+    def __init__(
+            self,
+            bf_size: int,
+            ind_size: int = DEFAULT_IND_SIZE,
+    ) -> None:
+        """Initializes a record format.
+
+        :param bf_size: The size of the Bloom filters (bits)
+        :type bf_size: int
+        :param ind_size: The size of the document identifier slot (bytes)
+        :type ind_size: int
+        :returns: None
+        :rtype: None
+        """
+        self.bf_size = bf_size
+        self.ind_size = ind_size
+        self.b_id_offset = 1 + ind_size
+        self.label_offset = self.b_id_offset + B_ID_SIZE
+        self.filter_offset = self.label_offset + LABEL_SIZE
+        self.record_size = self.filter_offset + (bf_size + 7) // 8
+
+    def pack(
+            self,
+            ind: Ind,
+            bit_array: bitarray,
+            b_id: bytes,
+            label: Optional[bytes] = None,
+    ) -> bytes:
+        """Encodes an index entry as a record.
+
+        :param ind: The document identifier, an integer or a bytes-like object
+        :type ind: Ind
+        :param bit_array: The masked Bloom filter
+        :type bit_array: bitarray
+        :param b_id: The ID of the Bloom filter
+        :type b_id: bytes
+        :param label: The dictionary label of the keyword, if any
+        :type label: Optional[bytes]
+        :returns: The record
+        :rtype: bytes
+        """
+        # Bloom filters read from a file are padded to a multiple of 8 bits
+        if (len(bit_array) + 7) // 8 != (self.bf_size + 7) // 8:
+            raise ValueError('Expected a Bloom filter of {0} bits, got {1} bits'.format(self.bf_size, len(bit_array)))
+        if len(b_id) != B_ID_SIZE or (label is not None and len(label) != LABEL_SIZE):
+            raise ValueError('Bloom filter IDs and dictionary labels must be {0} bytes long'.format(B_ID_SIZE))
+        if _ind_size(ind) > self.ind_size:
+            raise ValueError('The document identifier needs {0} bytes, but the slots of the index are {1} bytes long; '
+                             'create the index with a larger ind_size'.format(_ind_size(ind), self.ind_size))
+        flags = 0 if label is None else LABELLED
+        if isinstance(ind, int):
+            ind_bytes = ind.to_bytes(self.ind_size, 'big', signed=True)
+        else:
+            flags |= IND_BYTES
+            ind_bytes = IND_LENGTH.pack(len(ind)) + bytes(ind) + bytes(self.ind_size - IND_LENGTH.size - len(ind))
+        return bytes([flags]) + ind_bytes + b_id + (label or bytes(LABEL_SIZE)) + bit_array.tobytes()
+
+    def unpack(
+            self,
+            buffer: memoryview,
+            offset: int,
+            copy: bool = False,
+    ) -> Entry:
+        """Decodes the index entry of a record. Unless a copy is requested, a document identifier stored as bytes is
+        returned as a read-only slice of the buffer, and the returned Bloom filter is a read-only view of the buffer,
+        padded to a multiple of 8 bits.
+
+        :param buffer: The buffer containing the record
+        :type buffer: memoryview
+        :param offset: The offset of the record in the buffer
+        :type offset: int
+        :param copy: Whether to copy the document identifier and the Bloom filter out of the buffer
+        :type copy: bool
+        :returns: The document identifier, the masked Bloom filter and its ID
+        :rtype: Entry
+        """
+        if buffer[offset] & IND_BYTES:
+            (length,) = IND_LENGTH.unpack_from(buffer, offset + 1)
+            ind_start = offset + 1 + IND_LENGTH.size
+            ind = buffer[ind_start:ind_start + length]
+            if copy:
+                ind = bytes(ind)
+        else:
+            ind = int.from_bytes(buffer[offset + 1:offset + self.b_id_offset], 'big', signed=True)
+        b_id = bytes(buffer[offset + self.b_id_offset:offset + self.label_offset])
+        filter_bytes = buffer[offset + self.filter_offset:offset + self.record_size]
+        if copy:
+            bit_array = bitarray(endian='big')
+            bit_array.frombytes(filter_bytes)
+            del bit_array[self.bf_size:]
+        else:
+            bit_array = bitarray(buffer=filter_bytes, endian='big')
+        return ind, bit_array, b_id
+
+
+class MappedIndex(object):
+    """An index of a Zhao and Nishide server that is stored in a file of fixed-size records and searched in place
+    through a memory map. The operating system caches the pages of the file, so the index is not limited by the size
+    of the Python heap and several processes that open the same file share one copy of it in memory.
+
+    New entries are appended at the end of the file. Deleting an entry only sets a flag in its record, which also
+    hides the entry from searches that are already running. The Bloom filter size is taken from the first entry that
+    is appended to a new file.
+
+    Alternatively, scans can stream the records from the file in chunks of a fixed size, which are read into reusable
+    buffers. The memory used by a scan is then bounded by the chunk size, whatever the size of the index, and the
+    operating system is advised to read the next chunk ahead while the current chunk is searched.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            ind_size: int = DEFAULT_IND_SIZE,
+            chunk_size: Optional[int] = None,
+    ) -> None:
+        """Opens an index file, creating it if it does not exist.
+
+        :param path: The path of the index file
+        :type path: str
+        :param ind_size: The size of the document identifier slot (bytes), used if the file is created. Document
+        identifiers stored as bytes take 2 bytes more than their length.
+        :type ind_size: int
+        :param chunk_size: The number of bytes to read at once when streaming a scan, or None to scan through a memory
+        map
+        :type chunk_size: Optional[int]
+        :returns: None
+        :rtype: None
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._chunk_buffers: List[bytearray] = []
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            os.pwrite(self._fd, HEADER.pack(MAGIC, VERSION, 0, ind_size), 0)
+            size = HEADER.size
+        (magic, version, bf_size, ind_size) = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+        if magic != MAGIC or version != VERSION:
+            os.close(self._fd)
+            raise ValueError('{0} is not a version {1} ZN index file'.format(path, VERSION))
+
+        self.format = RecordFormat(bf_size, ind_size)
+        self._length = (size - HEADER.size) // self.format.record_size if bf_size > 0 else 0
+        self._map: Optional[mmap.mmap] = None
+        self._map_lock = threading.Lock()
+        self._positions: Dict[bytes, List[int]] = {}
+        if self._length > 0:
+            # Reading the Bloom filter IDs through the memory map takes no system call per record
+            buffer = self._buffer(self._length)
+            (b_id_offset, label_offset) = (self.format.b_id_offset, self.format.label_offset)
+            offsets = range(HEADER.size, self._offset(self._length), self.format.record_size)
+            for position, offset in enumerate(offsets):
+                if buffer[offset] & DELETED == 0:
+                    b_id = bytes(buffer[offset + b_id_offset:offset + label_offset])
+                    self._positions.setdefault(b_id, []).append(position)
+            buffer.release()
+
+    def __len__(
+            self,
+    ) -> int:
+        """Returns the number of records in the file, including deleted records.
+
+        :returns: The number of records
+        :rtype: int
+        """
+        return self._length
+
+    def __getitem__(
+            self,
+            position: int,
+    ) -> Optional[Tuple[int, bitarray, bytes]]:
+        """Reads the entry of a record.
+
+        :param position: The position of the record
+        :type position: int
+        :returns: The entry of the record, or None if it has been deleted
+        :rtype: Optional[Tuple[int, bitarray, bytes]]
+        """
+        if not 0 <= position < self._length:
+            raise IndexError('Record position out of range')
+        buffer = self._buffer(position + 1)
+        offset = self._offset(position)
+        if buffer[offset] & DELETED:
+            return None
+        return self.format.unpack(buffer, offset)
+
+    def entries(
+            self,
+            start: int,
+            stop: int,
+            placeholders: bool = False,
+    ) -> Iterator[Optional[Tuple[int, bitarray, bytes]]]:
+        """Iterates over the entries of a range of records, skipping deleted records.
+
+        :param start: The position of the first record
+        :type start: int
+        :param stop: The position after the last record, at most the number of records
+        :type stop: int
+        :param placeholders: Whether to yield None for every deleted record instead of skipping it, so every record
+        yields exactly one item
+        :type placeholders: bool
+        :returns: An iterator over the entries
+        :rtype: Iterator[Optional[Tuple[int, bitarray, bytes]]]
+        """
+        if start >= stop:
+            return
+        if self.chunk_size is not None:
+            yield from self._stream(start, stop, placeholders)
+            return
+        buffer = self._buffer(stop)
+        unpack = self.format.unpack
+        record_size = self.format.record_size
+        for offset in range(self._offset(start), self._offset(stop), record_size):
+            if buffer[offset] & DELETED == 0:
+                yield unpack(buffer, offset)
+            elif placeholders:
+                yield None
+
+    def labelled_entries(
+            self,
+    ) -> Iterator[Tuple[int, bytes, bytes]]:
+        """Iterates over the live entries that carry a dictionary label.
+
+        :returns: An iterator over the document identifiers, Bloom filter IDs and labels of the entries
+        :rtype: Iterator[Tuple[int, bytes, bytes]]
+        """
+        buffer = self._buffer(self._length)
+        for positions in self._positions.values():
+            for position in positions:
+                offset = self._offset(position)
+                if buffer[offset] & LABELLED:
+                    (ind, _, b_id) = self.format.unpack(buffer, offset)
+                    label_start = offset + self.format.label_offset
+                    yield ind, b_id, bytes(buffer[label_start:label_start + LABEL_SIZE])
+
+    def append(
+            self,
+            ind: int,
+            bit_array: bitarray,
+            b_id: bytes,
+            label: Optional[bytes] = None,
+    ) -> None:
+        """Appends an entry to the file. Appends must not run concurrently with each other or with delete().
+
+        :param ind: The document identifier
+        :type ind: int
+        :param bit_array: The masked Bloom filter
+        :type bit_array: bitarray
+        :param b_id: The ID of the Bloom filter
+        :type b_id: bytes
+        :param label: The dictionary label of the keyword, if any
+        :type label: Optional[bytes]
+        :returns: None
+        :rtype: None
+        """
+        if self.format.bf_size == 0:
+            self.format = RecordFormat(len(bit_array), self.format.ind_size)
+            os.pwrite(self._fd, HEADER.pack(MAGIC, VERSION, self.format.bf_size, self.format.ind_size), 0)
+        record = self.format.pack(ind, bit_array, b_id, label)
+        os.pwrite(self._fd, record, self._offset(self._length))
+        self._positions.setdefault(b_id, []).append(self._length)
+        self._length += 1
+
+    def delete(
+            self,
+            b_id: bytes,
+    ) -> None:
+        """Marks the records of the entries with a Bloom filter ID as deleted.
+
+        :param b_id: The ID of the Bloom filter
+        :type b_id: bytes
+        :returns: None
+        :rtype: None
+        """
+        for position in self._positions.pop(b_id, []):
+            offset = self._offset(position)
+            flags = os.pread(self._fd, 1, offset)[0]
+            os.pwrite(self._fd, bytes([flags | DELETED]), offset)
+
+    def flush(
+            self,
+    ) -> None:
+        """Writes all appended and deleted records to the disk.
+
+        :returns: None
+        :rtype: None
+        """
+        os.fsync(self._fd)
+
+    def close(
+            self,
+    ) -> None:
+        """Closes the index file, if it is still open. Entries returned by earlier reads remain valid.
+
+        :returns: None
+        :rtype: None
+        """
+        self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _offset(
+            self,
+            position: int,
+    ) -> int:
+        """Computes the offset of a record in the file.
+
+        :param position: The position of the record
+        :type position: int
+        :returns: The offset of the record (bytes)
+        :rtype: int
+        """
+        return HEADER.size + position * self.format.record_size
+
+    def _stream(
+            self,
+            start: int,
+            stop: int,
+            placeholders: bool = False,
+    ) -> Iterator[Optional[Tuple[int, bitarray, bytes]]]:
+        """Iterates over the entries of a range of records like entries(), reading the records chunk by chunk into a
+        reusable buffer. The entries are copied out of the buffer, so they remain valid once the next chunk is read.
+        A read may return part of a record, which is then completed by the next read.
+
+        :param start: The position of the first record
+        :type start: int
+        :param stop: The position after the last record, at most the number of records
+        :type stop: int
+        :param placeholders: Whether to yield None for every deleted record instead of skipping it
+        :type placeholders: bool
+        :returns: An iterator over the entries
+        :rtype: Iterator[Optional[Tuple[int, bitarray, bytes]]]
+        """
+        record_size = self.format.record_size
+        records_per_chunk = max(1, self.chunk_size // record_size)
+        with self._map_lock:
+            buffer = self._chunk_buffers.pop() if len(self._chunk_buffers) > 0 else None
+        if buffer is None or len(buffer) != records_per_chunk * record_size:
+            buffer = bytearray(records_per_chunk * record_size)
+        view = memoryview(buffer)
+        unpack = self.format.unpack
+        end = self._offset(stop)
+        advise = hasattr(os, 'posix_fadvise')
+        try:
+            # Every scan reads through a file object of its own, so concurrent scans do not share a file position
+            with open(self.path, 'rb', buffering=0) as f:
+                if advise:
+                    os.posix_fadvise(f.fileno(), self._offset(start), end - self._offset(start),
+                                     os.POSIX_FADV_SEQUENTIAL)
+                f.seek(self._offset(start))
+                position = start
+                # The number of bytes of an incomplete record at the start of the buffer
+                partial = 0
+                while position < stop:
+                    size = min(records_per_chunk, stop - position) * record_size
+                    read = f.readinto(view[partial:size])
+                    if read == 0:
+                        break
+                    available = partial + read
+                    count = available // record_size
+                    partial = available - count * record_size
+                    position += count
+                    if advise and position < stop:
+                        next_offset = self._offset(position) + partial
+                        os.posix_fadvise(f.fileno(), next_offset, min(len(buffer), end - next_offset),
+                                         os.POSIX_FADV_WILLNEED)
+                    for offset in range(0, count * record_size, record_size):
+                        if view[offset] & DELETED == 0:
+                            yield unpack(view, offset, copy=True)
+                        elif placeholders:
+                            yield None
+                    if count > 0 and partial > 0:
+                        view[:partial] = view[count * record_size:available]
+        finally:
+            view.release()
+            with self._map_lock:
+                if len(self._chunk_buffers) < MAX_CHUNK_BUFFERS:
+                    self._chunk_buffers.append(buffer)
+
+    def _buffer(
+            self,
+            length: int,
+    ) -> memoryview:
+        """Returns a view of a memory map that covers at least a number of records. The file is only mapped again
+        when it has grown past the current map, and maps that are replaced stay valid for the searches using them.
+
+        :param length: The number of records to cover
+        :type length: int
+        :returns: A read-only view of the start of the file
+        :rtype: memoryview
+        """
+        size = self._offset(length)
+        with self._map_lock:
+            if self._map is None or len(self._map) < size:
+                self._map = mmap.mmap(self._fd, self._offset(self._length), access=mmap.ACCESS_READ)
+            return memoryview(self._map)
+
+
+class Segment(object):
+    """A sealed run of index entries, packed into the fixed-size records of an index file and kept in memory or in a
+    memory-mapped file. A segment never changes: deleting entries from it creates a copy that shares its records and
+    hides the deleted Bloom filter IDs, so searches that hold the original segment are not affected.
+    """
+
+    def __init__(
+            self,
+            records: memoryview,
+            record_format: RecordFormat,
+            length: int,
+            b_ids: FrozenSet[bytes],
+            deleted: FrozenSet[bytes] = frozenset(),
+            path: Optional[str] = None,
+    ) -> None:
+        """Initializes a segment. Segments are created by pack_segment().
+
+        :param records: A read-only buffer holding the header and the records
+        :type records: memoryview
+        :param record_format: The layout of the records
+        :type record_format: RecordFormat
+        :param length: The number of records
+        :type length: int
+        :param b_ids: The Bloom filter IDs of the entries
+        :type b_ids: FrozenSet[bytes]
+        :param deleted: The Bloom filter IDs of the deleted entries
+        :type deleted: FrozenSet[bytes]
+        :param path: The path of the file holding the records, or None if they are kept in memory
+        :type path: Optional[str]
+        :returns: None
+        :rtype: None
+        """
+        self.records = records
+        self.format = record_format
+        self.length = length
+        self.b_ids = b_ids
+        self.deleted = deleted
+        self.path = path
+
+    def __len__(
+            self,
+    ) -> int:
+        """Returns the number of records in the segment, including deleted records.
+
+        :returns: The number of records
+        :rtype: int
+        """
+        return self.length
+
+    def __getitem__(
+            self,
+            position: int,
+    ) -> Optional[Tuple[int, bitarray, bytes]]:
+        """Reads the entry of a record.
+
+        :param position: The position of the record
+        :type position: int
+        :returns: The entry of the record, or None if it has been deleted
+        :rtype: Optional[Tuple[int, bitarray, bytes]]
+        """
+        if not 0 <= position < self.length:
+            raise IndexError('Record position out of range')
+        entry = self.format.unpack(self.records, HEADER.size + position * self.format.record_size)
+        return None if entry[2] in self.deleted else entry
+
+    def entries(
+            self,
+            start: int,
+            stop: int,
+            placeholders: bool = False,
+    ) -> Iterator[Optional[Tuple[int, bitarray, bytes]]]:
+        """Iterates over the entries of a range of records, skipping deleted entries.
+
+        :param start: The position of the first record
+        :type start: int
+        :param stop: The position after the last record
+        :type stop: int
+        :param placeholders: Whether to yield None for every deleted entry instead of skipping it, so every record
+        yields exactly one item
+        :type placeholders: bool
+        :returns: An iterator over the entries
+        :rtype: Iterator[Optional[Tuple[int, bitarray, bytes]]]
+        """
+        (records, unpack, deleted) = (self.records, self.format.unpack, self.deleted)
+        record_size = self.format.record_size
+        for offset in range(HEADER.size + start * record_size, HEADER.size + stop * record_size, record_size):
+            entry = unpack(records, offset)
+            if entry[2] not in deleted:
+                yield entry
+            elif placeholders:
+                yield None
+
+    def delete(
+            self,
+            b_id: bytes,
+    ) -> 'Segment':
+        """Creates a copy of the segment from which the entries with a Bloom filter ID are deleted.
+
+        :param b_id: The ID of the Bloom filter
+        :type b_id: bytes
+        :returns: The copy of the segment
+        :rtype: Segment
+        """
+        return Segment(self.records, self.format, self.length, self.b_ids, self.deleted | {b_id}, self.path)
+
+
+def pack_segment(
+        entries: List[Tuple[int, bitarray, bytes]],
+        path: Optional[str] = None,
+) -> Segment:
+    """Packs index entries into a segment. If a path is given, the records are written to that file, in the format of
+    an index file, and searched through a memory map. Otherwise, they are kept in a single bytes object.
+
+    :param entries: The entries, in index order
+    :type entries: List[Tuple[int, bitarray, bytes]]
+    :param path: The path of the segment file, or None to keep the records in memory
+    :type path: Optional[str]
+    :returns: The segment
+    :rtype: Segment
+    """
+    bf_size = min([len(bit_array) for (_, bit_array, _) in entries], default=0)
+    record_format = RecordFormat(bf_size, max([_ind_size(ind) for (ind, _, _) in entries], default=1))
+    data = bytearray(HEADER.pack(MAGIC, VERSION, bf_size, record_format.ind_size))
+    for ind, bit_array, b_id in entries:
+        data += record_format.pack(ind, bit_array, b_id)
+    b_ids = frozenset(b_id for (_, _, b_id) in entries)
+    if path is None:
+        return Segment(memoryview(bytes(data)), record_format, len(entries), b_ids)
+
+    with open(path, 'w+b') as f:
+        f.write(data)
+        f.flush()
+        # The map remains valid once the file is closed
+        records = mmap.mmap(f.fileno(), len(data), access=mmap.ACCESS_READ)
+    return Segment(memoryview(records), record_format, len(entries), b_ids, path=path)
+
+
+def save_snapshot(
+        path: str,
+        sections: Sections,
+        labels: Dict[bytes, bytes],
+) -> None:
+    """Writes the entries of an index to a snapshot file. The snapshot is written to a temporary file first, which then
+    replaces the file at the path, so an existing snapshot is never left half overwritten.
+
+    :param path: The path of the snapshot file
+    :type path: str
+    :param sections: The entries of the index per length bucket
+    :type sections: Sections
+    :param labels: The dictionary labels of the entries, by Bloom filter ID
+    :type labels: Dict[bytes, bytes]
+    :returns: None
+    :rtype: None
+    """
+    entries = [entry for (_, section) in sections for entry in section]
+    bf_size = min([len(bit_array) for (_, bit_array, _) in entries], default=0)
+    record_format = RecordFormat(bf_size, max([_ind_size(ind) for (ind, _, _) in entries], default=1))
+
+    body = bytearray()
+    for bucket, section in sections:
+        body += SECTION_HEADER.pack(bucket is not None, bucket or 0, len(section))
+        for ind, bit_array, b_id in section:
+            body += record_format.pack(ind, bit_array, b_id, labels.get(b_id))
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, bf_size, record_format.ind_size, len(sections), 0)
+    checksum = zlib.crc32(body, zlib.crc32(header[:SNAPSHOT_CHECKSUM_OFFSET]))
+    header = header[:SNAPSHOT_CHECKSUM_OFFSET] + struct.pack('>I', checksum)
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(
+        path: str,
+) -> Tuple[Sections, List[Tuple[int, bytes, bytes]]]:
+    """Reads the entries of an index from a snapshot file. The file is read and verified at once, after which the
+    Bloom filters are filled directly from its contents.
+
+    :param path: The path of the snapshot file
+    :type path: str
+    :returns: The entries of the index per length bucket, and the document identifiers, Bloom filter IDs and
+    dictionary labels of the labelled entries
+    :rtype: Tuple[Sections, List[Tuple[int, bytes, bytes]]]
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < SNAPSHOT_HEADER.size:
+        raise ValueError('{0} is not a ZN snapshot'.format(path))
+    (magic, version, bf_size, ind_size, section_count, checksum) = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('{0} is not a ZN snapshot'.format(path))
+    if version != SNAPSHOT_VERSION:
+        raise ValueError('Unsupported ZN snapshot version {0}'.format(version))
+    buffer = memoryview(data)
+    if zlib.crc32(buffer[SNAPSHOT_HEADER.size:], zlib.crc32(buffer[:SNAPSHOT_CHECKSUM_OFFSET])) != checksum:
+        raise ValueError('The checksum of {0} does not match its contents'.format(path))
+
+    record_format = RecordFormat(bf_size, ind_size)
+    sections: Sections = []
+    labelled: List[Tuple[int, bytes, bytes]] = []
+    offset = SNAPSHOT_HEADER.size
+    for _ in range(section_count):
+        (is_bucket, bucket, count) = SECTION_HEADER.unpack_from(buffer, offset)
+        offset += SECTION_HEADER.size
+        section = []
+        for _ in range(count):
+            (ind, bit_array, b_id) = entry = record_format.unpack(buffer, offset, copy=True)
+            section.append(entry)
+            if buffer[offset] & LABELLED:
+                label_start = offset + record_format.label_offset
+                labelled.append((ind, b_id, bytes(buffer[label_start:label_start + LABEL_SIZE])))
+            offset += record_format.record_size
+        sections.append((bucket if is_bucket else None, section))
+    return sections, labelled
+
+
+class WriteAheadLog(object):
+    """An append-only log of the add and delete tokens applied to an index, used to recover the updates made since
+    the last snapshot.
+
+    Every record is handed to the operating system as soon as it is appended, so it survives a crash of the process.
+    To survive a crash of the machine, records are forced to the disk in groups: the log is synced once group_size
+    records are pending or once the oldest pending record is max_delay seconds old, so the cost of a sync is shared
+    by all records of a group. A timer syncs the log once max_delay has passed, also if no further records are
+    appended. Records that are still pending when the machine crashes are lost.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            group_size: int = 64,
+            max_delay: Optional[float] = None,
+    ) -> None:
+        """Opens a log file, creating it if it does not exist.
+
+        :param path: The path of the log file
+        :type path: str
+        :param group_size: The number of records after which the log is synced
+        :type group_size: int
+        :param max_delay: The age of the oldest pending record after which the log is synced (seconds), or None to
+        only sync full groups
+        :type max_delay: Optional[float]
+        :returns: None
+        :rtype: None
+        """
+        if group_size < 1:
+            raise ValueError('The group size must be at least 1')
+        self.path = path
+        self.group_size = group_size
+        self.max_delay = max_delay
+        self.pending = 0
+        self._pending_since = 0.
+        self._timer: Optional[threading.Timer] = None
+        # Syncs may run on the timer thread, concurrently with appends
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def records(
+            self,
+    ) -> Iterator[Tuple[int, object]]:
+        """Iterates over the records in the log, in the order they were appended. A record that was only partially
+        written before a crash ends the log, so it is cut off together with everything after it.
+
+        :returns: An iterator over the records, as pairs of their type and their add token or Bloom filter ID
+        :rtype: Iterator[Tuple[int, object]]
+        """
+        size = os.fstat(self._fd).st_size
+        data = os.pread(self._fd, size, 0)
+        buffer = memoryview(data)
+        offset = 0
+        while offset + LOG_RECORD_HEADER.size <= size:
+            (record_type, length, checksum) = LOG_RECORD_HEADER.unpack_from(buffer, offset)
+            payload = buffer[offset + LOG_RECORD_HEADER.size:offset + LOG_RECORD_HEADER.size + length]
+            if record_type not in (LOG_ADD, LOG_DELETE) or len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            yield record_type, self._decode_add(payload) if record_type == LOG_ADD else bytes(payload)
+            offset += LOG_RECORD_HEADER.size + length
+        if offset < size:
+            os.ftruncate(self._fd, offset)
+
+    def append_add(
+            self,
+            add_token: Tuple,
+    ) -> None:
+        """Appends an add token to the log.
+
+        :param add_token: An add token, optionally with a length bucket and dictionary label
+        :type add_token: Tuple
+        :returns: None
+        :rtype: None
+        """
+        (ind, bit_array, b_id, bucket, label) = add_token if len(add_token) == 5 else (*add_token, None, None)
+        flags = (HAS_BUCKET if bucket is not None else 0) | (HAS_LABEL if label is not None else 0)
+        if isinstance(ind, int):
+            ind_bytes = ind.to_bytes(_ind_size(ind), 'big', signed=True)
+        else:
+            ind_bytes = bytes(ind)
+            flags |= HAS_BYTES_IND
+        payload = ADD_PAYLOAD_HEADER.pack(flags, bucket or 0, len(bit_array), len(ind_bytes))
+        payload += ind_bytes + b_id + (label or b'') + bit_array.tobytes()
+        self._append(LOG_ADD, payload)
+
+    def append_delete(
+            self,
+            b_id: bytes,
+    ) -> None:
+        """Appends a delete token, a Bloom filter ID, to the log.
+
+        :param b_id: The ID of the Bloom filter of the deleted entries
+        :type b_id: bytes
+        :returns: None
+        :rtype: None
+        """
+        self._append(LOG_DELETE, b_id)
+
+    def sync(
+            self,
+    ) -> None:
+        """Forces all pending records to the disk.
+
+        :returns: None
+        :rtype: None
+        """
+        with self._lock:
+            self._sync()
+
+    def truncate(
+            self,
+    ) -> None:
+        """Removes all records from the log, once the updates they describe have been saved elsewhere.
+
+        :returns: None
+        :rtype: None
+        """
+        with self._lock:
+            os.ftruncate(self._fd, 0)
+            os.fsync(self._fd)
+            self.pending = 0
+            self._cancel_timer()
+
+    def close(
+            self,
+    ) -> None:
+        """Syncs and closes the log file.
+
+        :returns: None
+        :rtype: None
+        """
+        with self._lock:
+            self._sync()
+            os.close(self._fd)
+
+    def _append(
+            self,
+            record_type: int,
+            payload: bytes,
+    ) -> None:
+        """Appends a record to the log and syncs the log if the group of pending records is complete.
+
+        :param record_type: The type of the record, LOG_ADD or LOG_DELETE
+        :type record_type: int
+        :param payload: The payload of the record
+        :type payload: bytes
+        :returns: None
+        :rtype: None
+        """
+        with self._lock:
+            os.write(self._fd, LOG_RECORD_HEADER.pack(record_type, len(payload), zlib.crc32(payload)) + payload)
+            now = time.monotonic()
+            if self.pending == 0:
+                self._pending_since = now
+                if self.max_delay is not None:
+                    self._timer = threading.Timer(self.max_delay, self.sync)
+                    self._timer.daemon = True
+                    self._timer.start()
+            self.pending += 1
+            if self.pending >= self.group_size or (self.max_delay is not None
+                                                   and now - self._pending_since >= self.max_delay):
+                self._sync()
+
+    def _sync(
+            self,
+    ) -> None:
+        """Forces all pending records to the disk. The caller must hold the lock of the log.
+
+        :returns: None
+        :rtype: None
+        """
+        self._cancel_timer()
+        if self.pending > 0:
+            os.fsync(self._fd)
+            self.pending = 0
+
+    def _cancel_timer(
+            self,
+    ) -> None:
+        """Cancels the timer that syncs the pending records, if it is running. The caller must hold the lock of the
+        log.
+
+        :returns: None
+        :rtype: None
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @staticmethod
+    def _decode_add(
+            payload: memoryview,
+    ) -> Tuple[int, bitarray, bytes, Optional[int], Optional[bytes]]:
+        """Decodes the add token of an add record.
+
+        :param payload: The payload of the record
+        :type payload: memoryview
+        :returns: The add token, with its length bucket and dictionary label
+        :rtype: Tuple[int, bitarray, bytes, Optional[int], Optional[bytes]]
+        """
+        (flags, bucket, bf_size, ind_length) = ADD_PAYLOAD_HEADER.unpack_from(payload)
+        offset = ADD_PAYLOAD_HEADER.size
+        if flags & HAS_BYTES_IND:
+            ind = bytes(payload[offset:offset + ind_length])
+        else:
+            ind = int.from_bytes(payload[offset:offset + ind_length], 'big', signed=True)
+        offset += ind_length
+        b_id = bytes(payload[offset:offset + B_ID_SIZE])
+        offset += B_ID_SIZE
+        label = None
+        if flags & HAS_LABEL:
+            label = bytes(payload[offset:offset + LABEL_SIZE])
+            offset += LABEL_SIZE
+        bit_array = bitarray(endian='big')
+        bit_array.frombytes(payload[offset:])
+        del bit_array[bf_size:]
+        return ind, bit_array, b_id, bucket if flags & HAS_BUCKET else None, label
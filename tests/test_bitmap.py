@@ -0,0 +1,55 @@
+# Python imports
+import random
+import unittest
+
+# Third-party imports
+from bitarray import bitarray
+
+# Project imports
+from src.bitmap import Bitmap, DENSE_THRESHOLD
+
+
+class TestBitmap(unittest.TestCase):
+    def setUp(self):
+        random.seed(314)
+        self.sparse = set(random.sample(range(-10 ** 6, 10 ** 6), 1000))
+        self.dense = set(random.sample(range(1 << 16, 1 << 17), 3 * DENSE_THRESHOLD)) | set(range(100))
+
+    def test_add_discard_contains(self):
+        bitmap = Bitmap([5, 70000, -3])
+        bitmap.add(5)
+        self.assertEqual(3, len(bitmap))
+        self.assertTrue(70000 in bitmap)
+        self.assertTrue(-3 in bitmap)
+        bitmap.discard(70000)
+        bitmap.discard(123)
+        self.assertFalse(70000 in bitmap)
+        self.assertEqual([-3, 5], list(bitmap))
+
+    def test_dense_containers(self):
+        bitmap = Bitmap(self.dense)
+        self.assertTrue(isinstance(bitmap.containers[1], bitarray))
+        self.assertEqual(sorted(self.dense), list(bitmap))
+
+        for value in sorted(self.dense)[110:]:
+            bitmap.discard(value)
+        self.assertFalse(isinstance(bitmap.containers[1], bitarray))
+        self.assertEqual(sorted(self.dense)[:110], list(bitmap))
+
+    def test_set_operations(self):
+        for a in [self.sparse, self.dense]:
+            for b in [self.sparse, self.dense, set(range(50, 1 << 17, 3))]:
+                self.assertEqual(sorted(a | b), list(Bitmap(a).union(Bitmap(b))))
+                self.assertEqual(sorted(a - b), list(Bitmap(a).difference(Bitmap(b))))
+                self.assertEqual(sorted(a & b), list(Bitmap(a).intersection(Bitmap(b))))
+
+    def test_operations_do_not_modify_operands(self):
+        a = Bitmap(self.dense)
+        b = Bitmap(range(1 << 16, 1 << 17))
+        a.difference(b)
+        a.union(b)
+        self.assertEqual(Bitmap(self.dense), a)
+
+
+if __name__ == '__main__':
+    unittest.main()
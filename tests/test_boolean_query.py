@@ -0,0 +1,36 @@
+# Python imports
+import unittest
+
+# Project imports
+from src.boolean_query import evaluate_clauses, is_boolean_query, parse_boolean_query
+
+
+class TestParse(unittest.TestCase):
+    def test_is_boolean_query(self):
+        self.assertTrue(is_boolean_query('a AND b'))
+        self.assertTrue(is_boolean_query('a OR b'))
+        self.assertTrue(is_boolean_query('NOT a'))
+        self.assertFalse(is_boolean_query('a*b'))
+        self.assertFalse(is_boolean_query('sand'))
+
+    def test_parse(self):
+        (clauses, patterns) = parse_boolean_query('foo* AND NOT *bar OR baz AND foo*')
+        self.assertEqual(['foo*', '*bar', 'baz'], patterns)
+        self.assertEqual([[(False, 0), (True, 1)], [(False, 2), (False, 0)]], clauses)
+
+    def test_invalid_queries(self):
+        for q in ['NOT a', 'a OR NOT b', 'a AND ', 'a AND NOT NOT b']:
+            with self.assertRaises(ValueError):
+                parse_boolean_query(q)
+
+
+class TestEvaluate(unittest.TestCase):
+    def test_evaluate(self):
+        documents = [[1, 2, 3], [2], [4, 3]]
+        self.assertEqual([1, 3], evaluate_clauses([[(False, 0), (True, 1)]], documents))
+        self.assertEqual([3], evaluate_clauses([[(False, 0), (False, 2)]], documents))
+        self.assertEqual([2, 3, 4], evaluate_clauses([[(False, 1)], [(False, 2)]], documents))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@ import os
 import unittest
 
 # Project imports
-from src.crypto import encrypt, decrypt
+from src.crypto import decrypt, decrypt_bytes, derive_key, encrypt, encrypt_bytes
 
 
 class TestEncrypt(unittest.TestCase):
@@ -22,5 +22,20 @@ class TestEncrypt(unittest.TestCase):
                 self.assertEqual(plain_text, result)
 
 
+class TestEncryptBytes(unittest.TestCase):
+    def test_authenticated_encryption(self):
+        key = derive_key('passphrase', b'salt')
+        self.assertEqual(key, derive_key('passphrase', b'salt'))
+        cipher_text = encrypt_bytes(key, b'state', b'header')
+        self.assertEqual(b'state', decrypt_bytes(key, cipher_text, b'header'))
+
+        with self.assertRaises(ValueError):
+            decrypt_bytes(derive_key('other passphrase', b'salt'), cipher_text, b'header')
+        with self.assertRaises(ValueError):
+            decrypt_bytes(key, cipher_text, b'other header')
+        with self.assertRaises(ValueError):
+            decrypt_bytes(key, cipher_text[:-1] + bytes([cipher_text[-1] ^ 1]), b'header')
+
+
 if __name__ == '__main__':
     unittest.main()
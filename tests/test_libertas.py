@@ -1,9 +1,12 @@
 # Python imports
+import os
+import tempfile
 import unittest
 
 # Project imports
 from src.libertas.libertas_client import LibertasClient
 from src.libertas.libertas_server import LibertasServer
+from src.libertas.pair_tracker import ApproximatePairTracker, ExactPairTracker
 from src.utils import Op
 from src.zhao_nishide.zn_client import ZNClient
 from src.zhao_nishide.zn_server import ZNServer
@@ -37,6 +40,23 @@ class TestEncryptUpdates(unittest.TestCase):
         result = self.client._decrypt_update(cipher_text)
         self.assertEqual(update, result)
 
+    def test_encoding(self):
+        for update in [(1, Op.DEL, -3, 'abc'), (2 ** 64 - 1, Op.ADD, 2 ** 63 - 1, ''), (3, Op.ADD, 4, 'ñ,ü')]:
+            cipher_text = self.client._encrypt_update(*update)
+            self.assertEqual(update, self.client._decrypt_update(cipher_text))
+        with self.assertRaises(ValueError):
+            self.client._encrypt_update(1, Op.ADD, 2 ** 63, 'abc')
+
+    def test_size_classes(self):
+        client = LibertasClient(ZNClient(.01, 3), size_classes=[64, 32])
+        client.setup((256, 2048))
+        lengths = [len(client._encrypt_update(1, Op.ADD, 2, w)) for w in ['a', 'abcdefghijk', 'a' * 20, 'a' * 100]]
+        self.assertEqual(lengths[0], lengths[1])
+        self.assertEqual(lengths[0] + 32, lengths[2])
+        self.assertEqual(lengths[0] + 96, lengths[3])
+        encrypted = client._encrypt_update(1, Op.ADD, 2, 'a' * 20)
+        self.assertEqual((1, Op.ADD, 2, 'a' * 20), client._decrypt_update(encrypted))
+
 
 class TestUniquenessOfTokens(unittest.TestCase):
     def setUp(self):
@@ -131,6 +151,12 @@ class TestDelete(unittest.TestCase):
         result = self.client.dec_search(encrypted_result)
         self.assertEqual([1], result)
 
+    def test_updates_in_any_order(self):
+        updates = [(1, Op.ADD, 1, 'a'), (2, Op.ADD, 2, 'a'), (3, Op.DEL, 1, 'a'), (4, Op.ADD, 1, 'b'),
+                   (5, Op.DEL, 2, 'a'), (6, Op.ADD, 2, 'a'), (7, Op.ADD, 3, 'a'), (8, Op.DEL, 3, 'a')]
+        for shuffled_updates in [updates, updates[::-1], updates[1::2] + updates[::2]]:
+            self.assertEqual([1, 2], LibertasClient._relevant_documents(shuffled_updates))
+
 
 class TestSearch(unittest.TestCase):
     def setUp(self):
@@ -291,5 +317,481 @@ class TestSearch(unittest.TestCase):
             self.assertTrue(set(r).issubset(set(result)))
 
 
+class TestPartialSearch(unittest.TestCase):
+    def setUp(self):
+        zn_client = ZNClient(.01, 6)
+        zn_server = ZNServer()
+        self.client = LibertasClient(zn_client)
+        self.server = LibertasServer(zn_server)
+        self.client.setup((256, 2048))
+        self.server.build_index()
+
+        for ind in range(4):
+            add_token = self.client.add_token(ind, 'abc')
+            self.server.add(add_token)
+        del_token = self.client.del_token(0, 'abc')
+        self.server.delete(del_token)
+
+    def test_resumed_partial_search(self):
+        srch_token = self.client.srch_token('abc')
+        encrypted_result = []
+        cursor = 0
+        while cursor is not None:
+            partial_result = self.server.partial_search(srch_token, filter_budget=2, cursor=cursor)
+            encrypted_result += partial_result.results
+            cursor = partial_result.cursor
+        result = self.client.dec_search(encrypted_result)
+        self.assertEqual([1, 2, 3], sorted(result))
+
+
+class TestExactMatchDictionary(unittest.TestCase):
+    def setUp(self):
+        zn_client = ZNClient(.01, 6, exact_match_dictionary=True)
+        zn_server = ZNServer()
+        self.client = LibertasClient(zn_client)
+        self.server = LibertasServer(zn_server)
+        self.client.setup((256, 2048))
+        self.server.build_index()
+
+    def test_exact_search_with_delete(self):
+        for ind in range(3):
+            add_token = self.client.add_token(ind, 'abc')
+            self.server.add(add_token)
+        del_token = self.client.del_token(1, 'abc')
+        self.server.delete(del_token)
+
+        encrypted_result = self.server.search(self.client.srch_token('abc'))
+        self.assertEqual(4, len(encrypted_result))
+        self.assertEqual([0, 2], sorted(self.client.dec_search(encrypted_result)))
+        encrypted_result = self.server.search(self.client.srch_token('a*'))
+        self.assertEqual([0, 2], sorted(self.client.dec_search(encrypted_result)))
+
+
+class TestEstimate(unittest.TestCase):
+    def setUp(self):
+        zn_client = ZNClient(.01, 6)
+        zn_server = ZNServer()
+        self.client = LibertasClient(zn_client)
+        self.server = LibertasServer(zn_server)
+        self.client.setup((256, 2048))
+        self.server.build_index()
+
+    def test_estimate_counts_updates(self):
+        for ind in range(3):
+            add_token = self.client.add_token(ind, 'abc')
+            self.server.add(add_token)
+        del_token = self.client.del_token(1, 'abc')
+        self.server.delete(del_token)
+        add_token = self.client.add_token(3, 'xyz')
+        self.server.add(add_token)
+
+        estimate = self.server.estimate(self.client.srch_token('abc'), 1)
+        self.assertEqual(4, estimate.matches)
+        self.assertEqual(5, estimate.sample_size)
+
+
+class TestExplain(unittest.TestCase):
+    def test_explain(self):
+        client = LibertasClient(ZNClient(.01, 6))
+        server = LibertasServer(ZNServer())
+        client.setup((256, 2048))
+        server.build_index()
+
+        for ind in range(3):
+            add_token = client.add_token(ind, 'abc')
+            server.add(add_token)
+        del_token = client.del_token(1, 'abc')
+        server.delete(del_token)
+
+        plan = server.explain(client.srch_token('a*'))
+        self.assertEqual(4, plan.filters)
+
+
+class TestBooleanSearch(unittest.TestCase):
+    def test_boolean_search_with_deletes(self):
+        client = LibertasClient(ZNClient(.01, 6))
+        server = LibertasServer(ZNServer())
+        client.setup((256, 2048))
+        server.build_index()
+
+        for ind, w in [(0, 'foo'), (0, 'xbar'), (1, 'foo'), (2, 'foo'), (2, 'xbar')]:
+            add_token = client.add_token(ind, w)
+            server.add(add_token)
+        del_token = client.del_token(2, 'xbar')
+        server.delete(del_token)
+
+        encrypted_result = server.search(client.srch_token('foo AND NOT *bar'))
+        self.assertEqual([1, 2], sorted(client.dec_search(encrypted_result)))
+        encrypted_result = server.search(client.srch_token('foo AND *bar OR xbar'))
+        self.assertEqual([0], client.dec_search(encrypted_result))
+
+    def test_false_positives_of_negated_patterns(self):
+        client = LibertasClient(ZNClient(.6, 3))
+        server = LibertasServer(ZNServer())
+        client.setup((256, 2048))
+        server.build_index()
+
+        for ind in range(30):
+            server.add(client.add_token(ind, 'foo{0}'.format(ind)))
+
+        q = 'foo* AND NOT *z*'
+        self.assertEqual(list(range(30)), client.dec_search(server.search(client.srch_token(q)), q))
+        q = 'foo1*'
+        self.assertEqual([1] + list(range(10, 20)), client.dec_search(server.search(client.srch_token(q)), q))
+        with self.assertRaises(ValueError):
+            client.dec_search(server.search(client.srch_token('foo1*')), q='foo* AND NOT *z*')
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_save_and_load(self):
+        zn_client = ZNClient(.01, 6)
+        client = LibertasClient(zn_client)
+        client.setup((256, 2048))
+        server = LibertasServer(ZNServer())
+        server.build_index()
+        for ind in range(3):
+            server.add(client.add_token(ind, 'abc'))
+        server.delete(client.del_token(1, 'abc'))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.snapshot')
+            server.save(path)
+            restored_server = LibertasServer(ZNServer())
+            restored_server.load(path)
+
+        srch_token = client.srch_token('abc')
+        self.assertEqual(server.search(srch_token), restored_server.search(srch_token))
+        self.assertEqual([0, 2], client.dec_search(restored_server.search(srch_token)))
+
+
+class TestPackedCipherTexts(unittest.TestCase):
+    def setUp(self):
+        zn_client = ZNClient(.01, 6)
+        self.client = LibertasClient(zn_client)
+        self.client.setup((256, 2048))
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fill(self, server):
+        for ind in range(3):
+            server.add(self.client.add_token(ind, 'abc'))
+        server.delete(self.client.del_token(1, 'abc'))
+
+    def test_cipher_texts_are_bytes(self):
+        cipher_text = self.client._encrypt_update(1, Op.ADD, 2, 'abc')
+        self.assertIsInstance(cipher_text, bytes)
+        self.assertEqual((1, Op.ADD, 2, 'abc'), self.client._decrypt_update(memoryview(cipher_text)))
+
+    def test_segment_results_are_slices(self):
+        zn_server = ZNServer(segment_size=2)
+        server = LibertasServer(zn_server)
+        server.build_index()
+        self.fill(server)
+        self.assertEqual(2, len(zn_server.segments))
+
+        r_star = server.search(self.client.srch_token('abc'))
+        self.assertEqual(4, len(r_star))
+        self.assertTrue(all(isinstance(e, memoryview) for e in r_star))
+        self.assertEqual([0, 2], self.client.dec_search(r_star))
+
+    def test_index_file(self):
+        zn_server = ZNServer()
+        server = LibertasServer(zn_server)
+        zn_server.build_index(os.path.join(self.directory.name, 'index.zn'), ind_size=64)
+        self.fill(server)
+
+        r_star = server.search(self.client.srch_token('ab*'))
+        self.assertTrue(all(isinstance(e, memoryview) for e in r_star))
+        self.assertEqual([0, 2], self.client.dec_search(r_star))
+        zn_server.index.close()
+
+
+class TestClientState(unittest.TestCase):
+    def test_save_and_load(self):
+        client = LibertasClient(ZNClient(.01, 6))
+        client.setup((256, 2048))
+        server = LibertasServer(ZNServer())
+        server.build_index()
+        for ind in range(3):
+            server.add(client.add_token(ind, 'abc'))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'client.state')
+            client.save(path, 'passphrase')
+            restored_client = LibertasClient(ZNClient(.01, 6))
+            restored_client.load(path, 'passphrase')
+
+        self.assertEqual(client.k, restored_client.k)
+        self.assertEqual(3, restored_client.t)
+        server.delete(restored_client.del_token(1, 'abc'))
+        self.assertEqual([0, 2], restored_client.dec_search(server.search(restored_client.srch_token('abc'))))
+
+
+class TestParallelDecryption(unittest.TestCase):
+    def setUp(self):
+        self.client = LibertasClient(ZNClient(.01, 6), decryption_workers=2, parallel_threshold=1)
+        self.client.setup((256, 2048))
+        self.server = LibertasServer(ZNServer())
+        self.server.build_index()
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_parallel_dec_search(self):
+        for ind in range(20):
+            self.server.add(self.client.add_token(ind, 'abc'))
+        for ind in range(0, 20, 3):
+            self.server.delete(self.client.del_token(ind, 'abc'))
+        self.server.add(self.client.add_token(3, 'abc'))
+
+        r_star = self.server.search(self.client.srch_token('abc'))
+        expected = [ind for ind in range(20) if ind % 3 != 0 or ind == 3]
+        self.assertEqual(expected, self.client.dec_search(r_star))
+        self.assertEqual(expected, LibertasClient._relevant_documents(self.client._decrypt_update(e) for e in r_star))
+
+    def test_parallel_dec_search_with_query(self):
+        for ind in range(20):
+            self.server.add(self.client.add_token(ind, 'abc' if ind < 10 else 'abd'))
+        # The updates of abd stand in for false positives of the Bloom filters
+        r_star = self.server.search(self.client.srch_token('ab_'))
+        self.assertEqual(list(range(20)), self.client.dec_search(r_star))
+        self.assertEqual(list(range(10)), self.client.dec_search(r_star, 'abc'))
+
+    def test_cached_parallel_dec_search(self):
+        self.client.cache_size = 100000
+        for ind in range(10):
+            self.server.add(self.client.add_token(ind, 'abc'))
+        self.server.delete(self.client.del_token(4, 'abc'))
+        r_star = self.server.search(self.client.srch_token('abc'))
+        self.assertEqual([0, 1, 2, 3, 5, 6, 7, 8, 9], self.client.dec_search(r_star))
+        self.assertEqual(11, len(self.client._update_cache))
+        self.client.k = os.urandom(32)
+        # Every update is served from the cache, so the changed key is not used
+        self.assertEqual([0, 1, 2, 3, 5, 6, 7, 8, 9], self.client.dec_search(r_star))
+
+    def test_new_key(self):
+        self.server.add(self.client.add_token(1, 'abc'))
+        self.client.dec_search(self.server.search(self.client.srch_token('abc')))
+        self.client.setup((256, 2048))
+        self.server.build_index()
+        self.server.add(self.client.add_token(2, 'abc'))
+        self.assertEqual([2], self.client.dec_search(self.server.search(self.client.srch_token('abc'))))
+
+
+class TestUpdateCache(unittest.TestCase):
+    def setUp(self):
+        self.client = LibertasClient(ZNClient(.01, 6), cache_size=10000)
+        self.client.setup((256, 2048))
+        self.server = LibertasServer(ZNServer())
+        self.server.build_index()
+        for ind in range(5):
+            self.server.add(self.client.add_token(ind, 'abc'))
+        self.server.delete(self.client.del_token(2, 'abc'))
+
+    def test_cached_search(self):
+        r_star = self.server.search(self.client.srch_token('abc'))
+        self.assertEqual([0, 1, 3, 4], self.client.dec_search(r_star))
+        self.assertEqual(6, len(self.client._update_cache))
+        self.client.k = os.urandom(32)
+        # Every update is served from the cache, so the changed key is not used
+        self.assertEqual([0, 1, 3, 4], self.client.dec_search(r_star))
+
+    def test_eviction(self):
+        r_star = self.server.search(self.client.srch_token('abc'))
+        self.client.dec_search(r_star[:1])
+        self.client.cache_size = self.client.cache_usage * 2
+        self.client.dec_search(r_star[1:3])
+        self.assertLessEqual(self.client.cache_usage, self.client.cache_size)
+        self.assertEqual(2, len(self.client._update_cache))
+        self.assertIsNone(self.client._cached_update(r_star[0]))
+        self.assertIsNotNone(self.client._cached_update(r_star[2]))
+
+    def test_new_key(self):
+        self.client.dec_search(self.server.search(self.client.srch_token('abc')))
+        self.client.setup((256, 2048))
+        self.assertEqual(0, self.client.cache_usage)
+        self.assertEqual(0, len(self.client._update_cache))
+
+
+class TestConsolidation(unittest.TestCase):
+    def setUp(self):
+        self.client = LibertasClient(ZNClient(.01, 6))
+        self.client.setup((256, 2048))
+        self.zn_server = ZNServer()
+        self.server = LibertasServer(self.zn_server)
+        self.server.build_index()
+
+        for ind in range(4):
+            self.server.add(self.client.add_token(ind, 'abc'))
+            self.server.add(self.client.add_token(ind, 'abd'))
+        self.server.add(self.client.add_token(9, 'xyz'))
+        for ind in range(3):
+            self.server.delete(self.client.del_token(ind, 'abc'))
+        self.server.add(self.client.add_token(1, 'abc'))
+
+    def test_consolidate(self):
+        r_star = self.server.search(self.client.srch_token('abc'))
+        result = self.client.dec_search(r_star)
+        consolidation_token = self.client.consolidate('abc', r_star)
+        self.assertEqual(7, len(consolidation_token.del_tokens))
+        self.assertEqual(1, len(consolidation_token.add_tokens))
+        self.server.consolidate(consolidation_token)
+
+        self.assertEqual(7, len(self.zn_server.index))
+        r_star = self.server.search(self.client.srch_token('abc'))
+        self.assertEqual(2, len(r_star))
+        self.assertEqual(result, self.client.dec_search(r_star))
+        self.assertEqual([0, 1, 2, 3], self.client.dec_search(self.server.search(self.client.srch_token('abd'))))
+        self.assertEqual(0, len(self.client.consolidate('abc', r_star).del_tokens))
+
+    def test_wildcard_query(self):
+        self.server.delete(self.client.del_token(3, 'abd'))
+        r_star = self.server.search(self.client.srch_token('ab_'))
+        self.server.consolidate(self.client.consolidate('ab_', r_star))
+        self.assertEqual(6, len(self.zn_server.index))
+        self.assertEqual([0, 1, 2, 3], self.client.dec_search(self.server.search(self.client.srch_token('ab*'))))
+
+    def test_updates_after_search(self):
+        r_star = self.server.search(self.client.srch_token('abc'))
+        self.server.delete(self.client.del_token(1, 'abc'))
+        self.server.consolidate(self.client.consolidate('abc', r_star))
+        self.assertEqual([3], self.client.dec_search(self.server.search(self.client.srch_token('abc'))))
+
+    def test_boolean_query(self):
+        with self.assertRaises(ValueError):
+            self.client.consolidate('abc AND abd', [])
+
+
+class TestUpdateBuffer(unittest.TestCase):
+    def setUp(self):
+        self.client = LibertasClient(ZNClient(.01, 6), buffer_size=4)
+        self.client.setup((256, 2048))
+        self.server = LibertasServer(ZNServer())
+        self.server.build_index()
+
+    def send(self, tokens):
+        for token in tokens:
+            self.server.add(token)
+
+    def search(self, q):
+        return self.client.dec_search(self.server.search(self.client.srch_token(q)))
+
+    def test_cancellation(self):
+        self.assertEqual([], self.client.buffer_add(1, 'abc'))
+        self.assertEqual([], self.client.buffer_add(2, 'abc'))
+        self.assertEqual([], self.client.buffer_delete(1, 'abc'))
+        self.assertEqual([], self.client.buffer_add(2, 'abc'))
+        tokens = self.client.flush()
+        self.assertEqual(2, len(tokens))
+        self.send(tokens)
+        self.assertEqual([2], self.search('abc'))
+        self.assertEqual([], self.client.flush())
+
+    def test_delete_of_flushed_pair(self):
+        self.send(self.client.buffer_add(1, 'abc') + self.client.flush())
+        self.send(self.client.buffer_delete(1, 'abc') + self.client.buffer_add(1, 'abd')
+                  + self.client.buffer_delete(1, 'abd') + self.client.flush())
+        self.assertEqual([], self.search('ab_'))
+
+    def test_direct_update_of_buffered_pair(self):
+        self.assertEqual([], self.client.buffer_add(1, 'abc'))
+        self.assertEqual([], self.client.buffer_add(2, 'abc'))
+        self.server.add(self.client.del_token(1, 'abc'))
+        self.send(self.client.flush())
+        self.assertEqual([2], self.search('abc'))
+
+        self.assertEqual([], self.client.buffer_delete(2, 'abc'))
+        self.server.add(self.client.add_token(2, 'abc'))
+        self.assertEqual([], self.client.flush())
+        self.assertEqual([2], self.search('abc'))
+
+    def test_flush_by_size(self):
+        for ind in range(3):
+            self.assertEqual([], self.client.buffer_add(ind, 'abc'))
+        self.send(self.client.buffer_add(3, 'abc'))
+        self.assertEqual([0, 1, 2, 3], self.search('abc'))
+
+    def test_flush_by_age(self):
+        self.client.buffer_max_age = 0.
+        self.send(self.client.buffer_add(1, 'abc'))
+        self.assertEqual([1], self.search('abc'))
+
+    def test_export_state(self):
+        self.client.buffer_add(1, 'abc')
+        with self.assertRaises(ValueError):
+            self.client.export_state()
+        self.client.flush()
+        self.assertEqual(1, self.client.export_state()['t'])
+
+
+class TestPairTracker(unittest.TestCase):
+    def setUp(self):
+        self.server = LibertasServer(ZNServer())
+        self.server.build_index()
+
+    def client(self, pair_tracker, **kwargs):
+        client = LibertasClient(ZNClient(.01, 6), pair_tracker=pair_tracker, **kwargs)
+        client.setup((256, 2048))
+        return client
+
+    def test_exact(self):
+        client = self.client(ExactPairTracker())
+        self.server.add(client.add_token(1, 'abc'))
+        self.assertIsNone(client.add_token(1, 'abc'))
+        self.assertIsNone(client.del_token(2, 'abc'))
+        self.server.delete(client.del_token(1, 'abc'))
+        self.assertIsNone(client.del_token(1, 'abc'))
+        self.server.add(client.add_token(1, 'abc'))
+        self.assertEqual(3, client.t)
+        self.assertEqual(3, len(self.server.search(client.srch_token('abc'))))
+        self.assertEqual([1], client.dec_search(self.server.search(client.srch_token('abc'))))
+
+    def test_approximate(self):
+        client = self.client(ApproximatePairTracker(100, .01))
+        self.server.add(client.add_token(1, 'abc'))
+        self.assertIsNotNone(client.add_token(1, 'abc'))
+        self.assertIsNone(client.del_token(2, 'abc'))
+        self.assertIsNotNone(client.del_token(1, 'abc'))
+        self.assertIsNotNone(client.del_token(1, 'abc'))
+
+    def test_error_rate(self):
+        tracker = ApproximatePairTracker(1000, .01)
+        for ind in range(1000):
+            tracker.add(ind, 'abc')
+        self.assertTrue(all(tracker.may_be_live(ind, 'abc') for ind in range(1000)))
+        false_positives = sum(tracker.may_be_live(ind, 'abc') for ind in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+
+    def test_buffer(self):
+        client = self.client(ExactPairTracker(), buffer_size=10)
+        client.buffer_add(1, 'abc')
+        client.buffer_delete(1, 'abc')
+        client.buffer_add(2, 'abc')
+        self.assertEqual(1, len(client.flush()))
+
+    def test_export_state(self):
+        trackers = [(ExactPairTracker(), ExactPairTracker()),
+                    (ApproximatePairTracker(100, .01), ApproximatePairTracker(10, .5))]
+        for (pair_tracker, restored_pair_tracker) in trackers:
+            client = self.client(pair_tracker)
+            client.add_token(1, 'abc')
+            restored_client = LibertasClient(ZNClient(.01, 6), pair_tracker=restored_pair_tracker)
+            restored_client.import_state(client.export_state())
+            self.assertIsNone(restored_client.del_token(2, 'abc'))
+            self.assertIsNotNone(restored_client.del_token(1, 'abc'))
+
+    def test_mismatched_state(self):
+        client = self.client(ExactPairTracker())
+        restored_client = LibertasClient(ZNClient(.01, 6), pair_tracker=ApproximatePairTracker(10, .5))
+        with self.assertRaises(ValueError):
+            restored_client.import_state(client.export_state())
+        state = ApproximatePairTracker(10, .5).export_state()
+        state['bits'] = state['bits'][2:]
+        with self.assertRaises(ValueError):
+            ApproximatePairTracker(10, .5).import_state(state)
+
+
 if __name__ == '__main__':
     unittest.main()
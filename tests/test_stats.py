@@ -0,0 +1,33 @@
+# Python imports
+import unittest
+
+# Project imports
+from src.stats import Stats
+
+
+class TestStats(unittest.TestCase):
+    def test_count_and_observe(self):
+        stats = Stats()
+        stats.count('a')
+        stats.count('a', 2)
+        stats.observe('h', 3)
+        stats.observe('h', 3)
+        stats.observe('h', 1)
+        self.assertEqual({'counters': {'a': 3}, 'histograms': {'h': {3: 2, 1: 1}}}, stats.snapshot())
+
+    def test_merge_and_reset(self):
+        stats = Stats()
+        stats.count('a')
+        other = Stats()
+        other.count('a')
+        other.count('b')
+        other.observe('h', 2)
+        stats.merge(other)
+        self.assertEqual({'counters': {'a': 2, 'b': 1}, 'histograms': {'h': {2: 1}}}, stats.snapshot())
+
+        stats.reset()
+        self.assertEqual({'counters': {}, 'histograms': {}}, stats.snapshot())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,16 @@
 # Python imports
+import os
+import sys
+import tempfile
+import threading
 import unittest
+from unittest import mock
 
 # Project imports
+from src.utils import PartialSearchResult
 from src.zhao_nishide.zn_client import ZNClient
 from src.zhao_nishide.zn_server import ZNServer
+from src.zhao_nishide.zn_storage import MAX_CHUNK_BUFFERS, MappedIndex, WriteAheadLog
 
 
 class TestSetup(unittest.TestCase):
@@ -242,5 +249,822 @@ class TestSearch(unittest.TestCase):
             self.assertTrue(set(r).issubset(result))
 
 
+class TestIterSearch(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+
+        for ind in range(10):
+            for w in ['abc', 'abcd']:
+                add_token = self.client.add_token(ind, w)
+                self.server.add(add_token)
+
+    def test_iter_search_deduplicates(self):
+        srch_token = self.client.srch_token('abc*')
+        result = list(self.server.iter_search(srch_token))
+        self.assertEqual(list(range(10)), result)
+
+    def test_iter_search_limit(self):
+        srch_token = self.client.srch_token('abc*')
+        self.assertEqual([0, 1, 2], list(self.server.iter_search(srch_token, limit=3)))
+        self.assertEqual([], list(self.server.iter_search(srch_token, limit=0)))
+        self.assertEqual(list(range(10)), list(self.server.iter_search(srch_token, limit=20)))
+
+
+class TestPartialSearch(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+
+        for ind in range(10):
+            add_token = self.client.add_token(ind, 'abc')
+            self.server.add(add_token)
+
+    def test_unbounded_partial_search(self):
+        srch_token = self.client.srch_token('abc')
+        result = self.server.partial_search(srch_token)
+        self.assertEqual(list(range(10)), result.results)
+        self.assertEqual(1., result.scanned_fraction)
+        self.assertIsNone(result.cursor)
+
+    def test_filter_budget_and_resume(self):
+        srch_token = self.client.srch_token('abc')
+        result = self.server.partial_search(srch_token, filter_budget=4)
+        self.assertEqual([0, 1, 2, 3], result.results)
+        self.assertEqual(.4, result.scanned_fraction)
+        self.assertEqual(4, result.cursor)
+
+        result = self.server.partial_search(srch_token, filter_budget=100, cursor=result.cursor)
+        self.assertEqual([4, 5, 6, 7, 8, 9], result.results)
+        self.assertEqual(1., result.scanned_fraction)
+        self.assertIsNone(result.cursor)
+
+    def test_exhausted_time_budget(self):
+        srch_token = self.client.srch_token('abc')
+        result = self.server.partial_search(srch_token, time_budget=0)
+        self.assertEqual([0], result.results)
+        self.assertEqual(.1, result.scanned_fraction)
+        self.assertEqual(1, result.cursor)
+
+    def test_minimal_budgets_terminate(self):
+        srch_token = self.client.srch_token('abc')
+        for budgets in [{'time_budget': 0}, {'filter_budget': 1}]:
+            results = []
+            cursor = 0
+            calls = 0
+            while cursor is not None:
+                result = self.server.partial_search(srch_token, cursor=cursor, **budgets)
+                results += result.results
+                cursor = result.cursor
+                calls += 1
+            self.assertEqual(list(range(10)), results)
+            self.assertEqual(10, calls)
+
+    def test_zero_filter_budget(self):
+        with self.assertRaises(ValueError):
+            self.server.partial_search(self.client.srch_token('abc'), filter_budget=0)
+
+    def test_trailing_deleted_records(self):
+        self.server.seal()
+        self.server.delete(self.client.del_token(8, 'abc'))
+        self.server.delete(self.client.del_token(9, 'abc'))
+        srch_token = self.client.srch_token('abc')
+        results = []
+        cursor = 0
+        calls = 0
+        while cursor is not None:
+            result = self.server.partial_search(srch_token, filter_budget=3, cursor=cursor)
+            results += result.results
+            cursor = result.cursor
+            calls += 1
+        self.assertEqual(list(range(8)), results)
+        self.assertEqual(4, calls)
+        self.assertEqual(PartialSearchResult([], 1., None), result)
+
+
+class TestConcurrency(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+
+        for ind in range(10):
+            add_token = self.client.add_token(ind, 'abc')
+            self.server.add(add_token)
+        self.add_tokens = [self.client.add_token(ind, 'abc') for ind in range(10, 40)]
+        self.del_tokens = [self.client.del_token(ind, 'abc') for ind in range(10, 40, 2)]
+
+    def test_search_during_updates(self):
+        srch_token = self.client.srch_token('abc')
+        results = []
+
+        def write():
+            for add_token in self.add_tokens:
+                self.server.add(add_token)
+            for del_token in self.del_tokens:
+                self.server.delete(del_token)
+
+        def read():
+            for _ in range(20):
+                results.append(self.server.search(srch_token))
+
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for result in results:
+            self.assertEqual(len(result), len(set(result)))
+            self.assertTrue(set(range(10)).issubset(result))
+        self.assertEqual(list(range(10)) + list(range(11, 40, 2)), self.server.search(srch_token))
+
+    def test_search_during_sealing(self):
+        server = ZNServer(segment_size=3, max_segments=2)
+        server.build_index()
+        for ind in range(10):
+            server.add(self.client.add_token(ind, 'abc'))
+        srch_token = self.client.srch_token('abc')
+        results = []
+
+        def write():
+            for add_token in self.add_tokens:
+                server.add(add_token)
+
+        def read():
+            for _ in range(50):
+                results.append(server.search(srch_token))
+
+        # Switch threads often, so searches run between the steps of a seal
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        if server._merger is not None:
+            server._merger.join()
+
+        for result in results:
+            self.assertEqual(len(result), len(set(result)))
+            self.assertTrue(set(range(10)).issubset(result))
+        self.assertEqual(list(range(40)), server.search(srch_token))
+
+    def test_seal_between_snapshot_reads(self):
+        class SealingServer(ZNServer):
+            # Seals the untagged entries as soon as the segments are read, like a concurrent seal could
+            sealing = False
+
+            @property
+            def segments(self):
+                segments = self.__dict__['segments']
+                if self.sealing:
+                    self.sealing = False
+                    self.seal()
+                return segments
+
+            @segments.setter
+            def segments(self, segments):
+                self.__dict__['segments'] = segments
+
+        server = SealingServer(segment_size=4)
+        server.build_index()
+        for ind in range(3):
+            server.add(self.client.add_token(ind, 'abc'))
+        server.sealing = True
+        self.assertEqual([0, 1, 2], server.search(self.client.srch_token('abc')))
+
+
+class TestLengthBuckets(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, length_bucket_width=2)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+
+        self.keywords = ['ab', 'abc', 'abcd', 'abcdef', 'bcdefgh']
+        for ind, w in zip(range(len(self.keywords)), self.keywords):
+            add_token = self.client.add_token(ind, w)
+            self.server.add(add_token)
+
+    def test_entries_are_bucketed(self):
+        self.assertEqual([], self.server.index)
+        self.assertEqual({1: 2, 2: 1, 3: 2}, {bucket: len(entries) for bucket, entries in self.server.buckets.items()})
+
+    def test_bucketed_searches(self):
+        queries = ['abc', 'ab__', '_cdefgh', 'ab*', '*', 'xyz']
+        results = [[1], [2], [4], [0, 1, 2, 3], [0, 1, 2, 3, 4], []]
+
+        for q, r in zip(queries, results):
+            srch_token = self.client.srch_token(q)
+            result = self.server.search(srch_token)
+            self.assertTrue(set(r).issubset(result))
+
+    def test_only_matching_bucket_is_scanned(self):
+        srch_token = self.client.srch_token('abc')
+        result = self.server.partial_search(srch_token, filter_budget=2)
+        self.assertEqual([1], result.results)
+        self.assertIsNone(result.cursor)
+
+    def test_bucketed_delete(self):
+        del_token = self.client.del_token(1, 'abc')
+        self.server.delete(del_token)
+        srch_token = self.client.srch_token('abc')
+        self.assertEqual([], self.server.search(srch_token))
+
+
+class TestExactMatchDictionary(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, length_bucket_width=1, exact_match_dictionary=True)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+
+        self.keywords = ['abc', 'abd', 'abcd', 'abc']
+        for ind, w in zip(range(len(self.keywords)), self.keywords):
+            add_token = self.client.add_token(ind, w)
+            self.server.add(add_token)
+
+    def test_exact_search_uses_dictionary(self):
+        srch_token = self.client.srch_token('abc')
+        self.assertEqual(([], []), srch_token[:2])
+        self.assertEqual([0, 3], self.server.search(srch_token))
+        self.assertEqual([0], list(self.server.iter_search(srch_token, limit=1)))
+        self.assertEqual([], self.server.search(self.client.srch_token('ab')))
+
+    def test_wildcard_search_scans_filters(self):
+        srch_token = self.client.srch_token('ab_')
+        self.assertIsNone(srch_token[3])
+        self.assertTrue({0, 1, 3}.issubset(self.server.search(srch_token)))
+
+    def test_dictionary_delete(self):
+        del_token = self.client.del_token(0, 'abc')
+        self.server.delete(del_token)
+        self.assertEqual([3], self.server.search(self.client.srch_token('abc')))
+        del_token = self.client.del_token(3, 'abc')
+        self.server.delete(del_token)
+        self.assertEqual([], self.server.search(self.client.srch_token('abc')))
+        self.assertNotIn(self.client._label('abc'), self.server.dictionary)
+
+
+class TestEstimate(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+
+        for ind in range(20):
+            add_token = self.client.add_token(ind, 'abc' if ind % 4 == 0 else 'xyz')
+            self.server.add(add_token)
+
+    def test_full_sample_is_exact(self):
+        estimate = self.server.estimate(self.client.srch_token('abc'), 1)
+        self.assertEqual((5, 5, 5, 20), estimate)
+
+    def test_partial_sample(self):
+        estimate = self.server.estimate(self.client.srch_token('abc'), .5)
+        self.assertEqual(10, estimate.sample_size)
+        self.assertTrue(0 <= estimate.lower <= estimate.matches <= estimate.upper <= 20)
+
+    def test_sample_without_hits(self):
+        estimate = self.server.estimate(self.client.srch_token('bcd'), .5)
+        self.assertEqual(0, estimate.matches)
+        self.assertEqual(0, estimate.lower)
+        self.assertGreater(estimate.upper, 0)
+
+    def test_empty_index(self):
+        self.server.build_index()
+        self.assertEqual((0, 0, 0, 0), self.server.estimate(self.client.srch_token('abc'), .1))
+
+    def test_invalid_sample_rate(self):
+        with self.assertRaises(ValueError):
+            self.server.estimate(self.client.srch_token('abc'), 0)
+
+
+class TestExplain(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, length_bucket_width=1)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+
+        for ind, w in enumerate(['abc', 'abd', 'abcd']):
+            add_token = self.client.add_token(ind, w)
+            self.server.add(add_token)
+
+    def test_explain(self):
+        srch_token = self.client.srch_token('ab_')
+        plan = self.server.explain(srch_token)
+        self.assertFalse(plan.dictionary_lookup)
+        self.assertEqual(2, plan.filters)
+        self.assertEqual(len(srch_token[0]), plan.positions)
+        self.assertEqual(len(set(srch_token[0])), plan.distinct_positions)
+        self.assertTrue(1 <= plan.expected_hmacs_per_filter <= 2)
+        self.assertIsNone(plan.estimated_seconds)
+
+        self.server.search(self.client.srch_token('*'))
+        plan = self.server.explain(srch_token)
+        self.assertIsNotNone(plan.estimated_seconds)
+        self.assertEqual(3, self.server.explain(self.client.srch_token('a*')).filters)
+
+    def test_explain_dictionary_lookup(self):
+        client = ZNClient(.01, 6, exact_match_dictionary=True)
+        client.setup(2048)
+        plan = self.server.explain(client.srch_token('abc'))
+        self.assertTrue(plan.dictionary_lookup)
+        self.assertEqual(0, plan.filters)
+
+
+class TestStats(unittest.TestCase):
+    def test_stats_disabled_by_default(self):
+        client = ZNClient(.01, 6)
+        client.setup(2048)
+        server = ZNServer()
+        server.build_index()
+        server.search(client.srch_token('abc'))
+        self.assertIsNone(client.stats())
+        self.assertIsNone(server.stats())
+
+    def test_stats(self):
+        client = ZNClient(.01, 6, collect_stats=True)
+        client.setup(2048)
+        server = ZNServer(collect_stats=True)
+        server.build_index()
+
+        for ind, w in [(0, 'abc'), (0, 'abcd'), (1, 'xyz')]:
+            add_token = client.add_token(ind, w)
+            server.add(add_token)
+        srch_token = client.srch_token('abc*')
+        self.assertEqual([0], server.search(srch_token))
+
+        client_counters = client.stats()['counters']
+        self.assertEqual(3, client_counters['add_tokens'])
+        self.assertEqual(1, client_counters['srch_tokens'])
+        self.assertEqual(2 * len(srch_token[0]), client_counters['srch_token_prf_calls'])
+        self.assertTrue(client_counters['add_token_prf_calls'] > 3 * 2 * client.bf_size)
+
+        server_stats = server.stats()
+        distinct_positions = len(set(srch_token[0]))
+        self.assertEqual(1, server_stats['counters']['searches'])
+        self.assertEqual(2, server_stats['counters']['filters_scanned'])
+        self.assertEqual(1, server_stats['counters']['matches'])
+        self.assertEqual(1, server_stats['counters']['duplicate_suppressions'])
+        depths = server_stats['histograms']['early_exit_depth']
+        self.assertEqual({1}, set(depths.values()))
+        self.assertEqual(distinct_positions + sum(depths), server_stats['counters']['hmacs'])
+
+    def test_matched_documents_are_skipped(self):
+        client = ZNClient(.01, 6)
+        client.setup(2048)
+        server = ZNServer(collect_stats=True)
+        server.build_index()
+
+        keywords = ['abc', 'abcd', 'abcde', 'abcdef']
+        for w in keywords:
+            add_token = client.add_token(1, w)
+            server.add(add_token)
+        self.assertEqual([1], server.search(client.srch_token('abc*')))
+        counters = server.stats()['counters']
+        self.assertEqual(1, counters['filters_scanned'])
+        self.assertEqual(len(keywords) - 1, counters['duplicate_suppressions'])
+
+
+class TestBooleanSearch(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, collect_stats=True)
+        self.client.setup(2048)
+        self.server = ZNServer(collect_stats=True)
+        self.server.build_index()
+
+        pairs = [(0, 'foo'), (0, 'xbar'), (1, 'foobar'), (2, 'food'), (3, 'bar')]
+        for ind, w in pairs:
+            add_token = self.client.add_token(ind, w)
+            self.server.add(add_token)
+
+    def test_boolean_searches(self):
+        queries = ['foo* AND NOT *bar', 'foo* AND *bar', 'foo OR bar', 'foo* AND NOT *bar OR bar']
+        results = [[2], [0, 1], [0, 3], [2, 3]]
+
+        for q, r in zip(queries, results):
+            srch_token = self.client.srch_token(q)
+            self.assertEqual(sorted(r), sorted(self.server.search(srch_token)))
+
+    def test_single_scan(self):
+        self.server.search(self.client.srch_token('foo* AND NOT *bar'))
+        self.assertEqual(1, self.server.stats()['counters']['searches'])
+
+    def test_multi_search(self):
+        srch_tokens = [self.client.srch_token('foo*'), self.client.srch_token('*bar')]
+        self.assertEqual([[0, 1, 2], [0, 1, 3]], self.server.multi_search(srch_tokens))
+
+    def test_unsupported_operations(self):
+        srch_token = self.client.srch_token('foo OR bar')
+        with self.assertRaises(ValueError):
+            self.server.partial_search(srch_token)
+
+
+class TestMappedIndex(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, exact_match_dictionary=True)
+        self.client.setup(2048)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'index.zn')
+        self.server = ZNServer()
+        self.server.build_index(self.path)
+
+        self.keywords = ['abc', 'abd', 'bcd', 'abc']
+        for ind, w in zip(range(len(self.keywords)), self.keywords):
+            self.server.add(self.client.add_token(ind, w))
+
+    def tearDown(self):
+        self.server.index.close()
+        self.directory.cleanup()
+
+    def test_search_in_place(self):
+        self.assertIsInstance(self.server.index, MappedIndex)
+        self.assertEqual(4, len(self.server.index))
+        self.assertEqual([0, 3], self.server.search(self.client.srch_token('abc')))
+        self.assertTrue({0, 1, 3}.issubset(self.server.search(self.client.srch_token('ab_'))))
+        self.assertEqual([2], self.server.search(self.client.srch_token('*cd')))
+        self.assertEqual(1., self.server.estimate(self.client.srch_token('*cd'), 1.).matches)
+        self.assertEqual((2, 2, 2, 0), self.server.estimate(self.client.srch_token('abc'), .5))
+
+    def test_delete(self):
+        self.server.delete(self.client.del_token(0, 'abc'))
+        self.server.delete(self.client.del_token(2, 'bcd'))
+        self.assertEqual(4, len(self.server.index))
+        self.assertEqual([3], self.server.search(self.client.srch_token('abc')))
+        self.assertEqual([], self.server.search(self.client.srch_token('*cd')))
+        self.assertEqual(0., self.server.estimate(self.client.srch_token('*cd'), 1.).matches)
+
+    def test_reopen(self):
+        self.server.delete(self.client.del_token(0, 'abc'))
+        index = self.server.index
+        self.server.build_index(self.path)
+        self.assertIsNone(index._fd)
+        self.assertEqual(4, len(self.server.index))
+        self.assertEqual(3, sum(len(positions) for positions in self.server.index._positions.values()))
+        self.assertEqual([3], self.server.search(self.client.srch_token('abc')))
+        self.assertEqual([1], self.server.search(self.client.srch_token('_bd')))
+
+        self.server.add(self.client.add_token(4, 'bcd'))
+        self.assertEqual([2, 4], self.server.search(self.client.srch_token('b_d')))
+
+    def test_document_identifier_size(self):
+        with self.assertRaises(ValueError):
+            self.server.add(self.client.add_token(1 << 64, 'abc'))
+
+    def test_streaming_search(self):
+        self.server.delete(self.client.del_token(2, 'bcd'))
+        self.server.index.close()
+        self.server.build_index(self.path, chunk_size=1)
+        self.assertEqual(1, self.server.index.chunk_size)
+        self.assertEqual([0, 1, 3], self.server.search(self.client.srch_token('ab*')))
+        self.assertEqual([], self.server.search(self.client.srch_token('bcd')))
+        self.assertEqual(PartialSearchResult([1], .5, 2),
+                         self.server.partial_search(self.client.srch_token('_bd'), filter_budget=2))
+
+        self.server.index.chunk_size = 2 * self.server.index.format.record_size
+        self.assertEqual([0, 1], list(self.server.iter_search(self.client.srch_token('ab*'), limit=2)))
+        self.assertEqual([0, 1, 3], self.server.search(self.client.srch_token('ab*')))
+        self.assertEqual(1, len(self.server.index._chunk_buffers))
+
+    def test_short_reads(self):
+        class ShortReads(object):
+            def __init__(self, f):
+                self.f = f
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self.f.close()
+
+            def readinto(self, b):
+                return self.f.readinto(memoryview(b)[:7])
+
+            def __getattr__(self, name):
+                return getattr(self.f, name)
+
+        self.server.build_index(self.path, chunk_size=1000)
+        with mock.patch('src.zhao_nishide.zn_storage.open', create=True,
+                        side_effect=lambda *args, **kwargs: ShortReads(open(*args, **kwargs))):
+            self.assertEqual([0, 1, 3], self.server.search(self.client.srch_token('ab*')))
+            self.assertEqual([2], self.server.search(self.client.srch_token('bcd')))
+
+    def test_partial_search_over_deleted_records(self):
+        self.server.delete(self.client.del_token(0, 'abc'))
+        self.server.delete(self.client.del_token(3, 'abc'))
+        srch_token = self.client.srch_token('ab_')
+        for chunk_size in [None, 1]:
+            self.server.build_index(self.path, chunk_size=chunk_size)
+            results = []
+            cursor = 0
+            while cursor is not None:
+                result = self.server.partial_search(srch_token, filter_budget=1, cursor=cursor)
+                results += result.results
+                cursor = result.cursor
+            self.assertEqual([1], results)
+            self.assertEqual(1., result.scanned_fraction)
+
+    def test_chunk_buffer_limit(self):
+        self.server.build_index(self.path, chunk_size=1)
+        scans = [self.server.index.entries(0, 4) for _ in range(10)]
+        for scan in scans:
+            next(scan)
+        for scan in scans:
+            self.assertEqual(3, len(list(scan)))
+        self.assertEqual(MAX_CHUNK_BUFFERS, len(self.server.index._chunk_buffers))
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, length_bucket_width=2, exact_match_dictionary=True)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'index.snapshot')
+
+        self.keywords = ['abc', 'abd', 'abcde', 'abc']
+        for ind, w in zip(range(len(self.keywords)), self.keywords):
+            self.server.add(self.client.add_token(ind, w))
+        self.server.delete(self.client.del_token(1, 'abd'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_and_load(self):
+        self.server.save(self.path)
+        server = ZNServer()
+        server.load(self.path)
+        self.assertEqual(self.server.index, server.index)
+        self.assertEqual(self.server.buckets, server.buckets)
+        self.assertEqual(self.server.dictionary, server.dictionary)
+        self.assertEqual([0, 3], server.search(self.client.srch_token('abc')))
+        self.assertEqual([2], server.search(self.client.srch_token('*de')))
+
+        server.add(self.client.add_token(4, 'bcd'))
+        self.assertEqual([4], server.search(self.client.srch_token('b_d')))
+
+    def test_save_mapped_index(self):
+        mapped_server = ZNServer()
+        mapped_server.build_index(os.path.join(self.directory.name, 'index.zn'))
+        for ind, w in zip(range(len(self.keywords)), self.keywords):
+            mapped_server.add(self.client.add_token(ind, w))
+        mapped_server.save(self.path)
+        mapped_server.index.close()
+
+        self.server.load(self.path)
+        self.assertIsInstance(self.server.index, list)
+        self.assertEqual(4, len(self.server.index))
+        self.assertEqual([0, 3], self.server.search(self.client.srch_token('abc')))
+
+    def test_corrupt_snapshot(self):
+        self.server.save(self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+        with self.assertRaises(ValueError):
+            ZNServer().load(self.path)
+
+    def test_corrupt_snapshot_header(self):
+        self.server.save(self.path)
+        with open(self.path, 'r+b') as f:
+            # The last byte of the Bloom filter size
+            f.seek(9)
+            value = f.read(1)
+            f.seek(9)
+            f.write(bytes([value[0] ^ 1]))
+        with self.assertRaises(ValueError):
+            ZNServer().load(self.path)
+
+
+class TestWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, length_bucket_width=2, exact_match_dictionary=True)
+        self.client.setup(2048)
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.directory.name, 'index.log')
+        self.snapshot_path = os.path.join(self.directory.name, 'index.snapshot')
+        self.server = ZNServer()
+        self.server.build_index()
+        self.assertEqual(0, self.server.open_log(self.log_path, group_size=3))
+
+        self.keywords = ['abc', 'abd', 'abcde', 'abc']
+        for ind, w in zip(range(len(self.keywords)), self.keywords):
+            self.server.add(self.client.add_token(ind, w))
+        self.server.delete(self.client.del_token(1, 'abd'))
+
+    def tearDown(self):
+        self.server.close_log()
+        self.directory.cleanup()
+
+    def restart(self):
+        self.server.close_log()
+        server = ZNServer()
+        server.build_index()
+        if os.path.exists(self.snapshot_path):
+            server.load(self.snapshot_path)
+        replayed = server.open_log(self.log_path)
+        return server, replayed
+
+    def test_replay(self):
+        (server, replayed) = self.restart()
+        self.assertEqual(5, replayed)
+        self.assertEqual(self.server.index, server.index)
+        self.assertEqual(self.server.buckets, server.buckets)
+        self.assertEqual(self.server.dictionary, server.dictionary)
+        self.assertEqual([0, 3], server.search(self.client.srch_token('abc')))
+        server.close_log()
+
+    def test_replace(self):
+        self.server.replace([self.client.del_token(0, 'abc'), self.client.del_token(2, 'abcde')],
+                            [self.client.add_token(4, 'abc'), self.client.add_token(5, 'abcde')])
+        self.assertEqual([3, 4], self.server.search(self.client.srch_token('abc')))
+        self.assertEqual([5], self.server.search(self.client.srch_token('abc*e')))
+        (server, replayed) = self.restart()
+        self.assertEqual(9, replayed)
+        self.assertEqual(self.server.buckets, server.buckets)
+        self.assertEqual(self.server.dictionary, server.dictionary)
+        server.close_log()
+
+    def test_snapshot_truncates_log(self):
+        self.server.save(self.snapshot_path)
+        self.server.add(self.client.add_token(4, 'bcd'))
+        (server, replayed) = self.restart()
+        self.assertEqual(1, replayed)
+        self.assertEqual([4], server.search(self.client.srch_token('bcd')))
+        self.assertEqual([0, 3], server.search(self.client.srch_token('abc')))
+        server.close_log()
+
+    def test_torn_record_is_cut_off(self):
+        self.server.close_log()
+        size = os.path.getsize(self.log_path)
+        with open(self.log_path, 'ab') as f:
+            f.write(b'\x01\x00\x00\x10')
+        (server, replayed) = self.restart()
+        self.assertEqual(5, replayed)
+        self.assertEqual(size, os.path.getsize(self.log_path))
+        server.close_log()
+
+    def test_group_commit(self):
+        log = WriteAheadLog(os.path.join(self.directory.name, 'group.log'), group_size=3)
+        for i in range(4):
+            log.append_delete(bytes(32))
+        self.assertEqual(1, log.pending)
+        log.sync()
+        self.assertEqual(0, log.pending)
+        self.assertEqual(4, len(list(log.records())))
+        log.close()
+
+    def test_delayed_sync_without_appends(self):
+        log = WriteAheadLog(os.path.join(self.directory.name, 'delayed.log'), group_size=100, max_delay=.01)
+        log.append_delete(bytes(32))
+        self.assertEqual(1, log.pending)
+        timer = log._timer
+        timer.join()
+        self.assertEqual(0, log.pending)
+        self.assertIsNone(log._timer)
+        log.close()
+
+
+class TestSegments(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6)
+        self.client.setup(2048)
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = ZNServer(segment_size=2, max_segments=2, segment_directory=self.directory.name)
+        self.server.build_index()
+
+        self.keywords = ['abc', 'abd', 'bcd', 'abc', 'bcd']
+        for ind, w in zip(range(len(self.keywords)), self.keywords):
+            self.server.add(self.client.add_token(ind, w))
+        if self.server._merger is not None:
+            self.server._merger.join()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_entries_are_sealed(self):
+        self.assertEqual(2, len(self.server.segments))
+        self.assertEqual(1, len(self.server.index))
+        self.assertEqual(2, len(os.listdir(self.directory.name)))
+        self.assertEqual([0, 3], self.server.search(self.client.srch_token('abc')))
+        self.assertEqual([2, 4], self.server.search(self.client.srch_token('bcd')))
+
+    def test_delete_from_segment(self):
+        self.server.delete(self.client.del_token(0, 'abc'))
+        self.server.delete(self.client.del_token(4, 'bcd'))
+        self.assertEqual([3], self.server.search(self.client.srch_token('abc')))
+        self.assertEqual([2], self.server.search(self.client.srch_token('bcd')))
+        self.assertEqual(1., self.server.estimate(self.client.srch_token('abc'), 1.).matches)
+
+    def test_merge(self):
+        self.server.delete(self.client.del_token(0, 'abc'))
+        self.server.merge()
+        self.assertEqual(1, len(self.server.segments))
+        self.assertEqual(3, len(self.server.segments[0]))
+        self.assertEqual(1, len(os.listdir(self.directory.name)))
+        self.assertEqual([3], self.server.search(self.client.srch_token('abc')))
+        self.assertEqual([2, 4], self.server.search(self.client.srch_token('bcd')))
+
+    def test_background_merge(self):
+        self.server.add(self.client.add_token(5, 'abd'))
+        self.server._merger.join()
+        self.assertEqual(1, len(self.server.segments))
+        self.assertEqual(0, len(self.server.index))
+        self.assertEqual([1, 5], self.server.search(self.client.srch_token('abd')))
+
+    def test_failed_background_merge(self):
+        with mock.patch('src.zhao_nishide.zn_server.pack_segment', side_effect=OSError('No space left')):
+            self.server._background_merge()
+        self.assertEqual(2, len(self.server.segments))
+        with self.assertRaises(RuntimeError):
+            self.server.merge()
+        self.server.merge()
+        self.assertEqual(1, len(self.server.segments))
+
+    def test_save_and_load(self):
+        path = os.path.join(self.directory.name, 'index.snapshot')
+        self.server.save(path)
+        server = ZNServer()
+        server.load(path)
+        self.assertEqual(5, len(server.index))
+        self.assertEqual([2, 4], server.search(self.client.srch_token('bcd')))
+
+    def test_replaced_index_removes_segment_files(self):
+        path = os.path.join(self.directory.name, 'index.snapshot')
+        self.server.save(path)
+        self.server.load(path)
+        self.assertEqual(['index.snapshot'], os.listdir(self.directory.name))
+        for ind in range(4):
+            self.server.add(self.client.add_token(ind, 'abc'))
+        self.assertEqual(3, len(os.listdir(self.directory.name)))
+        self.server.build_index()
+        self.assertEqual(['index.snapshot'], os.listdir(self.directory.name))
+
+    def test_shared_segment_directory(self):
+        server = ZNServer(segment_size=2, segment_directory=self.directory.name)
+        server.build_index()
+        for ind in range(2):
+            server.add(self.client.add_token(ind, 'xyz'))
+        self.assertEqual(3, len(os.listdir(self.directory.name)))
+        self.assertEqual([0, 3], self.server.search(self.client.srch_token('abc')))
+        self.assertEqual([0, 1], server.search(self.client.srch_token('xyz')))
+
+
+class TestClientState(unittest.TestCase):
+    def setUp(self):
+        self.client = ZNClient(.01, 6, length_bucket_width=2, collect_stats=True)
+        self.client.setup(2048)
+        self.server = ZNServer()
+        self.server.build_index()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'client.state')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_precomputed_tables(self):
+        self.server.add(self.client.add_token(0, 'abc'))
+        self.client.precompute_tables()
+        self.server.add(self.client.add_token(1, 'abc'))
+        self.assertEqual([0, 1], self.server.search(self.client.srch_token('abc')))
+
+        filter_prf_calls = 1 + len(ZNClient._s_k('abc\0')) * self.client.bf_hash_functions
+        expected_prf_calls = 2 * filter_prf_calls + 2 * self.client.bf_size + self.client.bf_size
+        self.assertEqual(expected_prf_calls, self.client.stats()['counters']['add_token_prf_calls'])
+
+    def test_save_and_load(self):
+        self.client.precompute_tables()
+        self.server.add(self.client.add_token(0, 'abc'))
+        self.client.save(self.path, 'passphrase')
+
+        client = ZNClient(.1, 3)
+        client.load(self.path, 'passphrase')
+        self.assertEqual(self.client.k, client.k)
+        self.assertEqual(self.client.bf_size, client.bf_size)
+        self.assertEqual(2, client.length_bucket_width)
+        self.assertEqual(self.client._position_hashes, client._position_hashes)
+        self.assertEqual(self.client.srch_token('a_c'), client.srch_token('a_c'))
+        self.assertEqual([0], self.server.search(client.srch_token('abc')))
+
+        with self.assertRaises(ValueError):
+            ZNClient(.01, 6).load(self.path, 'wrong passphrase')
+
+
 if __name__ == '__main__':
     unittest.main()